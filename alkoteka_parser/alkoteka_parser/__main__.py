@@ -0,0 +1,255 @@
+"""Лёгкая точка входа для запусков по расписанию.
+
+    python -m alkoteka_parser run --region <uuid> --mode fast
+    python -m alkoteka_parser run --region <uuid> --mode fast --every 900
+    python -m alkoteka_parser run --jobs jobs.json
+
+В отличие от scrapy crawl не ищет scrapy.cfg и не обходит модули пауков:
+настройки берутся прямо из alkoteka_parser.settings, паук импортируется
+напрямую, а стандартные компоненты Scrapy, не нужные обходу web-api
+(telnet-консоль, контроль памяти, robots.txt, Referer, meta refresh,
+глубина и длина URL), отключены. HTML категорий не запрашивается
+(CATEGORY_SKIP_HTML). Scrapy и паук импортируются только после разбора
+аргументов.
+
+С --every или заданиями с полем every процесс не завершается и запускает
+задания по расписанию, не тратя время на повторный запуск интерпретатора и
+импорт Scrapy. Задания выполняются по очереди. jobs.json - список объектов
+с полями name, region, regions_file, start_url (строка или список), mode,
+per_page, use_proxy, every (секунды) и settings (настройки задания).
+
+Время от запуска задания до открытия паука пишется в статистику
+startup/seconds, у первого задания ещё startup/process_seconds - с момента
+импорта этого модуля.
+"""
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse
+import json
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Поверх alkoteka_parser.settings; -s в командной строке главнее
+LIGHTWEIGHT_SETTINGS = {
+    'SPIDER_MODULES': [],
+    'TELNETCONSOLE_ENABLED': False,
+    'MEMUSAGE_ENABLED': False,
+    'REFERER_ENABLED': False,
+    'METAREFRESH_ENABLED': False,
+    'CATEGORY_SKIP_HTML': True,
+}
+
+# Стандартные компоненты без отдельной настройки включения
+DISABLED_COMPONENTS = {
+    'DOWNLOADER_MIDDLEWARES': [
+        'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware',
+        'scrapy.downloadermiddlewares.httpauth.HttpAuthMiddleware',
+    ],
+    'SPIDER_MIDDLEWARES': [
+        'scrapy.spidermiddlewares.depth.DepthMiddleware',
+        'scrapy.spidermiddlewares.urllength.UrlLengthMiddleware',
+    ],
+}
+
+# Поле задания -> аргумент паука
+SPIDER_ARGS = {
+    'region': 'region_uuid',
+    'regions_file': 'regions_file',
+    'start_url': 'start_url',
+    'mode': 'mode',
+    'per_page': 'per_page',
+    'use_proxy': 'use_proxy',
+}
+
+
+def build_settings(overrides):
+    from scrapy.settings import Settings
+
+    settings = Settings()
+    settings.setmodule('alkoteka_parser.settings', priority='project')
+    settings.setdict(LIGHTWEIGHT_SETTINGS, priority='project')
+    for name, paths in DISABLED_COMPONENTS.items():
+        settings.set(name, {**settings.getdict(name), **dict.fromkeys(paths)}, priority='project')
+    settings.setdict(overrides, priority='cmdline')
+    return settings
+
+
+def spider_class(job):
+    from alkoteka_parser.spiders.alkoteka import AlkotekaProductSpider
+
+    if not job.get('settings'):
+        return AlkotekaProductSpider
+    # Свои настройки задания - через custom_settings подкласса
+    return type(AlkotekaProductSpider.__name__, (AlkotekaProductSpider,), {
+        'custom_settings': {**AlkotekaProductSpider.custom_settings, **job['settings']},
+    })
+
+
+def spider_args(job):
+    args = {}
+    for field, name in SPIDER_ARGS.items():
+        value = job.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ','.join(value)
+        args[name] = value
+    return args
+
+
+class JobRunner:
+    """Запускает задания по очереди в одном CrawlerProcess.
+
+    Задание без every выполняется один раз; когда таких не осталось,
+    реактор останавливается.
+    """
+
+    def __init__(self, process, jobs):
+        self.process = process
+        self.jobs = jobs
+        self.failed = 0
+        self._crawler = None
+        self._started = None
+        self._first = True
+
+    def run(self):
+        from twisted.internet import defer
+
+        return defer.ensureDeferred(self._run())
+
+    async def _run(self):
+        from twisted.internet import reactor, task
+
+        next_run = [0.0] * len(self.jobs)
+        while True:
+            for index, job in enumerate(self.jobs):
+                if next_run[index] is None or next_run[index] > time.monotonic():
+                    continue
+                started = time.monotonic()
+                await self._crawl(job)
+                every = job.get('every')
+                next_run[index] = started + float(every) if every else None
+
+            scheduled = [at for at in next_run if at is not None]
+            if not scheduled:
+                return
+            delay = min(scheduled) - time.monotonic()
+            if delay > 0:
+                await task.deferLater(reactor, delay)
+
+    def _crawl(self, job):
+        from scrapy import signals
+
+        name = job.get('name') or job.get('region') or 'default'
+        crawler = self.process.create_crawler(spider_class(job))
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        self._crawler = crawler
+        self._started = time.perf_counter()
+
+        d = self.process.crawl(crawler, **spider_args(job))
+        d.addCallback(lambda _: self._finished(name, crawler))
+        d.addErrback(self._failed, name)
+        return d
+
+    def spider_opened(self, spider):
+        stats = self._crawler.stats
+        now = time.perf_counter()
+        stats.set_value('startup/seconds', round(now - self._started, 3))
+        if self._first:
+            stats.set_value('startup/process_seconds', round(now - _STARTED, 3))
+            self._first = False
+
+    def _finished(self, name, crawler):
+        stats = crawler.stats
+        reason = stats.get_value('finish_reason')
+        if reason != 'finished':
+            self.failed += 1
+        logger.info(f"Job {name} finished ({reason}): {stats.get_value('item_scraped_count', 0)} item(s), "
+                    f"startup {stats.get_value('startup/seconds')}s, "
+                    f"total {time.perf_counter() - self._started:.1f}s")
+
+    def _failed(self, failure, name):
+        self.failed += 1
+        logger.error(f"Job {name} failed: {failure.getErrorMessage()}")
+
+
+def load_jobs(args):
+    if args.jobs:
+        with open(args.jobs, encoding='utf-8') as f:
+            jobs = json.load(f)
+        if not isinstance(jobs, list):
+            raise ValueError(f"{args.jobs} must contain a list of jobs")
+        return jobs
+    return [{
+        'region': args.region,
+        'regions_file': args.regions_file,
+        'start_url': args.start_url,
+        'mode': args.mode,
+        'per_page': args.per_page,
+        'use_proxy': args.use_proxy or None,
+        'every': args.every,
+    }]
+
+
+def parse_settings(values):
+    overrides = {}
+    for value in values or ():
+        name, sep, setting = value.partition('=')
+        if not sep:
+            raise ValueError(f"Invalid setting {value!r}, expected NAME=VALUE")
+        overrides[name] = setting
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m alkoteka_parser', description='Scheduled crawl runner')
+    parser.add_argument('command', choices=['run'])
+    parser.add_argument('--region', help='comma-separated city_uuid list')
+    parser.add_argument('--regions-file')
+    parser.add_argument('--start-url', action='append', help='category URL (repeatable)')
+    parser.add_argument('--mode', choices=['full', 'fast'])
+    parser.add_argument('--per-page', type=int)
+    parser.add_argument('--use-proxy', action='store_true')
+    parser.add_argument('--every', type=float, help='repeat the crawl every N seconds')
+    parser.add_argument('--jobs', help='JSON file with a list of jobs')
+    parser.add_argument('-s', '--set', action='append', metavar='NAME=VALUE', help='override a setting')
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args)
+    settings = build_settings(parse_settings(args.set))
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.reactor import install_reactor
+
+    # Реактор из настроек ставится до первого импорта twisted.internet.reactor,
+    # иначе встанет реактор по умолчанию и краулеры откажутся запускаться
+    if settings.get('TWISTED_REACTOR'):
+        install_reactor(settings['TWISTED_REACTOR'], settings.get('ASYNCIO_EVENT_LOOP'))
+
+    process = CrawlerProcess(settings)
+    runner = JobRunner(process, jobs)
+
+    from twisted.internet import reactor
+
+    def stop(result):
+        if reactor.running:
+            reactor.stop()
+        return result
+
+    def start():
+        d = runner.run()
+        d.addErrback(lambda failure: logger.error(f"Job runner failed: {failure.getErrorMessage()}"))
+        d.addBoth(stop)
+
+    # Задания стартуют в запущенном реакторе: даже мгновенная ошибка его остановит
+    reactor.callWhenRunning(start)
+    process.start(stop_after_crawl=False)
+    return 1 if runner.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Обратное давление: ограничение памяти на больших категориях.
+
+Паук не отдаёт карточки товаров в планировщик сразу, а держит их в очереди
+кортежей и подкладывает, когда в планировщике меньше половины
+BACKPRESSURE_SCHEDULER_DEPTH запросов. Если таких карточек больше
+BACKPRESSURE_PENDING_DETAILS, следующие страницы списка откладываются.
+BackpressureExtension ставит движок на паузу, пока JSONL-пайплайн не
+записал на диск больше BACKPRESSURE_WRITER_HIGH_WATER байт. Бюджет памяти
+BACKPRESSURE_MEMORY_MB уменьшает оба лимита по мере роста RSS.
+"""
+import logging
+import os
+import resource
+import time
+import weakref
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+# Лимиты общие для паука и расширения одного краулера
+_states = weakref.WeakKeyDictionary()
+
+
+def get_backpressure(crawler):
+    state = _states.get(crawler)
+    if state is None:
+        state = _states[crawler] = Backpressure(crawler.settings)
+    return state
+
+
+def current_rss():
+    """Текущий RSS процесса в байтах (на Linux), иначе пиковый."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Backpressure:
+    """Лимиты глубины планировщика и очереди записи с поправкой на память.
+
+    Пока RSS меньше 70% бюджета, действуют заданные лимиты; от 70% до 100%
+    бюджета они линейно уменьшаются до 10%.
+    """
+
+    def __init__(self, settings):
+        self.max_scheduler_depth = max(1, settings.getint('BACKPRESSURE_SCHEDULER_DEPTH', 1000))
+        self.max_pending_details = max(1, settings.getint('BACKPRESSURE_PENDING_DETAILS', 20000))
+        self.max_writer_bytes = max(1, settings.getint('BACKPRESSURE_WRITER_HIGH_WATER', 32 * 1024 * 1024))
+        self.memory_budget = settings.getint('BACKPRESSURE_MEMORY_MB', 0) * 1024 * 1024
+        self.scale = 1.0
+
+    @property
+    def scheduler_depth(self):
+        return max(1, int(self.max_scheduler_depth * self.scale))
+
+    @property
+    def pending_details(self):
+        return max(1, int(self.max_pending_details * self.scale))
+
+    @property
+    def writer_high_water(self):
+        return max(1, int(self.max_writer_bytes * self.scale))
+
+    def update(self, rss):
+        if not self.memory_budget:
+            return
+        usage = rss / self.memory_budget
+        self.scale = min(1.0, max(0.1, 0.1 + 0.9 * (1.0 - usage) / 0.3))
+
+
+class BackpressureExtension:
+    """Пауза движка, пока очередь записи товаров выше порога.
+
+    Раз в BACKPRESSURE_INTERVAL секунд пересчитывает лимиты по RSS и
+    сравнивает pending_bytes JSONL-пайплайна с порогом; движок продолжает
+    работу, когда очередь записи спадает вдвое. Пользуется только
+    engine.pause()/unpause() и статистикой. По RSS движок не
+    останавливается: Python редко возвращает память системе, и пауза могла
+    бы не закончиться никогда.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('BACKPRESSURE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.state = get_backpressure(crawler)
+        self.interval = settings.getfloat('BACKPRESSURE_INTERVAL', 1.0)
+        self.writer = None
+        self._paused_at = None
+        self._loop = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        pipelines = getattr(self.crawler.engine.scraper.itemproc, 'middlewares', ())
+        self.writer = next((p for p in pipelines if hasattr(p, 'pending_bytes')), None)
+        self._loop = task.LoopingCall(self._check)
+        self._loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        if self._paused_at is not None:
+            self._resume()
+
+    def _check(self):
+        rss = current_rss()
+        self.state.update(rss)
+        self.stats.max_value('backpressure/rss_max_mb', rss // (1024 * 1024))
+        self.stats.min_value('backpressure/scale_min', round(self.state.scale, 2))
+
+        pending = self.writer.pending_bytes if self.writer is not None else 0
+        engine = self.crawler.engine
+        if self._paused_at is None:
+            if pending > self.state.writer_high_water and not engine.paused:
+                engine.pause()
+                self._paused_at = time.monotonic()
+                self.stats.inc_value('backpressure/pauses')
+                logger.info(f"Pausing crawl: {pending} bytes waiting to be written")
+        elif pending <= self.state.writer_high_water // 2:
+            self._resume()
+
+    def _resume(self):
+        # Обход продолжится с ближайшим тактом движка (раз в 5 секунд)
+        self.stats.inc_value('backpressure/paused_seconds', round(time.monotonic() - self._paused_at, 3))
+        self._paused_at = None
+        self.crawler.engine.unpause()
@@ -0,0 +1,291 @@
+"""Распределённый обход: общая очередь шардов и множество загруженных товаров.
+
+Шард - одна страница списка товаров (регион, категория, страница).
+Координатор кладёт в очередь первые страницы, воркер, обработавший первую
+страницу, добавляет остальные. Воркеры (обычные процессы паука с
+DISTRIBUTED_ENABLED) берут шарды в аренду. Каждый товар загружается только
+тем воркером, который первым занял его slug. Воркер пишет свой JSONL-файл,
+координатор в конце сливает их в один.
+
+Очередь - SQLite-файл для многих процессов на одной машине:
+
+    python -m alkoteka_parser.distributed seed --queue product_data/queue.sqlite3
+    scrapy crawl alkoteka -s DISTRIBUTED_ENABLED=True   # в N процессах
+    python -m alkoteka_parser.distributed status --queue product_data/queue.sqlite3
+    python -m alkoteka_parser.distributed merge --queue product_data/queue.sqlite3 \\
+        --output product_data/all_products.jsonl
+"""
+import argparse
+import glob
+import json
+import os
+import socket
+import sqlite3
+import time
+
+DEFAULT_CATEGORIES = ['krepkiy-alkogol', 'slaboalkogolnye-napitki-2', 'vino']
+DEFAULT_REGION = '4a70f9e0-46ae-11e7-83ff-00155d026416'
+
+
+def worker_id(settings):
+    return settings.get('DISTRIBUTED_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def output_path(settings):
+    return settings.get(
+        'DISTRIBUTED_OUTPUT_PATTERN', 'product_data/shards/products-{worker}.jsonl'
+    ).format(worker=worker_id(settings))
+
+
+class ShardQueue:
+    """Очередь шардов в SQLite, общая для процессов одной машины.
+
+    Шард берётся в аренду на lease_timeout секунд; воркер продлевает аренду,
+    пока обрабатывает шард. Шард упавшего воркера по истечении аренды
+    достаётся другому, а занятые упавшим воркером товары освобождаются.
+    Обращения к базе идут по шардам и страницам, а не по товарам, чтобы
+    процессы не упирались в блокировку записи.
+    """
+
+    def __init__(self, path, worker=None, lease_timeout=300.0, max_attempts=3):
+        self.path = path
+        self.worker = worker
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._conn = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('DISTRIBUTED_QUEUE_PATH', 'product_data/queue.sqlite3'),
+            worker=worker_id(settings),
+            lease_timeout=settings.getfloat('DISTRIBUTED_LEASE_TIMEOUT', 300.0),
+            max_attempts=settings.getint('DISTRIBUTED_MAX_ATTEMPTS', 3),
+        )
+
+    def open(self):
+        if self._conn is not None:
+            return self
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Транзакции открываются явно (BEGIN IMMEDIATE), ожидание блокировки до 30 с
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                region TEXT NOT NULL,
+                category TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                leased_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (region, category, page)
+            );
+            CREATE INDEX IF NOT EXISTS shards_state ON shards (state, page);
+            CREATE TABLE IF NOT EXISTS seen (
+                region TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                shard_id INTEGER NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (region, slug)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS seen_shard ON seen (shard_id);
+        """)
+        return self
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._conn.close()
+        self._conn = None
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    def seed(self, regions, categories, per_page):
+        """Новый обход: очищает очередь и кладёт первые страницы."""
+        with self._transaction():
+            for table in ('shards', 'seen', 'meta'):
+                self._conn.execute(f'DELETE FROM {table}')
+            self._conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+                ('per_page', str(per_page)), ('seeded_at', str(time.time())),
+            ])
+            self._conn.executemany(
+                'INSERT INTO shards (region, category, page) VALUES (?, ?, 1)',
+                [(region, category) for region in regions for category in categories]
+            )
+
+    def get_meta(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def lease(self, limit):
+        """Берёт в аренду до limit шардов; первые страницы выдаются раньше."""
+        now = time.time()
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT id, region, category, page, state FROM shards "
+                "WHERE state = 'pending' OR (state = 'leased' AND leased_at < ?) "
+                "ORDER BY page, id LIMIT ?",
+                (now - self.lease_timeout, limit)
+            ).fetchall()
+            for shard_id, _, _, _, state in rows:
+                if state == 'leased':
+                    # Аренда упавшего воркера: его незавершённые товары свободны
+                    self._conn.execute('DELETE FROM seen WHERE shard_id = ? AND done = 0', (shard_id,))
+            self._conn.executemany(
+                "UPDATE shards SET state = 'leased', worker = ?, leased_at = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                [(self.worker, now, row[0]) for row in rows]
+            )
+        return [row[:4] for row in rows]
+
+    def renew(self, shard_ids):
+        if not shard_ids:
+            return
+        with self._transaction():
+            self._conn.executemany(
+                "UPDATE shards SET leased_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                [(time.time(), shard_id, self.worker) for shard_id in shard_ids]
+            )
+
+    def add_pages(self, region, category, pages):
+        with self._transaction():
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO shards (region, category, page) VALUES (?, ?, ?)',
+                [(region, category, page) for page in pages]
+            )
+
+    def claim(self, shard_id, region, slugs):
+        """Занимает товары для загрузки; возвращает slug, которые достались шарду."""
+        with self._transaction():
+            claimed = []
+            for slug in slugs:
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO seen (region, slug, shard_id) VALUES (?, ?, ?)',
+                    (region, slug, shard_id)
+                )
+                if cursor.rowcount:
+                    claimed.append(slug)
+                else:
+                    # Повторная обработка своего же шарда (после аренды)
+                    owner = self._conn.execute(
+                        'SELECT shard_id FROM seen WHERE region = ? AND slug = ?', (region, slug)
+                    ).fetchone()
+                    if owner and owner[0] == shard_id:
+                        claimed.append(slug)
+        return claimed
+
+    def complete(self, shard_id):
+        with self._transaction():
+            self._conn.execute("UPDATE shards SET state = 'done' WHERE id = ?", (shard_id,))
+            self._conn.execute('UPDATE seen SET done = 1 WHERE shard_id = ?', (shard_id,))
+
+    def fail(self, shard_id):
+        """Шард не обработан: вернуть в очередь или, после max_attempts, бросить."""
+        with self._transaction():
+            self._conn.execute(
+                "UPDATE shards SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL WHERE id = ?",
+                (self.max_attempts, shard_id)
+            )
+
+    def counts(self):
+        return dict(self._conn.execute('SELECT state, COUNT(*) FROM shards GROUP BY state').fetchall())
+
+    def finished(self):
+        counts = self.counts()
+        return not counts.get('pending') and not counts.get('leased')
+
+
+class _Transaction:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def merge(paths, output):
+    """Сливает файлы воркеров в один JSONL, по одной строке на (регион, RPC)."""
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    seen = set()
+    written = 0
+    with open(f'{output}.part', 'wb') as out:
+        for path in paths:
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        continue
+                    item = json.loads(line)
+                    key = (item.get('region'), item.get('RPC'))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    out.write(line)
+                    written += 1
+    os.replace(f'{output}.part', output)
+    return written
+
+
+def _regions(args):
+    regions = [r.strip() for r in (args.region or '').split(',') if r.strip()]
+    if args.regions_file:
+        with open(args.regions_file, encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    regions.append(line)
+    return list(dict.fromkeys(regions)) or [DEFAULT_REGION]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed crawl coordinator')
+    parser.add_argument('command', choices=['seed', 'status', 'merge'])
+    parser.add_argument('--queue', default='product_data/queue.sqlite3')
+    parser.add_argument('--region', help='comma-separated city_uuid list')
+    parser.add_argument('--regions-file')
+    parser.add_argument('--category', action='append', help='category slug (repeatable)')
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--shards', default='product_data/shards/products-*.jsonl*',
+                        help='worker output files to merge (glob, .part of stopped workers included)')
+    parser.add_argument('--output', default='product_data/all_products.jsonl')
+    args = parser.parse_args(argv)
+
+    queue = ShardQueue(args.queue).open()
+    try:
+        if args.command == 'seed':
+            regions = _regions(args)
+            categories = args.category or DEFAULT_CATEGORIES
+            queue.seed(regions, categories, args.per_page)
+            print(f"Seeded {len(regions) * len(categories)} shard(s) into {args.queue}")
+        elif args.command == 'status':
+            print(json.dumps(queue.counts()))
+        else:
+            if not queue.finished():
+                print(f"Warning: queue is not finished: {queue.counts()}")
+            paths = sorted(glob.glob(args.shards))
+            written = merge(paths, args.output)
+            print(f"Merged {len(paths)} file(s) into {args.output}: {written} product(s)")
+    finally:
+        queue.close()
+
+
+if __name__ == '__main__':
+    main()
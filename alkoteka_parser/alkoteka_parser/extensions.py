@@ -0,0 +1,196 @@
+import logging
+import os
+import socket
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from alkoteka_parser.metrics import get_registry
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsExtension:
+    """Собирает метрики загрузчика и выгружает реестр метрик.
+
+    Время загрузки пишется по типу запроса (meta['endpoint']) и прокси:
+    сетевое время ответа (download_latency) и полное время в загрузчике
+    вместе с ожиданием в слоте. Раз в METRICS_INTERVAL секунд снимаются
+    глубина очереди планировщика, число запросов в загрузчике и в разборе.
+    Реестр выгружается в файл METRICS_SNAPSHOT_PATH, отдаётся по HTTP на
+    METRICS_PORT (/metrics) и/или отправляется по UDP на METRICS_STATSD_ADDRESS.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.registry = get_registry(crawler)
+        self.interval = settings.getfloat('METRICS_INTERVAL', 10.0)
+        self.snapshot_path = settings.get('METRICS_SNAPSHOT_PATH')
+        self.snapshot_format = settings.get('METRICS_SNAPSHOT_FORMAT', 'prometheus')
+        if self.snapshot_format not in ('prometheus', 'statsd'):
+            raise ValueError(f"Unknown METRICS_SNAPSHOT_FORMAT: {self.snapshot_format}")
+        self.port = settings.getint('METRICS_PORT', 0)
+        self.host = settings.get('METRICS_HOST', '127.0.0.1')
+        self.statsd_address = self._parse_address(settings.get('METRICS_STATSD_ADDRESS'))
+
+        self._loop = None
+        self._listening = None
+        self._socket = None
+
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.item_dropped, signal=signals.item_dropped)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    @staticmethod
+    def _parse_address(address):
+        if not address:
+            return None
+        host, _, port = str(address).rpartition(':')
+        return host or '127.0.0.1', int(port)
+
+    def spider_opened(self, spider):
+        if self.statsd_address:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+        if self.port:
+            self._listen()
+        if self.interval > 0:
+            self._loop = task.LoopingCall(self.export)
+            self._loop.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        self.export()
+        if self._listening is not None:
+            self._listening.stopListening()
+        if self._socket is not None:
+            self._socket.close()
+
+        # Краткая сводка по времени колбэков и загрузок остаётся в статистике
+        stats = self.crawler.stats
+        for (name, labels), histogram in self.registry.histograms.items():
+            if name not in ('callback_seconds', 'download_latency_seconds'):
+                continue
+            label = '/'.join(str(value) for _, value in labels)
+            stats.set_value(f'metrics/{name}/{label}/p50_ms', round(histogram.quantile(0.5) * 1000, 3))
+            stats.set_value(f'metrics/{name}/{label}/p99_ms', round(histogram.quantile(0.99) * 1000, 3))
+
+    def request_reached_downloader(self, request, spider):
+        request.meta['metrics_downloader_started'] = time.perf_counter()
+
+    def response_received(self, response, request, spider):
+        endpoint = request.meta.get('endpoint', 'other')
+        proxy = request.meta.get('proxy') or 'direct'
+        self.registry.inc('responses_total', endpoint=endpoint, status=response.status)
+
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.registry.observe('download_latency_seconds', latency, endpoint=endpoint, proxy=proxy)
+        started = request.meta.get('metrics_downloader_started')
+        if started is not None:
+            self.registry.observe(
+                'downloader_seconds', time.perf_counter() - started, endpoint=endpoint, proxy=proxy
+            )
+
+    def item_scraped(self, item, spider):
+        self.registry.inc('items_total', status='scraped')
+
+    def item_dropped(self, item, spider, exception):
+        self.registry.inc('items_total', status='dropped')
+
+    def collect(self):
+        engine = self.crawler.engine
+        if engine is None:
+            return
+        registry = self.registry
+
+        slot = getattr(engine, '_slot', None)
+        if slot is not None and slot.scheduler is not None:
+            registry.set('scheduler_queue_depth', len(slot.scheduler))
+        registry.set('downloader_in_flight', len(engine.downloader.active))
+        registry.set('scraper_in_progress', len(engine.scraper.slot.active) if engine.scraper.slot else 0)
+        registry.set('items_in_pipelines', engine.scraper.slot.itemproc_size if engine.scraper.slot else 0)
+
+        # Слоты загрузчика появляются и исчезают, поэтому их значения
+        # пересобираются целиком
+        for name in ('slot_queue', 'slot_transferring', 'slot_concurrency', 'slot_delay'):
+            registry.clear_gauges(name)
+        for key, download_slot in engine.downloader.slots.items():
+            registry.set('slot_queue', len(download_slot.queue), slot=key)
+            registry.set('slot_transferring', len(download_slot.transferring), slot=key)
+            registry.set('slot_concurrency', download_slot.concurrency, slot=key)
+            registry.set('slot_delay', download_slot.delay, slot=key)
+
+    def export(self):
+        try:
+            self.collect()
+            if self.snapshot_path:
+                self._write_snapshot()
+            if self._socket is not None:
+                self._send_statsd()
+        except Exception as e:
+            logger.error(f"Error exporting metrics: {e}")
+
+    def _write_snapshot(self):
+        if self.snapshot_format == 'statsd':
+            text = self.registry.render_statsd()
+        else:
+            text = self.registry.render_prometheus()
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.snapshot_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _send_statsd(self):
+        # Строки собираются в пакеты, которые не дробятся по MTU
+        packet = []
+        size = 0
+        for line in self.registry.render_statsd().splitlines():
+            if packet and size + len(line) + 1 > 1400:
+                self._send_packet(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send_packet(packet)
+
+    def _send_packet(self, lines):
+        try:
+            self._socket.sendto('\n'.join(lines).encode('utf-8'), self.statsd_address)
+        except OSError as e:
+            logger.debug(f"Error sending metrics to StatsD: {e}")
+
+    def _listen(self):
+        from twisted.internet import reactor
+        from twisted.web import resource, server
+
+        extension = self
+
+        class MetricsResource(resource.Resource):
+            isLeaf = True
+
+            def render_GET(self, request):
+                extension.collect()
+                request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+                return extension.registry.render_prometheus().encode('utf-8')
+
+        root = resource.Resource()
+        root.putChild(b'metrics', MetricsResource())
+        self._listening = reactor.listenTCP(self.port, server.Site(root), interface=self.host)
+        logger.info(f"Metrics are available at http://{self.host}:{self.port}/metrics")
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import time
+import weakref
+
+# Фронтир общий для паука и пайплайнов одного краулера
+_frontiers = weakref.WeakKeyDictionary()
+
+
+def get_frontier(crawler):
+    frontier = _frontiers.get(crawler)
+    if frontier is None:
+        frontier = Frontier(crawler.settings.get('RESUME_STATE_PATH', 'product_data/frontier.sqlite3'))
+        _frontiers[crawler] = frontier
+    return frontier
+
+
+def frontier_scope(spider):
+    """Обход продолжается, только если набор категорий и регионов тот же."""
+    return '|'.join([
+        ','.join(sorted(spider.start_urls)),
+        ','.join(sorted(getattr(spider, 'region_uuids', []))),
+    ])
+
+
+class Frontier:
+    """Состояние обхода на диске для продолжения после падения.
+
+    Хранит по (регион, категория) окно пагинации и обработанные страницы
+    списка, очередь ещё не обработанных карточек товаров и (регион, RPC) уже
+    записанных товаров. Очередь карточек читается пачками по курсору, поэтому
+    в памяти её нет, сколько бы товаров ни ждало загрузки.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.scope = None
+        self.run_id = None
+        self.resumed = False
+        self._conn = None
+        self._cursor = 0
+
+    def open(self, scope):
+        """Открывает хранилище; продолжает незавершённый обход с тем же scope."""
+        if self._conn is not None:
+            return self
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS categories (
+                region TEXT NOT NULL,
+                category TEXT NOT NULL,
+                next_page INTEGER NOT NULL,
+                last_page INTEGER,
+                PRIMARY KEY (region, category)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                region TEXT NOT NULL,
+                category TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                PRIMARY KEY (region, category, page)
+            );
+            CREATE TABLE IF NOT EXISTS pending (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                region TEXT NOT NULL,
+                category TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                rpc TEXT NOT NULL,
+                from_list INTEGER NOT NULL DEFAULT 0,
+                UNIQUE (region, slug)
+            );
+            CREATE INDEX IF NOT EXISTS pending_rpc ON pending (region, rpc);
+            CREATE TABLE IF NOT EXISTS done (
+                region TEXT NOT NULL,
+                rpc TEXT NOT NULL,
+                PRIMARY KEY (region, rpc)
+            ) WITHOUT ROWID;
+        """)
+
+        meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+        self.scope = scope
+        self.resumed = meta.get('state') == 'running' and meta.get('scope') == scope
+        if self.resumed:
+            self.run_id = int(meta['run_id'])
+            # Товары, собранные из списка и не дошедшие до записи, в этот раз
+            # загружаются отдельными запросами карточек
+            self._conn.execute('UPDATE pending SET from_list = 0')
+        else:
+            self.run_id = int(time.time() * 1000)
+            for table in ('categories', 'pages', 'pending', 'done', 'meta'):
+                self._conn.execute(f'DELETE FROM {table}')
+            self._conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+                ('state', 'running'), ('scope', scope), ('run_id', str(self.run_id)),
+            ])
+        self._conn.commit()
+        return self
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+
+    def finish(self):
+        """Обход завершён: следующий запуск начнётся с начала."""
+        self._conn.execute("UPDATE meta SET value = 'finished' WHERE key = 'state'")
+        self._conn.commit()
+
+    def categories(self):
+        return self._conn.execute(
+            'SELECT region, category, next_page, last_page FROM categories'
+        ).fetchall()
+
+    def done_pages(self, region, category):
+        return {row[0] for row in self._conn.execute(
+            'SELECT page FROM pages WHERE region = ? AND category = ?', (region, category)
+        )}
+
+    def save_category(self, region, category, next_page, last_page):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO categories (region, category, next_page, last_page) VALUES (?, ?, ?, ?)',
+            (region, category, next_page, last_page)
+        )
+        self._conn.commit()
+
+    def page_done(self, region, category, page, products, next_page, last_page):
+        """Одной транзакцией: товары страницы в очередь, страница обработана.
+
+        products - тройки (slug, RPC, from_list); from_list - товар уже собран
+        из ответа списка и ждёт только записи. Уже записанные товары в очередь
+        не попадают.
+        """
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO pending (region, category, slug, rpc, from_list) '
+                'SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM done WHERE region = ? AND rpc = ?)',
+                [(region, category, slug, rpc, int(from_list), region, rpc) for slug, rpc, from_list in products]
+            )
+            self._conn.execute(
+                'INSERT OR IGNORE INTO pages (region, category, page) VALUES (?, ?, ?)',
+                (region, category, page)
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO categories (region, category, next_page, last_page) VALUES (?, ?, ?, ?)',
+                (region, category, next_page, last_page)
+            )
+
+    def next_batch(self, limit):
+        """Следующие карточки очереди, ещё не выданные в этом запуске."""
+        rows = self._conn.execute(
+            'SELECT id, region, category, slug, rpc FROM pending '
+            'WHERE id > ? AND from_list = 0 ORDER BY id LIMIT ?',
+            (self._cursor, limit)
+        ).fetchall()
+        if rows:
+            self._cursor = rows[-1][0]
+        return [row[1:] for row in rows]
+
+    def complete(self, keys):
+        """Товары (регион, RPC) записаны или не требуют записи."""
+        keys = [key for key in keys if key[1]]
+        if not keys:
+            return
+        with self._conn:
+            self._conn.executemany('DELETE FROM pending WHERE region = ? AND rpc = ?', keys)
+            self._conn.executemany('INSERT OR IGNORE INTO done (region, rpc) VALUES (?, ?)', keys)
+
+    def is_done(self, region, rpc):
+        return self._conn.execute(
+            'SELECT 1 FROM done WHERE region = ? AND rpc = ?', (region, rpc)
+        ).fetchone() is not None
+
+    def pending_count(self):
+        return self._conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
@@ -0,0 +1,164 @@
+"""Загрузка запросов web-api через httpx по HTTP/2.
+
+Карточки товаров - небольшие JSON-ответы одного хоста. HttpxDownloadHandler
+отправляет запросы с meta['endpoint'] из HTTP2_ENDPOINTS через пул
+постоянных соединений httpx: по HTTP/2 (ALPN) много запросов идут по одному
+соединению без новых TLS-рукопожатий. Остальные запросы, а также все
+запросы без httpx или без asyncio-реактора уходят обычному
+HTTP11DownloadHandler. Подключается через DOWNLOAD_HANDLERS:
+
+    scrapy crawl alkoteka -s 'DOWNLOAD_HANDLERS={"https": "alkoteka_parser.http2.HttpxDownloadHandler"}'
+
+Нужен пакет httpx[http2].
+"""
+import logging
+import time
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.reactor import is_asyncio_reactor_installed
+from twisted.internet import defer, error
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+class HttpxDownloadHandler:
+    """Обработчик загрузки с пулом HTTP/2-соединений httpx.
+
+    На каждый прокси (meta['proxy'], с Proxy-Authorization от
+    HttpProxyMiddleware) свой клиент и свой пул не больше
+    HTTP2_MAX_CONNECTIONS соединений. Число TCP-соединений и
+    TLS-рукопожатий видно в статистике http2/connections и
+    http2/tls_handshakes.
+    """
+
+    lazy = False
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.fallback = HTTP11DownloadHandler.from_crawler(crawler)
+        self.endpoints = set(settings.getlist('HTTP2_ENDPOINTS', ['detail']))
+        self.max_connections = max(1, settings.getint('HTTP2_MAX_CONNECTIONS', 4))
+        # Как и обычный обработчик Scrapy, по умолчанию сертификаты не проверяются
+        self.verify = settings.getbool('HTTP2_VERIFY_CERTIFICATES', False)
+        self.default_timeout = settings.getfloat('DOWNLOAD_TIMEOUT', 180)
+        self.default_maxsize = settings.getint('DOWNLOAD_MAXSIZE', 0)
+        self._clients = {}
+
+        self.enabled = True
+        if httpx is None:
+            logger.warning("httpx is not installed, HTTP/2 requests fall back to HTTP/1.1")
+            self.enabled = False
+        elif not is_asyncio_reactor_installed():
+            logger.warning("HTTP/2 requests need the asyncio reactor, falling back to HTTP/1.1")
+            self.enabled = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider):
+        if not self.enabled or request.meta.get('endpoint') not in self.endpoints:
+            return self.fallback.download_request(request, spider)
+        return deferred_from_coro(self._download(request))
+
+    def _client(self, proxy, proxy_auth):
+        key = (proxy, proxy_auth)
+        client = self._clients.get(key)
+        if client is None:
+            proxy_config = None
+            if proxy:
+                proxy_headers = {'Proxy-Authorization': proxy_auth.decode('latin-1')} if proxy_auth else None
+                proxy_config = httpx.Proxy(proxy, headers=proxy_headers)
+            client = self._clients[key] = httpx.AsyncClient(
+                http2=True,
+                verify=self.verify,
+                proxy=proxy_config,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                trust_env=False,
+            )
+        return client
+
+    async def _trace(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            self.stats.inc_value('http2/connections')
+        elif event_name == 'connection.start_tls.complete':
+            self.stats.inc_value('http2/tls_handshakes')
+
+    async def _download(self, request):
+        headers = Headers(request.headers)
+        # Учётные данные прокси HttpProxyMiddleware кладёт в заголовок запроса,
+        # httpx передаёт их прокси сам
+        proxy_auth = headers.pop(b'Proxy-Authorization', None)
+        if isinstance(proxy_auth, list):
+            proxy_auth = proxy_auth[0] if proxy_auth else None
+        client = self._client(request.meta.get('proxy'), proxy_auth)
+        timeout = request.meta.get('download_timeout', self.default_timeout)
+        maxsize = request.meta.get('download_maxsize', self.default_maxsize)
+
+        started = time.time()
+        try:
+            async with client.stream(
+                request.method,
+                request.url,
+                headers=[(name, value) for name, values in headers.items() for value in values],
+                content=request.body or None,
+                timeout=timeout,
+                extensions={'trace': self._trace},
+            ) as response:
+                chunks = []
+                size = 0
+                # Тело без распаковки: Content-Encoding снимает HttpCompressionMiddleware
+                async for chunk in response.aiter_raw():
+                    size += len(chunk)
+                    if maxsize and size > maxsize:
+                        raise defer.CancelledError(
+                            f"Cancelling download of {request.url}: received response size ({size}) "
+                            f"larger than download max size ({maxsize})."
+                        )
+                    chunks.append(chunk)
+        except httpx.TimeoutException:
+            raise error.TimeoutError(f"Getting {request.url} took longer than {timeout} seconds.")
+        except (httpx.ConnectError, httpx.ProxyError) as e:
+            raise error.ConnectError(string=f"{type(e).__name__}: {e}")
+        except httpx.TransportError as e:
+            raise error.ConnectionLost(f"{type(e).__name__}: {e}")
+        request.meta['download_latency'] = time.time() - started
+        self.stats.inc_value(f"http2/responses/{response.http_version}")
+
+        response_headers = Headers()
+        for name, value in response.headers.raw:
+            response_headers.appendlist(name, value)
+        body = b''.join(chunks)
+        respcls = responsetypes.from_args(headers=response_headers, url=request.url, body=body)
+        return respcls(
+            url=request.url,
+            status=response.status_code,
+            headers=response_headers,
+            body=body,
+            request=request,
+            protocol=response.http_version,
+        )
+
+    async def _close_clients(self, clients):
+        for client in clients:
+            await client.aclose()
+
+    def close(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        d = self.fallback.close()
+        if clients:
+            d.addCallback(lambda _: deferred_from_coro(self._close_clients(clients)))
+        return d
@@ -0,0 +1,143 @@
+"""HTTP-кэш страниц категорий и списков товаров.
+
+Включается HTTPCACHE_ENABLED=True. Срок свежести задаётся по типу запроса
+(meta['endpoint']) в HTTPCACHE_ENDPOINT_TTL: долгий для HTML категорий,
+короткий для списков; с нулевым сроком (по умолчанию у карточек) кэш
+обходится. Устаревший ответ перепроверяется условным запросом, если у него
+есть ETag/Last-Modified. Ответы хранятся на диске в сжатом виде, при
+превышении HTTPCACHE_MAX_BYTES удаляются давно не использованные.
+"""
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import FilesystemCacheStorage, RFC2616Policy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT_TTL = {'category': 86400, 'list': 900, 'detail': 0}
+
+
+class EndpointTTLPolicy(RFC2616Policy):
+    """RFC2616Policy, у которой срок свежести задаётся типом запроса.
+
+    API не отдаёт Cache-Control и Expires, поэтому срок берётся из
+    HTTPCACHE_ENDPOINT_TTL; запросы без известного типа кэшируются по
+    обычным правилам RFC 2616.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttls = {**DEFAULT_ENDPOINT_TTL, **settings.getdict('HTTPCACHE_ENDPOINT_TTL')}
+
+    def _ttl(self, request):
+        return self.ttls.get(request.meta.get('endpoint'))
+
+    def should_cache_request(self, request):
+        ttl = self._ttl(request)
+        if ttl is not None and ttl <= 0:
+            return False
+        return super().should_cache_request(request)
+
+    def should_cache_response(self, response, request):
+        if self._ttl(request) is None:
+            return super().should_cache_response(response, request)
+        return response.status == 200 and b'no-store' not in self._parse_cachecontrol(response)
+
+    def _compute_freshness_lifetime(self, response, request, now):
+        ttl = self._ttl(request)
+        if ttl is None:
+            return super()._compute_freshness_lifetime(response, request, now)
+        return ttl
+
+
+class LRUFilesystemCacheStorage(FilesystemCacheStorage):
+    """FilesystemCacheStorage с ограничением размера кэша.
+
+    Время последнего использования записи - mtime её pickled_meta, оно
+    обновляется при каждом чтении. Когда размер кэша превышает
+    HTTPCACHE_MAX_BYTES, давно не использованные записи удаляются, пока
+    размер не опустится до 90% лимита. Сжатие - HTTPCACHE_GZIP.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES', 0)
+        self.stats = None
+        # Путь записи -> размер, от давно использованных к недавним
+        self._entries = OrderedDict()
+        self._total = 0
+
+    def open_spider(self, spider):
+        super().open_spider(spider)
+        self.stats = spider.crawler.stats
+        self._entries.clear()
+        self._total = 0
+        entries = []
+        for meta_path in Path(self.cachedir, spider.name).glob('*/*/pickled_meta'):
+            try:
+                entries.append((meta_path.stat().st_mtime, str(meta_path.parent), self._size(meta_path.parent)))
+            except OSError:
+                continue
+        for _, path, size in sorted(entries):
+            self._entries[path] = size
+            self._total += size
+        self.stats.set_value('httpcache/bytes', self._total)
+        logger.info(f"HTTP cache: {len(self._entries)} entries, {self._total} bytes in {self.cachedir}")
+
+    def retrieve_response(self, spider, request):
+        response = super().retrieve_response(spider, request)
+        if response is not None:
+            path = self._get_request_path(spider, request)
+            try:
+                os.utime(os.path.join(path, 'pickled_meta'))
+            except OSError:
+                pass
+            if path in self._entries:
+                self._entries.move_to_end(path)
+        return response
+
+    def store_response(self, spider, request, response):
+        super().store_response(spider, request, response)
+        path = self._get_request_path(spider, request)
+        self._total -= self._entries.pop(path, 0)
+        size = self._size(Path(path))
+        self._entries[path] = size
+        self._total += size
+        if self.max_bytes and self._total > self.max_bytes:
+            self._evict(int(self.max_bytes * 0.9))
+        self.stats.set_value('httpcache/bytes', self._total)
+
+    def _evict(self, target):
+        evicted = 0
+        while self._entries and self._total > target:
+            path, size = self._entries.popitem(last=False)
+            shutil.rmtree(path, ignore_errors=True)
+            self._total -= size
+            evicted += 1
+        self.stats.inc_value('httpcache/evicted', evicted)
+
+    @staticmethod
+    def _size(path):
+        return sum(entry.stat().st_size for entry in path.iterdir() if entry.is_file())
+
+
+class EndpointHttpCacheMiddleware(HttpCacheMiddleware):
+    """HttpCacheMiddleware со статистикой httpcache/<endpoint>/hit|stale|miss."""
+
+    def process_request(self, request, spider):
+        response = super().process_request(request, spider)
+        if request.meta.get('dont_cache') or request.meta.get('_dont_cache'):
+            return response
+
+        if response is not None:
+            status = 'hit'
+        elif 'cached_response' in request.meta:
+            status = 'stale'
+        else:
+            status = 'miss'
+        self.stats.inc_value(f"httpcache/{request.meta.get('endpoint', 'other')}/{status}")
+        return response
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import weakref
+
+from scrapy.exceptions import IgnoreRequest
+
+# Хранилище общее для пайплайна и middleware одного краулера
+_stores = weakref.WeakKeyDictionary()
+
+
+def get_store(crawler):
+    store = _stores.get(crawler)
+    if store is None:
+        store = FingerprintStore(
+            crawler.settings.get('INCREMENTAL_STORE_PATH', 'product_data/incremental.sqlite3')
+        )
+        _stores[crawler] = store
+    return store
+
+
+class NotModified(IgnoreRequest):
+    """Карточка товара не изменилась с прошлого запуска (ответ 304)."""
+
+
+def item_fingerprint(item):
+    # timestamp меняется в каждом запуске и в сравнении не участвует
+    data = {k: v for k, v in item.items() if k != 'timestamp'}
+    raw = json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+class FingerprintStore:
+    """SQLite-хранилище отпечатков товаров по ключу (region_uuid, RPC).
+
+    Помимо хеша содержимого хранит номер запуска, в котором товар видели
+    последним, и валидаторы (ETag/Last-Modified) карточек товаров.
+    Отпечатки новых и изменившихся товаров и новые валидаторы копятся в
+    памяти и попадают в хранилище в save(), когда товары записаны в вывод;
+    discard() и close() их отбрасывают.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self._conn = None
+        self._uncommitted = 0
+        # (регион, RPC) -> (хеш, scope) и URL -> (регион, RPC, ETag, Last-Modified)
+        self._staged = {}
+        self._staged_validators = {}
+
+    def open(self):
+        if self._conn is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                region TEXT NOT NULL,
+                rpc TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                last_seen INTEGER NOT NULL,
+                PRIMARY KEY (region, rpc)
+            );
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                region TEXT NOT NULL,
+                rpc TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT
+            );
+        """)
+        self.run_id = int(time.time() * 1000)
+
+    def close(self):
+        self.discard()
+        if self._conn is None:
+            return
+        self._conn.commit()
+        self._conn.close()
+        self._conn = None
+
+    def check(self, region, rpc, digest, scope):
+        """Отмечает товар как увиденный; возвращает 'new', 'changed' или 'unchanged'.
+
+        Хеш нового или изменившегося товара откладывается до save().
+        """
+        key = (region, rpc)
+        staged = self._staged.get(key)
+        if staged is not None:
+            # Товар уже встречался в этом запуске
+            if staged[0] == digest:
+                return 'unchanged'
+            self._staged[key] = (digest, scope)
+            return 'changed'
+
+        row = self._conn.execute(
+            'SELECT hash FROM products WHERE region = ? AND rpc = ?', key
+        ).fetchone()
+        if row is not None and row[0] == digest:
+            self._conn.execute(
+                'UPDATE products SET scope = ?, last_seen = ? WHERE region = ? AND rpc = ?',
+                (scope, self.run_id, region, rpc)
+            )
+            self._maybe_commit()
+            return 'unchanged'
+
+        self._staged[key] = (digest, scope)
+        return 'new' if row is None else 'changed'
+
+    def save(self):
+        """Сохраняет отложенные отпечатки и валидаторы; возвращает число товаров."""
+        saved = len(self._staged)
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO products (region, rpc, hash, scope, last_seen) VALUES (?, ?, ?, ?, ?)',
+                [(region, rpc, digest, scope, self.run_id)
+                 for (region, rpc), (digest, scope) in self._staged.items()]
+            )
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO validators (url, region, rpc, etag, last_modified) VALUES (?, ?, ?, ?, ?)',
+                [(url, *values) for url, values in self._staged_validators.items()]
+            )
+        self._staged = {}
+        self._staged_validators = {}
+        return saved
+
+    def discard(self):
+        """Отбрасывает отложенное; возвращает число отброшенных товаров."""
+        discarded = len(self._staged)
+        self._staged = {}
+        self._staged_validators = {}
+        return discarded
+
+    def touch(self, region, rpc):
+        self._conn.execute(
+            'UPDATE products SET last_seen = ? WHERE region = ? AND rpc = ?',
+            (self.run_id, region, rpc)
+        )
+        self._maybe_commit()
+
+    def delisted(self, regions, scope):
+        """Товары регионов обхода, не встреченные в текущем запуске."""
+        placeholders = ', '.join('?' * len(regions))
+        return self._conn.execute(
+            f'SELECT region, rpc FROM products WHERE region IN ({placeholders}) '
+            f'AND scope = ? AND last_seen < ?',
+            (*regions, scope, self.run_id)
+        ).fetchall()
+
+    def forget(self, keys):
+        self._conn.executemany('DELETE FROM products WHERE region = ? AND rpc = ?', keys)
+        self._conn.executemany('DELETE FROM validators WHERE region = ? AND rpc = ?', keys)
+        self._conn.commit()
+
+    def get_validators(self, url):
+        return self._conn.execute(
+            'SELECT region, rpc, etag, last_modified FROM validators WHERE url = ?', (url,)
+        ).fetchone()
+
+    def set_validators(self, url, region, rpc, etag, last_modified):
+        # Валидаторы тоже ждут save(): с ними карточка, не попавшая в
+        # вывод, в следующий раз пришла бы ответом 304
+        self._staged_validators[url] = (region, rpc, etag, last_modified)
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
@@ -0,0 +1,90 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from alkoteka_parser.schemas import ProductListResponse, ProductResponse
+
+
+class JsonCodec:
+    """Разбор ответов API и сериализация товаров.
+
+    Декодер выбирается настройкой JSON_DECODER: 'auto' берёт msgspec, затем
+    orjson, затем стандартный json. С JSON_TYPED_DECODE и msgspec ответы
+    декодируются по схемам из schemas.py; если ответ не подходит под схему,
+    он разбирается целиком. Байты тела ответа передаются декодеру напрямую,
+    без промежуточного str.
+    """
+
+    def __init__(self, decoder='auto', typed=True):
+        if decoder == 'auto':
+            decoder = 'msgspec' if msgspec else 'orjson' if orjson else 'json'
+        if decoder not in ('msgspec', 'orjson', 'json'):
+            raise ValueError(f"Unknown JSON decoder: {decoder}")
+        if (decoder == 'msgspec' and msgspec is None) or (decoder == 'orjson' and orjson is None):
+            raise ValueError(f"JSON decoder '{decoder}' is not installed")
+        self.decoder = decoder
+
+        if decoder == 'msgspec':
+            self._loads = msgspec.json.Decoder().decode
+        elif decoder == 'orjson':
+            self._loads = orjson.loads
+        else:
+            self._loads = json.loads
+
+        self._product_decoder = None
+        self._list_decoder = None
+        if typed and decoder == 'msgspec':
+            self._product_decoder = msgspec.json.Decoder(ProductResponse).decode
+            self._list_decoder = msgspec.json.Decoder(ProductListResponse).decode
+
+        # Кодировщик: тот же быстрый, что и декодер, если он есть
+        if msgspec is not None and decoder == 'msgspec':
+            self._dumps = msgspec.json.Encoder().encode
+        elif orjson is not None and decoder != 'json':
+            self._dumps = orjson.dumps
+        else:
+            self._dumps = self._stdlib_dumps
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            decoder=settings.get('JSON_DECODER', 'auto'),
+            typed=settings.getbool('JSON_TYPED_DECODE', True),
+        )
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def decode_product(self, data):
+        return self._typed(self._product_decoder, data)
+
+    def decode_product_list(self, data):
+        return self._typed(self._list_decoder, data)
+
+    def dumps(self, obj):
+        """Сериализует в UTF-8 байты без экранирования не-ASCII символов."""
+        try:
+            return self._dumps(obj)
+        except TypeError:
+            # Например, целые за пределами 64 бит для orjson/msgspec
+            return self._stdlib_dumps(obj)
+
+    def _typed(self, decoder, data):
+        if decoder is None:
+            return self._loads(data)
+        try:
+            return decoder(data)
+        except msgspec.ValidationError:
+            return self._loads(data)
+
+    @staticmethod
+    def _stdlib_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,172 @@
+"""Метрики обхода: счётчики, значения и гистограммы времени.
+
+Реестр один на краулер (get_registry). Его наполняют middleware, пайплайны
+и MetricsExtension, а выгружается он в текстовом формате Prometheus или
+строками StatsD. Если METRICS_ENABLED выключен, запись в реестр ничего не
+делает.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+
+# Границы корзин гистограмм в секундах: от долей миллисекунды (разбор
+# одного ответа) до десятков секунд (медленные прокси)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+_registries = WeakKeyDictionary()
+
+
+def get_registry(crawler):
+    """Общий для всех компонентов краулера реестр метрик."""
+    registry = _registries.get(crawler)
+    if registry is None:
+        registry = MetricsRegistry(
+            enabled=crawler.settings.getbool('METRICS_ENABLED'),
+            prefix=crawler.settings.get('METRICS_PREFIX', 'alkoteka'),
+        )
+        _registries[crawler] = registry
+    return registry
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами, как в Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+
+    def __init__(self, enabled=True, prefix='alkoteka', buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = buckets
+        # Ключ - (имя, отсортированные пары меток)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def clear_gauges(self, name):
+        for key in [key for key in self.gauges if key[0] == name]:
+            del self.gauges[key]
+
+    def render_prometheus(self):
+        lines = []
+        for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted({key[0] for key in values}):
+                full_name = self._name(name, '_')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for key, value in sorted(values.items()):
+                    if key[0] == name:
+                        lines.append(f'{full_name}{_labels(key[1])} {value}')
+
+        for name in sorted({key[0] for key in self.histograms}):
+            full_name = self._name(name, '_')
+            lines.append(f'# TYPE {full_name} histogram')
+            for key, histogram in sorted(self.histograms.items()):
+                if key[0] != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{full_name}_bucket{_labels(key[1], le=bound)} {cumulative}')
+                lines.append(f'{full_name}_bucket{_labels(key[1], le="+Inf")} {histogram.count}')
+                lines.append(f'{full_name}_sum{_labels(key[1])} {histogram.sum:.6f}')
+                lines.append(f'{full_name}_count{_labels(key[1])} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def render_statsd(self):
+        """Строки StatsD (все значения - gauge, так как они накопленные).
+
+        Гистограммы выгружаются как count, sum и оценки p50/p90/p99 в
+        миллисекундах.
+        """
+        lines = []
+        for values in (self.counters, self.gauges):
+            for (name, labels), value in sorted(values.items()):
+                lines.append(f'{self._statsd_name(name, labels)}:{value}|g')
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            base = self._statsd_name(name, labels)
+            lines.append(f'{base}.count:{histogram.count}|g')
+            lines.append(f'{base}.sum_ms:{histogram.sum * 1000:.3f}|g')
+            for q in (0.5, 0.9, 0.99):
+                lines.append(f'{base}.p{int(q * 100)}_ms:{histogram.quantile(q) * 1000:.3f}|g')
+        return '\n'.join(lines) + '\n'
+
+    def _name(self, name, separator):
+        return f'{self.prefix}{separator}{name}' if self.prefix else name
+
+    def _statsd_name(self, name, labels):
+        parts = [self._name(name, '.')]
+        parts.extend(_statsd_safe(str(value)) for _, value in labels)
+        return '.'.join(parts)
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    body = ','.join(f'{key}="{_escape(value)}"' for key, value in pairs)
+    return '{' + body + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _statsd_safe(value):
+    for char in ':|@/. ':
+        value = value.replace(char, '_')
+    return value
@@ -1,14 +1,490 @@
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
+import random
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+
+from scrapy import signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware, get_retry_request
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest, NotConfigured
 from scrapy.utils.response import response_status_message
-from random import choice
+from twisted.python.failure import Failure
+
+from alkoteka_parser.incremental import NotModified, get_store
+from alkoteka_parser.jsoncodec import JsonCodec
+from alkoteka_parser.metrics import get_registry
+from alkoteka_parser.proxies import ProxyManager
+
+# Отложенные запросы общие для всех middleware одного краулера
+_parkings = weakref.WeakKeyDictionary()
+
+
+def get_parking(crawler):
+    parking = _parkings.get(crawler)
+    if parking is None:
+        parking = _parkings[crawler] = RequestParking(crawler)
+    return parking
+
+
+class RequestDeferred(IgnoreRequest):
+    """Запрос снят с загрузчика и позже вернётся в планировщик."""
+
+
+class RequestParking:
+    """Запросы, которые должны подождать, вне загрузчика.
+
+    Запрос, ждущий паузы перед повтором или свободного прокси, не занимает
+    слот загрузчика: park() запоминает его и бросает RequestDeferred, а
+    когда until сработает, запрос снова уходит в движок. Пока отложенные
+    запросы есть, паук не закрывается.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self._waiting = set()
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def park(self, request, until, reason):
+        self._waiting.add(until)
+        self.stats.inc_value(f'parked/{reason}')
+        self.stats.max_value('parked/max', len(self._waiting))
+
+        def _release(result):
+            self._waiting.discard(until)
+            # Отменено при закрытии паука
+            if isinstance(result, Failure):
+                return None
+            # Запрос уже прошёл через dupefilter планировщика
+            self.crawler.engine.crawl(request.replace(dont_filter=True))
+
+        until.addBoth(_release)
+        raise RequestDeferred(f"{request.url} parked ({reason})")
+
+    def delay(self, seconds):
+        from twisted.internet import reactor, task
+
+        return task.deferLater(reactor, seconds)
+
+    def spider_idle(self, spider):
+        if self._waiting:
+            raise DontCloseSpider
+
+    def spider_closed(self, spider):
+        for until in list(self._waiting):
+            until.cancel()
+
+
+def retry_after(response):
+    """Значение Retry-After ответа в секундах или None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.decode('latin-1').strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class BackoffRetryMiddleware(RetryMiddleware):
+    """Повторы с экспоненциальной паузой и бюджетом попыток на запрос.
+
+    Заменяет стандартный RetryMiddleware. Число повторов берётся из
+    meta['max_retry_times'], затем из RETRY_ENDPOINT_TIMES по типу запроса
+    (meta['endpoint']), затем из RETRY_TIMES. Перед N-м повтором запрос ждёт
+    RETRY_BACKOFF_BASE * 2^(N-1) секунд (не больше RETRY_BACKOFF_MAX и не
+    меньше Retry-After) со случайной добавкой до половины паузы; паузу запрос
+    пережидает в RequestParking, а не в загрузчике. Новый прокси
+    для повтора выбирает ProxyPoolMiddleware. Ответы с кодами из
+    RETRY_PERMANENT_HTTP_CODES (404) не повторяются и считаются отдельно.
+    Каждая попытка, не давшая годного ответа, засчитывается в retry/wasted.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler.settings)
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.endpoint_times = settings.getdict('RETRY_ENDPOINT_TIMES')
+        self.permanent_codes = {int(code) for code in settings.getlist('RETRY_PERMANENT_HTTP_CODES', [404])}
+        self.retry_http_codes -= self.permanent_codes
+        self.backoff_base = settings.getfloat('RETRY_BACKOFF_BASE', 1.0)
+        self.backoff_max = settings.getfloat('RETRY_BACKOFF_MAX', 60.0)
+        self.parking = get_parking(crawler)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
 
-class CustomRetryMiddleware(RetryMiddleware):
     def process_response(self, request, response, spider):
-        if response.status in [403, 429] and getattr(spider, 'use_proxy', False):
+        if request.meta.get('dont_retry', False):
+            return response
+        if response.status in self.permanent_codes:
+            self.stats.inc_value(f'retry/permanent/{response.status}')
+            self.stats.inc_value('retry/wasted')
+            return response
+        if response.status in self.retry_http_codes:
             reason = response_status_message(response.status)
-            if hasattr(spider, 'proxy_pool') and spider.proxy_pool:
-                new_proxy = choice(spider.proxy_pool)
-                spider.logger.warning(f'Switching proxy to {new_proxy} after {response.status} response')
-                request.meta['proxy'] = new_proxy
-                return self._retry(request, reason, spider) or response
-        return response
\ No newline at end of file
+            self._retry_request(request, reason, spider, retry_after(response))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, self.exceptions_to_retry) and not request.meta.get('dont_retry', False):
+            self._retry_request(request, exception, spider)
+        return None
+
+    def _retry_request(self, request, reason, spider, min_delay=None):
+        # Повтор ждёт паузу вне загрузчика, не занимая слот: RequestParking
+        # бросает RequestDeferred, и исходный запрос до колбэков не доходит.
+        # Без повтора (бюджет исчерпан) возвращает None
+        self.stats.inc_value('retry/wasted')
+        max_retry_times = request.meta.get('max_retry_times')
+        if max_retry_times is None:
+            max_retry_times = self.endpoint_times.get(request.meta.get('endpoint'), self.max_retry_times)
+        retry = get_retry_request(
+            request,
+            spider=spider,
+            reason=reason,
+            max_retry_times=int(max_retry_times),
+            priority_adjust=request.meta.get('priority_adjust', self.priority_adjust),
+        )
+        if retry is None:
+            return None
+
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (retry.meta['retry_times'] - 1))
+        delay += random.uniform(0, delay / 2)
+        if min_delay:
+            delay = max(delay, min(min_delay, self.backoff_max))
+        spider.logger.debug(f"Retrying {request.url} ({reason}) in {delay:.1f}s")
+        self.parking.park(retry, self.parking.delay(delay), 'retry')
+
+    def spider_closed(self, spider):
+        requests = self.stats.get_value('downloader/request_count')
+        if requests:
+            self.stats.set_value('retry/wasted_ratio', round((self.stats.get_value('retry/wasted') or 0) / requests, 4))
+
+
+class ProxyPoolMiddleware:
+    """Назначает запросам прокси из ProxyManager и сообщает ему об исходе.
+
+    Работает, только если у паука включён use_proxy. Запросы с явно
+    заданным meta['proxy'] не трогает; при повторе запроса прокси
+    выбирается заново. Если свободных прокси нет, запрос ждёт в
+    RequestParking, пока какой-нибудь не освободится.
+    """
+
+    def __init__(self, crawler):
+        self.manager = ProxyManager.from_settings(crawler.settings)
+        self.stats = crawler.stats
+        self.parking = get_parking(crawler)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if not getattr(spider, 'use_proxy', False) or not self.manager.proxies:
+            return None
+        if 'proxy' in request.meta and 'proxy_pool_started' not in request.meta:
+            return None
+
+        proxy = self.manager.acquire()
+        if proxy is None:
+            self.parking.park(request, self.manager.wait(), 'proxy')
+
+        request.meta['proxy'] = proxy
+        request.meta['proxy_pool_started'] = time.monotonic()
+        self.stats.inc_value(f'proxy/{proxy}/requests')
+        return None
+
+    def process_response(self, request, response, spider):
+        # Ответ из HTTP-кэша ничего не говорит о здоровье прокси
+        self._release(request, status=response.status, cached='cached' in response.flags)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._release(request, error=True)
+        return None
+
+    def _release(self, request, status=None, error=False, cached=False):
+        started = request.meta.get('proxy_pool_started')
+        if started is None or request.meta.get('proxy_pool_released') == started:
+            return
+        request.meta['proxy_pool_released'] = started
+
+        proxy = request.meta.get('proxy')
+        if cached:
+            self.manager.cancel(proxy)
+            self.stats.inc_value(f'proxy/{proxy}/requests', -1)
+            self.stats.inc_value('proxy/cached_responses')
+            return
+        self.manager.release(proxy, latency=time.monotonic() - started, status=status, error=error)
+        if status in (403, 429):
+            self.stats.inc_value(f'proxy/{proxy}/status_{status}')
+        elif error:
+            self.stats.inc_value(f'proxy/{proxy}/errors')
+
+    def spider_closed(self, spider):
+        for proxy, health in self.manager.snapshot().items():
+            if not health['requests']:
+                continue
+            for key in ('success_rate', 'latency_ms', 'cooldowns'):
+                if health[key] is not None:
+                    self.stats.set_value(f'proxy/{proxy}/{key}', health[key])
+
+
+class ConditionalRequestMiddleware:
+    """Условные запросы карточек товаров (If-None-Match / If-Modified-Since).
+
+    Валидаторы запоминаются, только если API их прислал; на ответ 304 товар
+    отмечается увиденным в FingerprintStore, а запрос отбрасывается.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not (settings.getbool('INCREMENTAL_ENABLED')
+                and settings.getbool('INCREMENTAL_CONDITIONAL_REQUESTS')):
+            raise NotConfigured
+        self.store = get_store(crawler)
+        self.stats = crawler.stats
+        self.codec = JsonCodec.from_settings(settings)
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.store.open()
+
+    def process_request(self, request, spider):
+        if 'slug' not in request.meta:
+            return None
+
+        validators = self.store.get_validators(request.url)
+        if validators:
+            _, _, etag, last_modified = validators
+            if etag:
+                request.headers.setdefault('If-None-Match', etag)
+            if last_modified:
+                request.headers.setdefault('If-Modified-Since', last_modified)
+        return None
+
+    def process_response(self, request, response, spider):
+        if 'slug' not in request.meta:
+            return response
+
+        if response.status == 304:
+            validators = self.store.get_validators(request.url)
+            if validators:
+                region, rpc, _, _ = validators
+                self.store.touch(region, rpc)
+            self.stats.inc_value('incremental/not_modified')
+            raise NotModified(f"Not modified: {request.url}")
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status == 200 and (etag or last_modified):
+            try:
+                rpc = (self.codec.decode_product(response.body).get('results') or {}).get('uuid')
+            except ValueError:
+                rpc = None
+            if rpc:
+                self.store.set_validators(
+                    request.url,
+                    request.meta.get('region', ''),
+                    rpc,
+                    etag.decode('latin-1') if etag else None,
+                    last_modified.decode('latin-1') if last_modified else None,
+                )
+        return response
+
+
+class AdaptiveThrottleMiddleware:
+    """AIMD-регулятор параллельности и задержки слотов загрузчика.
+
+    Пока ответы успешные и задержка ответа не растёт, каждый такой ответ
+    уменьшает паузу слота на ADAPTIVE_THROTTLE_DELAY_STEP, а каждые
+    ADAPTIVE_THROTTLE_INCREASE_EVERY ответов лимит растёт на один запрос. На
+    429/403/5xx и сетевые ошибки лимит умножается на
+    ADAPTIVE_THROTTLE_DECREASE_FACTOR, а пауза удваивается, но не меньше
+    Retry-After. Если ADAPTIVE_THROTTLE_SPLIT включён, у каждой пары
+    (тип запроса, прокси) свой слот и свой бюджет.
+    """
+
+    BACKOFF_STATUSES = (403, 429)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.split = settings.getbool('ADAPTIVE_THROTTLE_SPLIT', True)
+        self.min_concurrency = max(1, settings.getint('ADAPTIVE_THROTTLE_MIN_CONCURRENCY', 1))
+        self.max_concurrency = settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', 16)
+        self.min_delay = settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', 0.0)
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 60.0)
+        self.delay_step = settings.getfloat('ADAPTIVE_THROTTLE_DELAY_STEP', 0.1)
+        self.increase_every = max(1, settings.getint('ADAPTIVE_THROTTLE_INCREASE_EVERY', 10))
+        self.decrease_factor = settings.getfloat('ADAPTIVE_THROTTLE_DECREASE_FACTOR', 0.5)
+        self.latency_tolerance = settings.getfloat('ADAPTIVE_THROTTLE_LATENCY_TOLERANCE', 1.5)
+        # Бюджеты по ключу слота: concurrency, delay, базовая задержка ответа
+        self.budgets = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if self.split:
+            base = request.meta.get('download_slot') or self.crawler.engine.downloader.get_slot_key(request)
+            base = base.split('|', 1)[0]
+            endpoint = request.meta.get('endpoint', 'other')
+            proxy = request.meta.get('proxy') or 'direct'
+            request.meta['download_slot'] = f"{base}|{endpoint}|{proxy}"
+        return None
+
+    def process_response(self, request, response, spider):
+        # Ответы из HTTP-кэша ничего не говорят о нагрузке на сайт
+        if 'cached' in response.flags:
+            return response
+        if response.status in self.BACKOFF_STATUSES or response.status >= 500:
+            self._back_off(request, retry_after(response))
+        else:
+            self._success(request, request.meta.get('download_latency'))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # Отложенный запрос до сайта не доходил
+        if not isinstance(exception, RequestDeferred):
+            self._back_off(request, None)
+        return None
+
+    def _budget(self, request):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return None, None
+        budget = self.budgets.get(key)
+        if budget is None:
+            budget = self.budgets[key] = {
+                'key': key,
+                'concurrency': min(slot.concurrency, self.max_concurrency),
+                'delay': slot.delay,
+                'latency': None,
+                'successes': 0,
+            }
+        return budget, slot
+
+    def _success(self, request, latency):
+        budget, slot = self._budget(request)
+        if budget is None:
+            return
+
+        stable = True
+        if latency is not None:
+            baseline = budget['latency']
+            if baseline is not None:
+                stable = latency <= baseline * self.latency_tolerance
+                budget['latency'] = 0.9 * baseline + 0.1 * latency
+            else:
+                budget['latency'] = latency
+
+        if stable:
+            budget['successes'] += 1
+            budget['delay'] = max(self.min_delay, budget['delay'] - self.delay_step)
+        if budget['successes'] >= self.increase_every:
+            budget['successes'] = 0
+            budget['concurrency'] = min(self.max_concurrency, budget['concurrency'] + 1)
+            self.stats.inc_value('throttle/increase')
+        self._apply(budget, slot)
+
+    def _back_off(self, request, retry_after):
+        budget, slot = self._budget(request)
+        if budget is None:
+            return
+
+        budget['successes'] = 0
+        budget['concurrency'] = max(self.min_concurrency, int(budget['concurrency'] * self.decrease_factor))
+        delay = max(budget['delay'] * 2, self.delay_step)
+        if retry_after:
+            delay = max(delay, retry_after)
+        budget['delay'] = min(self.max_delay, delay)
+        self.stats.inc_value('throttle/backoff')
+        self._apply(budget, slot)
+
+    def _apply(self, budget, slot):
+        slot.concurrency = budget['concurrency']
+        slot.delay = budget['delay']
+        self.stats.set_value(f"throttle/{budget['key']}/concurrency", budget['concurrency'])
+        self.stats.set_value(f"throttle/{budget['key']}/delay", round(budget['delay'], 3))
+
+
+class CallbackTimingMiddleware:
+    """Меряет время колбэков паука (гистограмма callback_seconds).
+
+    Колбэки - генераторы, поэтому учитывается только время внутри самого
+    колбэка между выдачей результатов, без обработки результатов дальше по
+    цепочке. Должен стоять ближе всех к пауку (наибольший порядок в
+    SPIDER_MIDDLEWARES).
+    """
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        self.registry = get_registry(crawler)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        name = self._callback_name(response, spider)
+        iterator = iter(result)
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield value
+        finally:
+            self.registry.observe('callback_seconds', elapsed, callback=name)
+
+    async def process_spider_output_async(self, response, result, spider):
+        name = self._callback_name(response, spider)
+        iterator = result.__aiter__()
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    value = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield value
+        finally:
+            self.registry.observe('callback_seconds', elapsed, callback=name)
+
+    @staticmethod
+    def _callback_name(response, spider):
+        request = response.request
+        callback = request.callback if request is not None else None
+        return getattr(callback, '__name__', 'parse')
+
@@ -1,23 +1,726 @@
 import json
+import logging
 import os
+import socket
+import time
+import weakref
 
+from scrapy import signals
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, task, threads
+from twisted.python.failure import Failure
+
+from alkoteka_parser.distributed import output_path
+from alkoteka_parser.frontier import frontier_scope, get_frontier
+from alkoteka_parser.incremental import get_store, item_fingerprint
+from alkoteka_parser.jsoncodec import JsonCodec
+from alkoteka_parser.metrics import MetricsRegistry, get_registry
+from alkoteka_parser.priceindex import IN_STOCK, PriceIndex, price_events, product_key, tag_hash
+
+logger = logging.getLogger(__name__)
+
+# pyarrow импортируется долго, поэтому загружается только с PARQUET_ENABLED
+pyarrow = None
+
+
+# Публикация выходных файлов, общая для пайплайнов одного краулера
+_outputs = weakref.WeakKeyDictionary()
+
+
+def get_outputs(crawler):
+    outputs = _outputs.get(crawler)
+    if outputs is None:
+        outputs = _outputs[crawler] = OutputCommits()
+    return outputs
+
+
+class OutputCommits:
+    """Учёт публикации выходных файлов пайплайнами записи.
+
+    Пайплайн записи регистрируется при создании и в конце обхода сообщает
+    done(), опубликовал ли он свой файл. Колбэк when_done вызывается, когда
+    отчитались все зарегистрированные пайплайны (или сразу, если ждать
+    некого), с True, если все файлы опубликованы.
+    """
 
-class AlkotekaParserPipeline:
     def __init__(self):
-        self.data_dir = 'product_data'
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
+        self._pending = set()
+        self._committed = True
+        self._callbacks = []
+
+    def register(self, writer):
+        self._pending.add(writer)
+
+    def done(self, writer, committed):
+        self._pending.discard(writer)
+        self._committed = self._committed and committed
+        if not self._pending:
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                self._call(callback)
+
+    def when_done(self, callback):
+        if self._pending:
+            self._callbacks.append(callback)
+        else:
+            self._call(callback)
+
+    def _call(self, callback):
+        # Ошибка колбэка не должна ломать закрытие пайплайна записи
+        try:
+            callback(self._committed)
+        except Exception:
+            logger.exception("Error in output commit callback")
+
+
+def _load_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        try:
+            import pyarrow as module
+            import pyarrow.parquet
+        except ImportError:
+            return None
+        pyarrow = module
+    return pyarrow
+
+
+class JsonLinesWriterPipeline:
+    """Пишет товары в один JSONL-файл пачками, не блокируя реактор.
+
+    Строки копятся в памяти и сбрасываются в фоновом потоке, когда пачка
+    набирает PRODUCTS_JSONL_BATCH_ITEMS строк / PRODUCTS_JSONL_BATCH_BYTES байт
+    или раз в PRODUCTS_JSONL_FLUSH_INTERVAL секунд. Во время обхода данные
+    пишутся во временный файл, который на close_spider атомарно заменяет
+    PRODUCTS_JSONL_PATH.
+
+    В режиме продолжения (RESUME_ENABLED) записанные на диск товары
+    отмечаются во фронтире. Продолженный обход дописывает тот же временный
+    файл и пропускает уже записанные товары, а на место PRODUCTS_JSONL_PATH
+    файл встаёт только после успешного завершения обхода.
+
+    В распределённом режиме (DISTRIBUTED_ENABLED) каждый воркер пишет свой
+    файл по шаблону DISTRIBUTED_OUTPUT_PATTERN.
+    """
+
+    def __init__(self, path, batch_items=500, batch_bytes=1024 * 1024,
+                 flush_interval=5.0, stats=None, codec=None, metrics=None, frontier=None, outputs=None):
+        self.path = path
+        self.tmp_path = f"{path}.part"
+        self.batch_items = batch_items
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.codec = codec or JsonCodec()
+        self.metrics = metrics or MetricsRegistry(enabled=False)
+        self.frontier = frontier
+        self.outputs = outputs
+        if outputs is not None:
+            outputs.register(self)
+
+        self._file = None
+        self._buffer = []
+        # (регион, RPC) строк буфера, только в режиме продолжения
+        self._keys = []
+        self._buffer_bytes = 0
+        # Цепочка фоновых записей: каждая пачка пишется после предыдущей
+        self._writes = defer.succeed(None)
+        self._pending_bytes = 0
+        # Первая неудачная запись: файл неполный и не заменяет PRODUCTS_JSONL_PATH
+        self._write_failed = None
+        self._flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PRODUCTS_JSONL_ENABLED', True):
+            raise NotConfigured
+        if settings.getbool('DISTRIBUTED_ENABLED'):
+            path = output_path(settings)
+        else:
+            path = settings.get('PRODUCTS_JSONL_PATH', 'product_data/all_products.jsonl')
+        pipeline = cls(
+            path=path,
+            batch_items=settings.getint('PRODUCTS_JSONL_BATCH_ITEMS', 500),
+            batch_bytes=settings.getint('PRODUCTS_JSONL_BATCH_BYTES', 1024 * 1024),
+            flush_interval=settings.getfloat('PRODUCTS_JSONL_FLUSH_INTERVAL', 5.0),
+            stats=crawler.stats,
+            codec=JsonCodec.from_settings(settings),
+            metrics=get_registry(crawler),
+            frontier=get_frontier(crawler) if settings.getbool('RESUME_ENABLED') else None,
+            outputs=get_outputs(crawler),
+        )
+        if pipeline.frontier is not None:
+            crawler.signals.connect(pipeline.item_dropped, signal=signals.item_dropped)
+            crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    @property
+    def pending_bytes(self):
+        """Байты, принятые пайплайном, но ещё не записанные на диск."""
+        return self._buffer_bytes + self._pending_bytes
+
+    def open_spider(self, spider):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        resumed = self.frontier is not None and self.frontier.open(frontier_scope(spider)).resumed
+        if resumed and os.path.exists(self.tmp_path):
+            _truncate_partial_line(self.tmp_path)
+            self._file = open(self.tmp_path, 'ab')
+            logger.info(f"Appending to {self.tmp_path} from the interrupted crawl")
+        else:
+            self._file = open(self.tmp_path, 'wb')
+
+        if self.flush_interval > 0:
+            self._flush_loop = task.LoopingCall(self._flush)
+            self._flush_loop.start(self.flush_interval, now=False)
+
+    def process_item(self, item, spider):
+        started = time.perf_counter()
+        if self.frontier is not None:
+            key = (item.get('region', ''), item.get('RPC'))
+            if key[1] and self.frontier.is_done(*key):
+                if self.stats is not None:
+                    self.stats.inc_value('frontier/skipped_written')
+                raise DropItem(f"Product {key[1]} is already written", log_level='DEBUG')
+            self._keys.append(key)
+
+        line = self.codec.dumps(dict(item)) + b'\n'
+        self._buffer.append(line)
+        self._buffer_bytes += len(line)
+
+        if len(self._buffer) >= self.batch_items or self._buffer_bytes >= self.batch_bytes:
+            self._flush()
+        self.metrics.observe('pipeline_seconds', time.perf_counter() - started, stage='jsonl')
+        return item
+
+    def close_spider(self, spider):
+        if self._flush_loop is not None and self._flush_loop.running:
+            self._flush_loop.stop()
+        self._flush()
+
+        def _finalize(_):
+            if self.frontier is not None:
+                # Файл встанет на место в spider_closed, если обход завершён
+                return threads.deferToThread(self._sync)
+            d = threads.deferToThread(self._commit)
+            d.addBoth(self._report)
+            return d
+
+        return self._writes.addCallback(_finalize)
+
+    def _report(self, result):
+        committed = not isinstance(result, Failure) and self._write_failed is None
+        if self.outputs is not None:
+            self.outputs.done(self, committed)
+        return result
+
+    def item_dropped(self, item, response, exception, spider):
+        # Отброшенный товар (например, не изменившийся) записывать не нужно
+        self.frontier.complete([(item.get('region', ''), item.get('RPC'))])
+
+    def spider_closed(self, spider, reason):
+        committed = False
+        try:
+            if self._write_failed is not None:
+                logger.error(f"Products were not fully written, keeping {self.tmp_path}: "
+                             f"{self._write_failed.value}")
+            elif reason == 'finished':
+                os.replace(self.tmp_path, self.path)
+                committed = True
+                unfinished = self.frontier.pending_count()
+                self.frontier.finish()
+                logger.info(f"Saved products to {self.path}")
+                if unfinished:
+                    logger.warning(f"{unfinished} product(s) were not fetched in this crawl")
+            else:
+                logger.info(f"Crawl stopped ({reason}), run it again with RESUME_ENABLED to continue")
+        finally:
+            self.frontier.close()
+            if self.outputs is not None:
+                self.outputs.done(self, committed)
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        chunk = b''.join(self._buffer)
+        lines = len(self._buffer)
+        keys = self._keys
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._keys = []
+        self._pending_bytes += len(chunk)
+
+        def _write(_):
+            return threads.deferToThread(self._write_chunk, chunk)
+
+        def _written(latency):
+            self._pending_bytes -= len(chunk)
+            self.metrics.observe('jsonl_flush_seconds', latency)
+            if self.frontier is not None:
+                self.frontier.complete(keys)
+            if self.stats is not None:
+                self.stats.inc_value('jsonl/bytes_written', len(chunk))
+                self.stats.inc_value('jsonl/lines_written', lines)
+                self.stats.inc_value('jsonl/flushes')
+                self.stats.inc_value('jsonl/flush_latency_ms_total', round(latency * 1000, 3))
+                self.stats.max_value('jsonl/flush_latency_ms_max', round(latency * 1000, 3))
+
+        def _failed(failure):
+            self._pending_bytes -= len(chunk)
+            if self._write_failed is None:
+                self._write_failed = failure
+            if self.stats is not None:
+                self.stats.inc_value('jsonl/write_errors')
+            logger.error(f"Error writing {lines} products to {self.tmp_path}: {failure.value}")
+
+        self._writes.addCallback(_write)
+        self._writes.addCallbacks(_written, _failed)
+
+    def _write_chunk(self, chunk):
+        # Выполняется в пуле потоков реактора
+        started = time.perf_counter()
+        self._file.write(chunk)
+        self._file.flush()
+        return time.perf_counter() - started
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _commit(self):
+        self._sync()
+        if self._write_failed is not None:
+            logger.error(f"Products were not fully written, keeping {self.tmp_path} "
+                         f"instead of replacing {self.path}: {self._write_failed.value}")
+            return
+        os.replace(self.tmp_path, self.path)
+        logger.info(f"Saved products to {self.path}")
+
+
+def _truncate_partial_line(path):
+    # Обрезает строку, которую прерванный обход не успел дописать
+    with open(path, 'r+b') as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(64 * 1024, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+class IncrementalPipeline:
+    """Пропускает дальше только новые и изменившиеся товары.
+
+    Хеш каждого товара сравнивается с сохранённым в FingerprintStore.
+    Хеши новых и изменившихся товаров сохраняются в хранилище, только
+    когда обход завершён и все пайплайны записи опубликовали свои файлы:
+    иначе товар, не попавший в вывод, в следующих запусках считался бы
+    неизменившимся. После этого товары регионов обхода, которые не
+    встретились в этом запуске, записываются в INCREMENTAL_TOMBSTONES_PATH
+    и удаляются из хранилища. Регионы, где не загрузилась какая-либо
+    страница списка (spider.list_failures), при этом пропускаются.
+    """
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured
+        self.store = get_store(crawler)
+        self.outputs = get_outputs(crawler)
+        self.stats = crawler.stats
+        self.metrics = get_registry(crawler)
+        self.crawler = crawler
+        self.resume = crawler.settings.getbool('RESUME_ENABLED')
+        # Воркер распределённого обхода видит только часть товаров, снятые с
+        # продажи по его данным не определить
+        self.distributed = crawler.settings.getbool('DISTRIBUTED_ENABLED')
+        self.tombstones_path = crawler.settings.get(
+            'INCREMENTAL_TOMBSTONES_PATH', 'product_data/delisted.jsonl'
+        )
+        self.scope = ''
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        self.store.open()
+        # Товары сравниваются только в пределах того же набора категорий,
+        # иначе обход одной категории пометил бы остальные удалёнными
+        self.scope = ','.join(sorted(spider.start_urls))
+        if self.resume:
+            # Продолженный обход - тот же запуск: товары, увиденные до
+            # падения, не должны считаться снятыми с продажи
+            self.store.run_id = get_frontier(self.crawler).open(frontier_scope(spider)).run_id
+
+    def process_item(self, item, spider):
+        rpc = item.get('RPC')
+        if not rpc:
+            return item
+
+        started = time.perf_counter()
+        status = self.store.check(item.get('region', ''), rpc, item_fingerprint(item), self.scope)
+        self.metrics.observe('pipeline_seconds', time.perf_counter() - started, stage='incremental')
+        self.stats.inc_value(f'incremental/{status}')
+        if status == 'unchanged':
+            raise DropItem(f"Product {rpc} is unchanged", log_level='DEBUG')
+        return item
+
+    def spider_closed(self, spider, reason):
+        # Пайплайны записи могут опубликовать файлы и позже (в своём spider_closed)
+        self.outputs.when_done(lambda committed: self._finish(spider, reason, committed))
+
+    def _finish(self, spider, reason, committed):
+        try:
+            if reason != 'finished' or not committed:
+                discarded = self.store.discard()
+                if discarded:
+                    self.stats.set_value('incremental/discarded', discarded)
+                    logger.warning(f"Output was not saved ({reason}), not saving fingerprints "
+                                   f"of {discarded} new or changed product(s)")
+                return
+            self.stats.set_value('incremental/saved', self.store.save())
+            if not self.distributed:
+                self._write_tombstones(self._complete_regions(spider))
+        finally:
+            self.store.close()
+
+    def _complete_regions(self, spider):
+        # Товары не привязаны в хранилище к категории, поэтому регион, где не
+        # загрузилась хоть одна страница списка, пропускается целиком: иначе
+        # товары с этой страницы посчитались бы снятыми с продажи
+        failed = {region for region, _ in getattr(spider, 'list_failures', ())}
+        regions = getattr(spider, 'region_uuids', [])
+        skipped = [region for region in regions if region in failed]
+        if skipped:
+            self.stats.set_value('incremental/tombstones_skipped_regions', len(skipped))
+            logger.warning(f"Product list pages failed in {len(skipped)} region(s), "
+                           f"not writing delisted products for them")
+        return [region for region in regions if region not in failed]
+
+    def _write_tombstones(self, regions):
+        if not regions:
+            return
+        delisted = self.store.delisted(regions, self.scope)
+        timestamp = int(time.time())
+
+        directory = os.path.dirname(self.tombstones_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.tombstones_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for region, rpc in delisted:
+                record = {'timestamp': timestamp, 'RPC': rpc, 'region': region, 'delisted': True}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.tombstones_path)
+
+        self.store.forget(delisted)
+        self.stats.set_value('incremental/delisted', len(delisted))
+        logger.info(f"Saved {len(delisted)} delisted products to {self.tombstones_path}")
+
+
+class PriceChangePipeline:
+    """Пишет события изменения цены, акции и наличия товаров.
+
+    Последние известные цена, sale_tag и наличие каждого (регион, RPC)
+    хранятся в PriceIndex, который загружается из PRICE_EVENTS_SNAPSHOT_PATH
+    и атомарно сохраняется туда же в конце обхода. Каждый товар сравнивается
+    с индексом; события price_drop, price_rise, out_of_stock, back_in_stock и
+    new_promo дописываются в PRICE_EVENTS_PATH и/или отправляются UDP-пакетами
+    на PRICE_EVENTS_UDP_ADDRESS. Товары, которых не было в индексе, событий
+    не дают.
+    """
+
+    def __init__(self, snapshot_path, events_path=None, udp_address=None, stats=None, metrics=None, codec=None):
+        self.snapshot_path = snapshot_path
+        self.events_path = events_path
+        self.udp_address = udp_address
+        self.stats = stats
+        self.metrics = metrics or MetricsRegistry(enabled=False)
+        self.codec = codec or JsonCodec()
+        self.index = None
+        self._file = None
+        self._socket = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PRICE_EVENTS_ENABLED'):
+            raise NotConfigured
+        if settings.getbool('DISTRIBUTED_ENABLED'):
+            # Каждый воркер видит только часть товаров, а снимок общий
+            logger.warning("PRICE_EVENTS_ENABLED is not supported with DISTRIBUTED_ENABLED")
+            raise NotConfigured
+        udp_address = settings.get('PRICE_EVENTS_UDP_ADDRESS')
+        if udp_address:
+            host, _, port = str(udp_address).rpartition(':')
+            udp_address = (host or '127.0.0.1', int(port))
+        return cls(
+            snapshot_path=settings.get('PRICE_EVENTS_SNAPSHOT_PATH', 'product_data/price_index.bin'),
+            events_path=settings.get('PRICE_EVENTS_PATH'),
+            udp_address=udp_address,
+            stats=crawler.stats,
+            metrics=get_registry(crawler),
+            codec=JsonCodec.from_settings(settings),
+        )
+
+    def open_spider(self, spider):
+        started = time.perf_counter()
+        self.index = PriceIndex.load(self.snapshot_path)
+        logger.info(f"Loaded {len(self.index)} known prices in {time.perf_counter() - started:.2f}s")
+        if self.events_path:
+            directory = os.path.dirname(self.events_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.events_path, 'ab')
+        if self.udp_address:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
 
     def process_item(self, item, spider):
-        category = item.get('category')
-        slug = item.get('slug')
+        rpc = item.get('RPC')
+        if not rpc:
+            return item
+
+        started = time.perf_counter()
+        region = item.get('region', '')
+        price_data = item.get('price_data') or {}
+        price = float(price_data.get('current') or 0.0)
+        sale_tag = price_data.get('sale_tag') or ''
+        in_stock = bool((item.get('stock') or {}).get('in_stock'))
+
+        key = product_key(region, rpc)
+        previous = self.index.get(key)
+        if previous is None:
+            self.stats.inc_value('price_events/new_products')
+        else:
+            for event_type in price_events(previous, price, sale_tag, in_stock):
+                self._emit({
+                    'type': event_type,
+                    'timestamp': item.get('timestamp'),
+                    'region': region,
+                    'RPC': rpc,
+                    'old_price': previous[0],
+                    'price': price,
+                    'sale_tag': sale_tag,
+                    'in_stock': in_stock,
+                })
+        self.index.set(key, price, tag_hash(sale_tag), IN_STOCK if in_stock else 0)
+        self.metrics.observe('pipeline_seconds', time.perf_counter() - started, stage='price_events')
+        return item
+
+    def _emit(self, event):
+        self.stats.inc_value(f"price_events/{event['type']}")
+        line = self.codec.dumps(event) + b'\n'
+        if self._file is not None:
+            self._file.write(line)
+        if self._socket is not None:
+            try:
+                self._socket.sendto(line, self.udp_address)
+            except OSError as e:
+                logger.debug(f"Error sending price event: {e}")
+
+    def close_spider(self, spider):
+        if self._file is not None:
+            self._file.close()
+        if self._socket is not None:
+            self._socket.close()
+        # Индекс знает последние увиденные цены и после прерванного обхода
+        started = time.perf_counter()
+        self.index.save(self.snapshot_path)
+        logger.info(f"Saved {len(self.index)} known prices to {self.snapshot_path} "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+
+def _parquet_schema():
+    string_list = pyarrow.list_(pyarrow.string())
+    return pyarrow.schema([
+        ('timestamp', pyarrow.timestamp('s', tz='UTC')),
+        ('RPC', pyarrow.string()),
+        ('url', pyarrow.string()),
+        ('title', pyarrow.string()),
+        ('marketing_tags', string_list),
+        ('brand', pyarrow.string()),
+        ('section', string_list),
+        ('price_current', pyarrow.float64()),
+        ('price_original', pyarrow.float64()),
+        ('price_sale_tag', pyarrow.string()),
+        ('stock_in_stock', pyarrow.bool_()),
+        ('stock_count', pyarrow.int64()),
+        ('main_image', pyarrow.string()),
+        ('set_images', string_list),
+        ('view360', string_list),
+        ('video', string_list),
+        ('metadata', pyarrow.map_(pyarrow.string(), pyarrow.string())),
+        ('variants', pyarrow.int64()),
+    ])
+
+
+def _parquet_row(item):
+    price_data = item.get('price_data') or {}
+    stock = item.get('stock') or {}
+    assets = item.get('assets') or {}
+    metadata = item.get('metadata') or {}
+    return (
+        item.get('timestamp'),
+        item.get('RPC'),
+        item.get('url'),
+        item.get('title'),
+        item.get('marketing_tags'),
+        item.get('brand'),
+        item.get('section'),
+        price_data.get('current'),
+        price_data.get('original'),
+        price_data.get('sale_tag'),
+        stock.get('in_stock'),
+        stock.get('count'),
+        assets.get('main_image'),
+        assets.get('set_images'),
+        assets.get('view360'),
+        assets.get('video'),
+        [(str(key), None if value is None else str(value)) for key, value in metadata.items()],
+        item.get('variants'),
+    )
+
+
+class ParquetExportPipeline:
+    """Пишет товары в Parquet с разбиением по региону и дате обхода.
+
+    Вложенные price_data, stock и assets раскладываются по отдельным
+    типизированным колонкам, metadata хранится колонкой map<string, string>.
+    Файлы лежат в каталогах PARQUET_DIR/region_uuid=<регион>/date=<ГГГГ-ММ-ДД>
+    (разбиение в стиле Hive, его понимают pandas и pyarrow.dataset). Каждый
+    запуск пишет в партицию свой файл, поэтому старые даты можно удалять
+    целыми каталогами. Строки копятся по партициям и уходят на диск в фоновом
+    потоке группами строк по PARQUET_ROW_GROUP_SIZE. Файл партиции, в
+    которую не записалась какая-либо группа строк, остаётся с суффиксом
+    .part.
+    """
+
+    def __init__(self, directory, row_group_size=50000, compression='zstd', stats=None, metrics=None,
+                 outputs=None):
+        if _load_pyarrow() is None:
+            raise NotConfigured('pyarrow is not installed')
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.stats = stats
+        self.metrics = metrics or MetricsRegistry(enabled=False)
+        self.schema = _parquet_schema()
+        self.run_id = int(time.time() * 1000)
+        self.outputs = outputs
+        if outputs is not None:
+            outputs.register(self)
+
+        # Партиция (регион, дата) -> накопленные строки и открытый писатель
+        self._rows = {}
+        self._writers = {}
+        self._writes = defer.succeed(None)
+        # Партиция -> первая неудачная запись: файл неполный и не публикуется
+        self._write_failed = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PARQUET_ENABLED'):
+            raise NotConfigured
+        return cls(
+            directory=settings.get('PARQUET_DIR', 'product_data/parquet'),
+            row_group_size=settings.getint('PARQUET_ROW_GROUP_SIZE', 50000),
+            compression=settings.get('PARQUET_COMPRESSION', 'zstd'),
+            stats=crawler.stats,
+            metrics=get_registry(crawler),
+            outputs=get_outputs(crawler),
+        )
+
+    def process_item(self, item, spider):
+        started = time.perf_counter()
+        timestamp = item.get('timestamp') or int(time.time())
+        partition = (item.get('region') or 'unknown', time.strftime('%Y-%m-%d', time.gmtime(timestamp)))
+
+        rows = self._rows.setdefault(partition, [])
+        rows.append(_parquet_row(item))
+        if len(rows) >= self.row_group_size:
+            self._flush(partition)
+        self.metrics.observe('pipeline_seconds', time.perf_counter() - started, stage='parquet')
+        return item
+
+    def close_spider(self, spider):
+        for partition in list(self._rows):
+            self._flush(partition)
+
+        def _finalize(_):
+            return threads.deferToThread(self._commit)
+
+        def _report(result):
+            committed = not isinstance(result, Failure) and not self._write_failed
+            if self.outputs is not None:
+                self.outputs.done(self, committed)
+            return result
+
+        return self._writes.addCallback(_finalize).addBoth(_report)
+
+    def _flush(self, partition):
+        rows = self._rows.pop(partition, None)
+        if not rows:
+            return
+
+        def _write(_):
+            return threads.deferToThread(self._write_rows, partition, rows)
+
+        def _written(_):
+            if self.stats is not None:
+                self.stats.inc_value('parquet/rows_written', len(rows))
+                self.stats.inc_value('parquet/row_groups')
+
+        def _failed(failure):
+            self._write_failed.setdefault(partition, failure)
+            if self.stats is not None:
+                self.stats.inc_value('parquet/write_errors')
+            logger.error(f"Error writing {len(rows)} products to Parquet partition {partition}: {failure.value}")
 
-        if category and slug:
-            category_dir = os.path.join(self.data_dir, category)
-            os.makedirs(category_dir, exist_ok=True)
+        self._writes.addCallback(_write)
+        self._writes.addCallbacks(_written, _failed)
 
-            filename = os.path.join(category_dir, f"{slug}.json")
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(dict(item), f, ensure_ascii=False, indent=2)
+    def _write_rows(self, partition, rows):
+        # Выполняется в пуле потоков реактора; записи идут строго по очереди
+        columns = list(zip(*rows))
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+        entry = self._writers.get(partition)
+        if entry is None:
+            region, date = partition
+            directory = os.path.join(self.directory, f'region_uuid={region}', f'date={date}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{self.run_id}.parquet')
+            writer = pyarrow.parquet.ParquetWriter(f'{path}.part', self.schema, compression=self.compression)
+            entry = self._writers[partition] = (writer, path)
+        entry[0].write_table(table, row_group_size=self.row_group_size)
 
-        return item
\ No newline at end of file
+    def _commit(self):
+        saved = 0
+        for partition, (writer, path) in self._writers.items():
+            failure = self._write_failed.get(partition)
+            if failure is None:
+                writer.close()
+                os.replace(f'{path}.part', path)
+                saved += 1
+                continue
+            try:
+                writer.close()
+            except Exception as e:
+                logger.warning(f"Error closing {path}.part: {e}")
+            logger.error(f"Products were not fully written, keeping {path}.part: {failure.value}")
+        if self.stats is not None:
+            self.stats.set_value('parquet/files', saved)
+        logger.info(f"Saved {saved} Parquet file(s) to {self.directory}")
@@ -0,0 +1,156 @@
+"""Индекс последних известных цен и наличия товаров.
+
+Ключ товара - 64-битный хеш (регион, RPC). Записи снимка лежат в
+отсортированных по ключу массивах (ключ, цена, хеш sale_tag, флаги) - около
+21 байта на товар, поиск бинарный. Товары, которых не было в снимке,
+копятся в словаре и вливаются в массивы при сохранении.
+
+Формат снимка: заголовок (магия, версия, порядок байт, число записей), затем
+столбцы ключей, цен, хешей и флагов целиком, поэтому загрузка - это чтение
+четырёх блоков байт без разбора по записям.
+"""
+import hashlib
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'APIX'
+VERSION = 1
+_HEADER = struct.Struct('<4sBBQ')
+
+IN_STOCK = 1
+
+# Типы событий
+PRICE_DROP = 'price_drop'
+PRICE_RISE = 'price_rise'
+OUT_OF_STOCK = 'out_of_stock'
+BACK_IN_STOCK = 'back_in_stock'
+NEW_PROMO = 'new_promo'
+
+
+def product_key(region, rpc):
+    digest = hashlib.blake2b(f"{region}\0{rpc}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def tag_hash(sale_tag):
+    return zlib.crc32(sale_tag.encode('utf-8')) if sale_tag else 0
+
+
+class PriceIndex:
+
+    def __init__(self):
+        self._keys = array('Q')
+        self._prices = array('d')
+        self._tags = array('I')
+        self._flags = bytearray()
+        # Товары, которых нет в снимке: ключ -> (цена, хеш sale_tag, флаги)
+        self._new = {}
+
+    def __len__(self):
+        return len(self._keys) + len(self._new)
+
+    @classmethod
+    def load(cls, path):
+        """Загружает снимок. Повреждённый или обрезанный снимок (например,
+        после падения) пропускается с предупреждением: индекс начинается
+        заново, и события по товарам появятся со следующего обхода."""
+        if not os.path.exists(path):
+            return cls()
+        try:
+            return cls._read(path)
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Ignoring price index snapshot {path}: {e}")
+            return cls()
+
+    @classmethod
+    def _read(cls, path):
+        index = cls()
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                raise ValueError(f"{path} has a truncated header")
+            magic, version, little, count = _HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a price index snapshot")
+            for column, width in ((index._keys, 8), (index._prices, 8), (index._tags, 4)):
+                column.frombytes(f.read(count * width))
+                if bool(little) != (sys.byteorder == 'little'):
+                    column.byteswap()
+            index._flags = bytearray(f.read(count))
+        if len(index._flags) != count or len(index._tags) != count:
+            raise ValueError(f"Price index snapshot {path} is truncated")
+        return index
+
+    def _position(self, key):
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            return position
+        return None
+
+    def get(self, key):
+        position = self._position(key)
+        if position is None:
+            return self._new.get(key)
+        return self._prices[position], self._tags[position], self._flags[position]
+
+    def set(self, key, price, tag, flags):
+        position = self._position(key)
+        if position is None:
+            self._new[key] = (price, tag, flags)
+        else:
+            self._prices[position] = price
+            self._tags[position] = tag
+            self._flags[position] = flags
+
+    def save(self, path):
+        """Атомарно записывает снимок: временный файл, fsync, rename."""
+        if self._new:
+            self._merge()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, sys.byteorder == 'little', len(self._keys)))
+            for column in (self._keys, self._prices, self._tags):
+                column.tofile(f)
+            f.write(self._flags)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _merge(self):
+        keys = self._keys.tolist() + list(self._new)
+        values = [(self._prices[i], self._tags[i], self._flags[i]) for i in range(len(self._keys))]
+        values.extend(self._new.values())
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._keys = array('Q', [keys[i] for i in order])
+        self._prices = array('d', [values[i][0] for i in order])
+        self._tags = array('I', [values[i][1] for i in order])
+        self._flags = bytearray(values[i][2] for i in order)
+        self._new = {}
+
+
+def price_events(previous, price, sale_tag, in_stock):
+    """События изменения товара относительно записи индекса previous."""
+    old_price, old_tag, old_flags = previous
+    events = []
+    if price < old_price:
+        events.append(PRICE_DROP)
+    elif price > old_price:
+        events.append(PRICE_RISE)
+    old_in_stock = bool(old_flags & IN_STOCK)
+    if old_in_stock and not in_stock:
+        events.append(OUT_OF_STOCK)
+    elif in_stock and not old_in_stock:
+        events.append(BACK_IN_STOCK)
+    if sale_tag and tag_hash(sale_tag) != old_tag:
+        events.append(NEW_PROMO)
+    return events
@@ -0,0 +1,188 @@
+import os
+import random
+import time
+
+from twisted.internet import defer
+
+
+DEFAULT_PROXIES = [
+    'http://45.61.139.48:8000',
+    'http://103.177.45.3:80',
+    'http://20.210.113.32:80',
+    'http://45.79.189.78:80',
+]
+
+
+def load_proxies(settings):
+    """Список прокси: файл PROXY_LIST_FILE, переменная окружения PROXY_LIST_ENV
+    (через запятую или перевод строки) или PROXY_LIST из настроек."""
+    proxies = []
+    path = settings.get('PROXY_LIST_FILE')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            proxies.extend(f.read().split())
+
+    env_name = settings.get('PROXY_LIST_ENV', 'ALKOTEKA_PROXIES')
+    if env_name and os.environ.get(env_name):
+        proxies.extend(os.environ[env_name].replace(',', ' ').split())
+
+    if not proxies:
+        proxies = settings.getlist('PROXY_LIST', DEFAULT_PROXIES)
+
+    proxies = [p if '://' in p else f'http://{p}' for p in proxies if not p.startswith('#')]
+    return list(dict.fromkeys(proxies))
+
+
+class ProxyHealth:
+    """Здоровье одного прокси: скользящие средние с затуханием."""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.latency = None
+        self.success_rate = 1.0
+        self.bans = 0.0
+        self.in_flight = 0
+        self.strikes = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.status_403 = 0
+        self.status_429 = 0
+        self.failures = 0
+        self.cooldowns = 0
+
+    def weight(self):
+        latency = self.latency if self.latency is not None else 1.0
+        return max(self.success_rate, 0.01) / (1.0 + latency) / (1.0 + self.bans)
+
+
+class ProxyManager:
+    """Выбор прокси с учётом здоровья.
+
+    Прокси выбирается случайно с весом по доле успешных ответов, задержке и
+    числу недавних 403/429. Плохой прокси не удаляется, а уходит на паузу,
+    которая растёт экспоненциально при повторных проблемах. Число
+    одновременных запросов через один прокси ограничено max_per_proxy.
+    """
+
+    def __init__(self, proxies, max_per_proxy=2, decay=0.8, cooldown=30.0,
+                 max_cooldown=600.0, min_success_rate=0.5):
+        self.proxies = {proxy: ProxyHealth(proxy) for proxy in proxies}
+        self.max_per_proxy = max_per_proxy
+        self.decay = decay
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.min_success_rate = min_success_rate
+        self._waiters = []
+        self._wakeup_call = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            load_proxies(settings),
+            max_per_proxy=settings.getint('PROXY_MAX_CONCURRENCY', 2),
+            decay=settings.getfloat('PROXY_HEALTH_DECAY', 0.8),
+            cooldown=settings.getfloat('PROXY_COOLDOWN', 30.0),
+            max_cooldown=settings.getfloat('PROXY_COOLDOWN_MAX', 600.0),
+            min_success_rate=settings.getfloat('PROXY_MIN_SUCCESS_RATE', 0.5),
+        )
+
+    def acquire(self):
+        """Возвращает прокси для запроса или None, если все заняты или на паузе."""
+        now = time.monotonic()
+        candidates = [
+            health for health in self.proxies.values()
+            if health.cooldown_until <= now and health.in_flight < self.max_per_proxy
+        ]
+        if not candidates:
+            return None
+
+        health = random.choices(candidates, weights=[h.weight() for h in candidates])[0]
+        health.in_flight += 1
+        health.requests += 1
+        return health.proxy
+
+    def wait(self):
+        """Deferred, который сработает, когда какой-то прокси может освободиться."""
+        d = defer.Deferred()
+        self._waiters.append(d)
+        self._schedule_wakeup()
+        return d
+
+    def release(self, proxy, latency=None, status=None, error=False):
+        health = self.proxies.get(proxy)
+        if health is None:
+            return
+        health.in_flight = max(0, health.in_flight - 1)
+
+        banned = status in (403, 429)
+        failed = error or banned or (status is not None and status >= 500)
+
+        if latency is not None and not error:
+            if health.latency is None:
+                health.latency = latency
+            else:
+                health.latency = self.decay * health.latency + (1 - self.decay) * latency
+        health.success_rate = self.decay * health.success_rate + (1 - self.decay) * (0.0 if failed else 1.0)
+        health.bans = self.decay * health.bans + (1.0 if banned else 0.0)
+
+        if status == 403:
+            health.status_403 += 1
+        elif status == 429:
+            health.status_429 += 1
+        if failed:
+            health.failures += 1
+
+        if banned or (failed and health.success_rate < self.min_success_rate):
+            self._cool_down(health)
+        elif not failed:
+            health.strikes = 0
+
+        self._wake_waiters()
+
+    def cancel(self, proxy):
+        """Освобождает прокси запроса, который не ходил в сеть (ответ из кэша)."""
+        health = self.proxies.get(proxy)
+        if health is None:
+            return
+        health.in_flight = max(0, health.in_flight - 1)
+        health.requests = max(0, health.requests - 1)
+        self._wake_waiters()
+
+    def _cool_down(self, health):
+        health.strikes += 1
+        health.cooldowns += 1
+        pause = min(self.cooldown * 2 ** (health.strikes - 1), self.max_cooldown)
+        health.cooldown_until = time.monotonic() + pause
+
+    def _wake_waiters(self):
+        waiters, self._waiters = self._waiters, []
+        for d in waiters:
+            d.callback(None)
+
+    def _schedule_wakeup(self):
+        # Если все прокси на паузе, освобождений не будет: будим ожидающих
+        # к окончанию ближайшей паузы
+        from twisted.internet import reactor
+
+        if self._wakeup_call is not None and self._wakeup_call.active():
+            return
+        now = time.monotonic()
+        delay = min((h.cooldown_until - now for h in self.proxies.values()), default=1.0)
+        self._wakeup_call = reactor.callLater(max(delay, 0.1), self._wake_waiters)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return {
+            proxy: {
+                'requests': health.requests,
+                'in_flight': health.in_flight,
+                'success_rate': round(health.success_rate, 3),
+                'latency_ms': round(health.latency * 1000, 1) if health.latency is not None else None,
+                'status_403': health.status_403,
+                'status_429': health.status_429,
+                'failures': health.failures,
+                'cooldowns': health.cooldowns,
+                'cooling_down': health.cooldown_until > now,
+            }
+            for proxy, health in self.proxies.items()
+        }
@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import zlib
+
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from twisted.internet import defer
+from w3lib.url import canonicalize_url
+
+
+class Corpus:
+    """Корпус записанных ответов в одном SQLite-файле.
+
+    Ответы хранятся по каноническому URL (порядок параметров запроса не
+    важен), тела сжаты zlib.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL
+            )
+        """)
+
+    def add(self, url, status, headers, body):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO responses (url, status, headers, body) VALUES (?, ?, ?, ?)',
+            (canonicalize_url(url), status, json.dumps(headers), zlib.compress(body))
+        )
+
+    def get(self, url):
+        row = self._conn.execute(
+            'SELECT status, headers, body FROM responses WHERE url = ?', (canonicalize_url(url),)
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, body = row
+        return status, json.loads(headers), zlib.decompress(body)
+
+    def items(self):
+        for url, status, headers, body in self._conn.execute(
+                'SELECT url, status, headers, body FROM responses'):
+            yield url, status, json.loads(headers), zlib.decompress(body)
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+def _plain_headers(headers):
+    return {
+        key.decode('latin-1'): [value.decode('latin-1') for value in values]
+        for key, values in headers.items()
+    }
+
+
+class ResponseRecorderMiddleware:
+    """Записывает ответы сайта в корпус REPLAY_RECORD_PATH для офлайн-прогонов."""
+
+    def __init__(self, path):
+        self.corpus = Corpus(path)
+        self.recorded = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('REPLAY_RECORD_PATH')
+        if not path:
+            raise NotConfigured
+        return cls(path)
+
+    def process_response(self, request, response, spider):
+        if response.status < 400:
+            self.corpus.add(request.url, response.status, _plain_headers(response.headers), response.body)
+            self.recorded += 1
+            if self.recorded % 500 == 0:
+                self.corpus.commit()
+        return response
+
+    def close_spider(self, spider):
+        self.corpus.close()
+
+
+class ReplayDownloadHandler:
+    """Обработчик загрузки, который отдаёт ответы из корпуса REPLAY_PATH.
+
+    Подключается для схем http/https через DOWNLOAD_HANDLERS; паук при этом
+    не меняется. На URL, которого нет в корпусе, отвечает 404.
+    """
+
+    lazy = False
+
+    def __init__(self, settings, crawler=None):
+        path = settings.get('REPLAY_PATH')
+        if not path:
+            raise NotConfigured('REPLAY_PATH is not set')
+        self.corpus = Corpus(path)
+        self.stats = crawler.stats if crawler is not None else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        found = self.corpus.get(request.url)
+        if found is None:
+            status, headers, body = 404, {}, b''
+            if self.stats is not None:
+                self.stats.inc_value('replay/miss')
+        else:
+            status, headers, body = found
+            if self.stats is not None:
+                self.stats.inc_value('replay/hit')
+
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        return defer.succeed(respcls(
+            url=request.url, status=status, headers=headers, body=body, request=request
+        ))
+
+    def close(self):
+        self.corpus.close()
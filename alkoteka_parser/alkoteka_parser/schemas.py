@@ -0,0 +1,81 @@
+"""Типизированные схемы ответов web-api.
+
+Описывают только поля, которые читают transform_product_data, парсинг списка
+и логирование. При декодировании через msgspec остальные поля ответа
+пропускаются, а на выходе получаются обычные dict, так что код преобразования
+не меняется.
+"""
+from typing import Any, List, Optional, TypedDict
+
+
+class FilterLabel(TypedDict, total=False):
+    filter: Any
+    title: Any
+
+
+class PriceDetail(TypedDict, total=False):
+    title: Any
+
+
+class DescriptionValue(TypedDict, total=False):
+    name: Any
+    enabled: Any
+
+
+class DescriptionBlock(TypedDict, total=False):
+    code: Any
+    title: Any
+    type: Any
+    unit: Any
+    min: Any
+    max: Any
+    values: Optional[List[Optional[DescriptionValue]]]
+
+
+class TextBlock(TypedDict, total=False):
+    content: Any
+
+
+class ParentCategory(TypedDict, total=False):
+    name: Any
+
+
+class Category(TypedDict, total=False):
+    name: Any
+    parent: Optional[ParentCategory]
+
+
+class ProductResult(TypedDict, total=False):
+    uuid: Any
+    slug: Any
+    name: Any
+    subname: Any
+    new: Any
+    gift_package: Any
+    price: Any
+    prev_price: Any
+    available: Any
+    quantity_total: Any
+    image_url: Any
+    vendor_code: Any
+    filter_labels: Optional[List[Optional[FilterLabel]]]
+    price_details: Optional[List[Optional[PriceDetail]]]
+    description_blocks: Optional[List[Optional[DescriptionBlock]]]
+    text_blocks: Optional[List[Optional[TextBlock]]]
+    category: Optional[Category]
+
+
+class ProductResponse(TypedDict, total=False):
+    results: Optional[ProductResult]
+
+
+class ProductListMeta(TypedDict, total=False):
+    current_page: Any
+    last_page: Any
+    per_page: Any
+    total: Any
+
+
+class ProductListResponse(TypedDict, total=False):
+    results: Optional[List[ProductResult]]
+    meta: Optional[ProductListMeta]
@@ -5,13 +5,237 @@ NEWSPIDER_MODULE = 'alkoteka_parser.spiders'
 
 ROBOTSTXT_OBEY = False
 
-# Настройки из custom_settings паука можно перенести сюда
+# Повторы делает BackoffRetryMiddleware: RETRY_TIMES повторов на запрос, если
+# для его типа (meta['endpoint']) нет своего числа в RETRY_ENDPOINT_TIMES.
+# Пауза перед N-м повтором - RETRY_BACKOFF_BASE * 2^(N-1) секунд со случайной
+# добавкой, не больше RETRY_BACKOFF_MAX. Коды из RETRY_PERMANENT_HTTP_CODES
+# не повторяются и считаются в retry/permanent/<код>
 RETRY_TIMES = 3
-RETRY_HTTP_CODES = [500, 502, 503, 504, 400, 403, 404, 408, 429]
-CONCURRENT_REQUESTS = 4
-DOWNLOAD_DELAY = 1
+RETRY_HTTP_CODES = [500, 502, 503, 504, 400, 403, 408, 429]
+RETRY_PERMANENT_HTTP_CODES = [404]
+RETRY_ENDPOINT_TIMES = {'category': 3, 'list': 5, 'detail': 2}
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 60.0
 LOG_LEVEL = 'INFO'
 
+# Общий потолок параллельности. Начальные лимит и пауза каждого слота
+# загрузчика задают CONCURRENT_REQUESTS_PER_DOMAIN и DOWNLOAD_DELAY, дальше их
+# подстраивает AdaptiveThrottleMiddleware
+CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS_PER_DOMAIN = 2
+DOWNLOAD_DELAY = 0.5
+
+# Постраничная загрузка списка товаров: размер страницы и сколько страниц
+# одной категории запрашивается одновременно. Страница, без которой обход
+# категории не может продолжиться (первая или при отсутствии метаданных),
+# после исчерпания повторов запрашивается заново, всего до
+# PRODUCT_LIST_PAGE_ATTEMPTS раз; неудачи считаются в product_list/failed
+PRODUCT_LIST_PER_PAGE = 100
+PRODUCT_LIST_CONCURRENT_PAGES = 4
+PRODUCT_LIST_PAGE_ATTEMPTS = 3
+
+# Режим обхода: 'full' - отдельный запрос карточки каждого товара,
+# 'fast' - товары собираются из ответа списка. В режиме 'fast' карточка всё же
+# запрашивается, если в ответе списка нет какого-либо поля из
+# LIST_ONLY_REQUIRED_FIELDS (поля results API)
+CRAWL_MODE = 'full'
+LIST_ONLY_REQUIRED_FIELDS = ['name', 'price', 'available', 'quantity_total', 'uuid']
+
+# Лимит одновременных запросов на регион (у каждого региона свой слот
+# загрузчика); 0 - использовать CONCURRENT_REQUESTS_PER_DOMAIN
+REGION_CONCURRENT_REQUESTS = 0
+
+DOWNLOADER_MIDDLEWARES = {
+    'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
+    'alkoteka_parser.middlewares.BackoffRetryMiddleware': 550,
+    'alkoteka_parser.middlewares.ConditionalRequestMiddleware': 560,
+    # Оба должны видеть ответы 403/429 раньше BackoffRetryMiddleware (550)
+    'alkoteka_parser.middlewares.ProxyPoolMiddleware': 570,
+    'alkoteka_parser.middlewares.AdaptiveThrottleMiddleware': 580,
+    'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+    'alkoteka_parser.httpcache.EndpointHttpCacheMiddleware': 900,
+    'alkoteka_parser.replay.ResponseRecorderMiddleware': 950,
+}
+
+SPIDER_MIDDLEWARES = {
+    # Ближе всех к пауку, чтобы мерить только сами колбэки
+    'alkoteka_parser.middlewares.CallbackTimingMiddleware': 990,
+}
+
+EXTENSIONS = {
+    'alkoteka_parser.extensions.MetricsExtension': 500,
+    'alkoteka_parser.backpressure.BackpressureExtension': 510,
+}
+
+# Разбор и преобразование карточек товаров в пуле процессов, чтобы не
+# упираться в одно ядро. TRANSFORM_POOL_WORKERS = 0 - по числу ядер минус одно;
+# карточки передаются в пул пачками по TRANSFORM_POOL_BATCH_SIZE, неполная
+# пачка уходит через TRANSFORM_POOL_BATCH_DELAY секунд
+TRANSFORM_POOL_ENABLED = False
+TRANSFORM_POOL_WORKERS = 0
+TRANSFORM_POOL_BATCH_SIZE = 32
+TRANSFORM_POOL_BATCH_DELAY = 0.05
+TRANSFORM_POOL_START_METHOD = 'spawn'
+
+# Доля товаров, сведения о которых пишутся в лог (0 - не писать, 1 - все)
+PRODUCT_LOG_SAMPLE_RATE = 0.0
+
+# Метрики: время колбэков и пайплайнов, время загрузки по типу запроса и
+# прокси, очереди и слоты загрузчика. Выгружаются раз в METRICS_INTERVAL
+# секунд в METRICS_SNAPSHOT_PATH (формат 'prometheus' или 'statsd'), по HTTP
+# на METRICS_HOST:METRICS_PORT/metrics (0 - не поднимать) и/или по UDP
+# в StatsD по адресу METRICS_STATSD_ADDRESS ('host:port')
+METRICS_ENABLED = False
+METRICS_PREFIX = 'alkoteka'
+METRICS_INTERVAL = 10.0
+METRICS_SNAPSHOT_PATH = 'product_data/metrics.prom'
+METRICS_SNAPSHOT_FORMAT = 'prometheus'
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 0
+METRICS_STATSD_ADDRESS = None
+
+# Декодер JSON: 'auto' (msgspec, затем orjson, затем json), 'msgspec',
+# 'orjson' или 'json'. JSON_TYPED_DECODE - декодировать ответы по схемам из
+# schemas.py (только с msgspec)
+JSON_DECODER = 'auto'
+JSON_TYPED_DECODE = True
+
 ITEM_PIPELINES = {
-    'alkoteka_parser.pipelines.AlkotekaParserPipeline': 300,
-}
\ No newline at end of file
+    'alkoteka_parser.pipelines.IncrementalPipeline': 200,
+    'alkoteka_parser.pipelines.PriceChangePipeline': 250,
+    'alkoteka_parser.pipelines.JsonLinesWriterPipeline': 300,
+    'alkoteka_parser.pipelines.ParquetExportPipeline': 310,
+}
+
+# Запись товаров в JSONL: файл пишется пачками в фоне и атомарно
+# подменяется по завершении обхода
+PRODUCTS_JSONL_ENABLED = True
+PRODUCTS_JSONL_PATH = 'product_data/all_products.jsonl'
+PRODUCTS_JSONL_BATCH_ITEMS = 500
+PRODUCTS_JSONL_BATCH_BYTES = 1024 * 1024
+PRODUCTS_JSONL_FLUSH_INTERVAL = 5.0
+
+# Выгрузка в Parquet (нужен pyarrow): каталоги PARQUET_DIR/region_uuid=.../
+# date=..., по файлу на запуск. Группы строк по PARQUET_ROW_GROUP_SIZE.
+# Работает вместе с JSONL; JSONL отключается PRODUCTS_JSONL_ENABLED=False
+PARQUET_ENABLED = False
+PARQUET_DIR = 'product_data/parquet'
+PARQUET_ROW_GROUP_SIZE = 50000
+PARQUET_COMPRESSION = 'zstd'
+
+# События изменения цен (-s PRICE_EVENTS_ENABLED=True): последние известные
+# цены и наличие хранятся в снимке PRICE_EVENTS_SNAPSHOT_PATH, события
+# price_drop/price_rise/out_of_stock/back_in_stock/new_promo пишутся в
+# PRICE_EVENTS_PATH (JSONL) и/или по UDP на PRICE_EVENTS_UDP_ADDRESS (host:port)
+PRICE_EVENTS_ENABLED = False
+PRICE_EVENTS_SNAPSHOT_PATH = 'product_data/price_index.bin'
+PRICE_EVENTS_PATH = 'product_data/price_events.jsonl'
+PRICE_EVENTS_UDP_ADDRESS = None
+
+# Продолжение прерванного обхода: очередь карточек товаров, состояние
+# пагинации и записанные товары хранятся в RESUME_STATE_PATH. Повторный
+# запуск с теми же категориями и регионами продолжает незавершённый обход и
+# дописывает product_data/all_products.jsonl.part (нужен JSONL-вывод).
+# Карточки подаются в загрузчик пачками по RESUME_BATCH_SIZE
+RESUME_ENABLED = False
+RESUME_STATE_PATH = 'product_data/frontier.sqlite3'
+RESUME_BATCH_SIZE = 1000
+
+# HTTP-кэш категорий и списков товаров (-s HTTPCACHE_ENABLED=True): срок
+# свежести в секундах по типу запроса, 0 - не кэшировать. Ответы хранятся
+# сжатыми в .scrapy/HTTPCACHE_DIR, кэш ограничен HTTPCACHE_MAX_BYTES байт
+HTTPCACHE_ENABLED = False
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_POLICY = 'alkoteka_parser.httpcache.EndpointTTLPolicy'
+HTTPCACHE_STORAGE = 'alkoteka_parser.httpcache.LRUFilesystemCacheStorage'
+HTTPCACHE_GZIP = True
+HTTPCACHE_ENDPOINT_TTL = {'category': 86400, 'list': 900, 'detail': 0}
+HTTPCACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Не запрашивать HTML-страницы категорий: слаг берётся из start_url
+CATEGORY_SKIP_HTML = False
+
+# Распределённый обход: координатор (python -m alkoteka_parser.distributed
+# seed) кладёт шарды (регион, категория, страница) в общую очередь
+# DISTRIBUTED_QUEUE_PATH, воркеры (процессы паука с DISTRIBUTED_ENABLED=True)
+# берут до DISTRIBUTED_SHARDS_IN_FLIGHT шардов в аренду на
+# DISTRIBUTED_LEASE_TIMEOUT секунд и пишут товары в свои файлы по шаблону
+# DISTRIBUTED_OUTPUT_PATTERN; merge сливает их в один. Имя воркера -
+# DISTRIBUTED_WORKER_ID, по умолчанию хост-pid
+DISTRIBUTED_ENABLED = False
+DISTRIBUTED_QUEUE_PATH = 'product_data/queue.sqlite3'
+DISTRIBUTED_WORKER_ID = None
+DISTRIBUTED_OUTPUT_PATTERN = 'product_data/shards/products-{worker}.jsonl'
+DISTRIBUTED_SHARDS_IN_FLIGHT = 4
+DISTRIBUTED_LEASE_TIMEOUT = 300
+DISTRIBUTED_MAX_ATTEMPTS = 3
+
+# Инкрементальный обход: на выход попадают только новые и изменившиеся
+# товары, снятые с продажи пишутся в INCREMENTAL_TOMBSTONES_PATH.
+# Включается через -s INCREMENTAL_ENABLED=True
+INCREMENTAL_ENABLED = False
+INCREMENTAL_STORE_PATH = 'product_data/incremental.sqlite3'
+INCREMENTAL_TOMBSTONES_PATH = 'product_data/delisted.jsonl'
+# Условные запросы карточек по ETag/Last-Modified, если API их отдаёт
+INCREMENTAL_CONDITIONAL_REQUESTS = True
+
+# Пул прокси (при -a use_proxy=True): файл со списком, переменная окружения
+# (через запятую) или PROXY_LIST. Прокси выбираются с весом по здоровью, после
+# 403/429 и серий ошибок уходят на паузу от PROXY_COOLDOWN до PROXY_COOLDOWN_MAX
+# секунд, через один прокси идёт не больше PROXY_MAX_CONCURRENCY запросов
+PROXY_LIST_FILE = None
+PROXY_LIST_ENV = 'ALKOTEKA_PROXIES'
+PROXY_LIST = [
+    'http://45.61.139.48:8000',
+    'http://103.177.45.3:80',
+    'http://20.210.113.32:80',
+    'http://45.79.189.78:80',
+]
+PROXY_MAX_CONCURRENCY = 2
+PROXY_HEALTH_DECAY = 0.8
+PROXY_MIN_SUCCESS_RATE = 0.5
+PROXY_COOLDOWN = 30.0
+PROXY_COOLDOWN_MAX = 600.0
+
+# AIMD-регулятор скорости: растит параллельность и уменьшает паузу слота, пока
+# ответы успешные, и резко сбрасывает их на 429/403/5xx с учётом Retry-After.
+# ADAPTIVE_THROTTLE_SPLIT - отдельные бюджеты по типу запроса и прокси
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_SPLIT = True
+ADAPTIVE_THROTTLE_MIN_CONCURRENCY = 1
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 16
+ADAPTIVE_THROTTLE_MIN_DELAY = 0.0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60.0
+ADAPTIVE_THROTTLE_DELAY_STEP = 0.1
+ADAPTIVE_THROTTLE_INCREASE_EVERY = 10
+ADAPTIVE_THROTTLE_DECREASE_FACTOR = 0.5
+ADAPTIVE_THROTTLE_LATENCY_TOLERANCE = 1.5
+
+# Загрузка запросов web-api по HTTP/2 (нужен httpx[http2]), подключается
+# через DOWNLOAD_HANDLERS: {"https": "alkoteka_parser.http2.HttpxDownloadHandler"}.
+# HTTP2_ENDPOINTS - типы запросов (meta['endpoint']), которые идут через
+# httpx, остальные загружаются обычным HTTP/1.1; HTTP2_MAX_CONNECTIONS -
+# соединений на прокси
+HTTP2_ENDPOINTS = ['detail']
+HTTP2_MAX_CONNECTIONS = 4
+HTTP2_VERIFY_CERTIFICATES = False
+
+# Ограничение памяти на больших категориях: карточки подаются в планировщик
+# порциями, пока в нём не больше BACKPRESSURE_SCHEDULER_DEPTH запросов; при
+# BACKPRESSURE_PENDING_DETAILS ждущих карточек откладываются страницы списка;
+# обход встаёт на паузу, пока товаров на запись больше
+# BACKPRESSURE_WRITER_HIGH_WATER байт. BACKPRESSURE_MEMORY_MB (0 - без
+# бюджета) уменьшает эти лимиты до 10%, когда RSS подходит к бюджету.
+# Включается явно, как TRANSFORM_POOL_ENABLED
+BACKPRESSURE_ENABLED = False
+BACKPRESSURE_SCHEDULER_DEPTH = 1000
+BACKPRESSURE_PENDING_DETAILS = 20000
+BACKPRESSURE_WRITER_HIGH_WATER = 32 * 1024 * 1024
+BACKPRESSURE_MEMORY_MB = 0
+BACKPRESSURE_INTERVAL = 1.0
+
+# Офлайн-прогоны: REPLAY_RECORD_PATH - куда ResponseRecorderMiddleware пишет
+# ответы сайта; REPLAY_PATH - корпус, из которого отдаёт ответы
+# ReplayDownloadHandler (подключается через DOWNLOAD_HANDLERS)
+REPLAY_RECORD_PATH = None
+REPLAY_PATH = None
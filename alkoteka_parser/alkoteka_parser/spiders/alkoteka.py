@@ -1,476 +1,636 @@
-import time
+from collections import deque
 
 import scrapy
-import json
 from urllib.parse import urlparse
-import os
-from random import choice
-from scrapy.downloadermiddlewares.retry import RetryMiddleware
-from scrapy.utils.response import response_status_message
+from random import random
 import logging
 from typing import Optional, List, Dict, Any
 
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet.task import LoopingCall
+
+from alkoteka_parser.backpressure import get_backpressure
+from alkoteka_parser.distributed import ShardQueue
+from alkoteka_parser.frontier import frontier_scope, get_frontier
+from alkoteka_parser.incremental import NotModified
+from alkoteka_parser.jsoncodec import JsonCodec
+from alkoteka_parser.middlewares import RequestDeferred
+from alkoteka_parser.transform import TransformPool, transform_product_data
+
 class AlkotekaProductSpider(scrapy.Spider):
     name = 'alkoteka'
 
     custom_settings = {
-        'RETRY_TIMES': 3,
-        'RETRY_HTTP_CODES': [500, 502, 503, 504, 400, 403, 404, 408, 429],
-        'CONCURRENT_REQUESTS': 4,
-        'DOWNLOAD_DELAY': 1,
         'LOG_LEVEL': 'INFO'
     }
 
-    def __init__(self, start_url=None, region_uuid='4a70f9e0-46ae-11e7-83ff-00155d026416',
-                 use_proxy=False, *args, **kwargs):
+    default_region_uuid = '4a70f9e0-46ae-11e7-83ff-00155d026416'
+
+    def __init__(self, start_url=None, region_uuid=None, regions_file=None,
+                 use_proxy=False, per_page=None, mode=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.start_urls = [start_url] if start_url else ['https://alkoteka.com/catalog/krepkiy-alkogol',
+        self.start_urls = [url.strip() for url in start_url.split(',')] if start_url else ['https://alkoteka.com/catalog/krepkiy-alkogol',
                                                          'https://alkoteka.com/catalog/slaboalkogolnye-napitki-2',
                                                          'https://alkoteka.com/catalog/vino'
                                                         ]
-        self.region_uuid = region_uuid
-        self.use_proxy = use_proxy
-        self.data_dir = 'product_data'
-        self.proxy_pool = self._init_proxy_pool() if use_proxy else None
-
-        self._configure_middlewares()
-
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-            self.logger.info(f"Created directory {self.data_dir}")
-
-    def _init_proxy_pool(self):
-        return [
-            'http://45.61.139.48:8000',
-            'http://103.177.45.3:80',
-            'http://20.210.113.32:80',
-            'http://45.79.189.78:80'
-        ]
-
-    def _configure_middlewares(self):
-        if self.use_proxy:
-            if not hasattr(self, 'custom_settings'):
-                self.custom_settings = {}
-            self.custom_settings['DOWNLOADER_MIDDLEWARES'] = {
-                'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
-                'alkoteka_parser.middlewares.CustomRetryMiddleware': 550,
-            }
-
+        # Регионы (city_uuid): через запятую в region_uuid и/или по одному
+        # на строку в regions_file
+        self.region_uuids = self._load_regions(region_uuid, regions_file)
+        self.region_uuid = self.region_uuids[0]
+        # Аргументы из командной строки приходят строками ('True'/'False')
+        self.use_proxy = str(use_proxy).lower() in ('1', 'true', 'yes')
+        # Размер страницы списка товаров; по умолчанию PRODUCT_LIST_PER_PAGE
+        self.per_page = int(per_page) if per_page else None
+        # full - карточка каждого товара запрашивается отдельно,
+        # fast - товары собираются прямо из ответа списка; по умолчанию CRAWL_MODE
+        self.mode = mode
+        # Состояние пагинации по (регион, категория): следующая страница и последняя
+        self._list_pages = {}
+        # (регион, категория), у которых не загрузилась страница списка
+        self.list_failures = set()
+        self.transform_pool = None
+        # Очередь карточек на диске в режиме продолжения (RESUME_ENABLED)
+        self.frontier = None
+        # Общая очередь шардов в распределённом режиме (DISTRIBUTED_ENABLED):
+        # шард -> число ещё не обработанных карточек (None - список не разобран)
+        self.shard_queue = None
+        self._shards = {}
+        self._shard_renewal = None
+        # Ограничение памяти (BACKPRESSURE_ENABLED): карточки ждут своей
+        # очереди как кортежи (регион, категория, слаг), а страницы списка
+        # откладываются, пока таких карточек слишком много
+        self.backpressure = None
+        self._pending_details = deque()
+        self._details_in_flight = 0
+        self._held_list_requests = deque()
+        # Каталоги вывода создают сами пайплайны и хранилища при открытии
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        return spider
+
+    def _load_regions(self, region_uuid, regions_file):
+        regions = []
+        if region_uuid:
+            regions.extend(r.strip() for r in str(region_uuid).split(','))
+        if regions_file:
+            with open(regions_file, encoding='utf-8') as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        regions.append(line)
+
+        regions = list(dict.fromkeys(r for r in regions if r))
+        return regions or [self.default_region_uuid]
 
     def start_requests(self):
+        if self.per_page is None:
+            self.per_page = self.settings.getint('PRODUCT_LIST_PER_PAGE', 100)
+        self.list_concurrency = max(1, self.settings.getint('PRODUCT_LIST_CONCURRENT_PAGES', 4))
+        self.codec = JsonCodec.from_settings(self.settings)
+        # Доля товаров, сведения о которых пишутся в лог (0 - не писать)
+        self.product_log_rate = self.settings.getfloat('PRODUCT_LOG_SAMPLE_RATE', 0.0)
+        # Разбор карточек в пуле процессов вместо потока реактора
+        if self.settings.getbool('TRANSFORM_POOL_ENABLED') and self.transform_pool is None:
+            self.transform_pool = TransformPool.from_settings(self.settings, self.crawler.stats)
+        if self.mode is None:
+            self.mode = self.settings.get('CRAWL_MODE', 'full')
+        if self.mode not in ('full', 'fast'):
+            raise ValueError(f"Unknown crawl mode: {self.mode}")
+        self.list_required_fields = self.settings.getlist(
+            'LIST_ONLY_REQUIRED_FIELDS', ['name', 'price', 'available', 'quantity_total', 'uuid']
+        )
+        # Запросы каждого региона идут через свой слот загрузчика; лимит
+        # одновременных запросов на слот задаёт REGION_CONCURRENT_REQUESTS
+        region_concurrency = self.settings.getint('REGION_CONCURRENT_REQUESTS', 0)
+        if region_concurrency > 0:
+            self.max_concurrent_requests = region_concurrency
+        self.logger.info(f"Crawling {len(self.region_uuids)} region(s)")
+
+        if self.settings.getbool('DISTRIBUTED_ENABLED'):
+            if self.settings.getbool('RESUME_ENABLED'):
+                raise ValueError("DISTRIBUTED_ENABLED and RESUME_ENABLED cannot be combined")
+            yield from self._start_worker()
+            return
+
+        # В режиме продолжения карточки товаров копятся в очереди на диске и
+        # отдаются загрузчику пачками, когда паук простаивает
+        if self.settings.getbool('RESUME_ENABLED'):
+            self.frontier = get_frontier(self.crawler).open(frontier_scope(self))
+            self.resume_batch_size = max(1, self.settings.getint('RESUME_BATCH_SIZE', 1000))
+        if self.settings.getbool('BACKPRESSURE_ENABLED'):
+            self.backpressure = get_backpressure(self.crawler)
+        if self.frontier is not None:
+            if self.frontier.resumed:
+                yield from self._resume_requests()
+                return
+
+        # Прокси запросам назначает ProxyPoolMiddleware
         for url in self.start_urls:
-            request = scrapy.Request(url, callback=self.parse_category)
-            if self.use_proxy and self.proxy_pool:
-                request.meta['proxy'] = choice(self.proxy_pool)
-            yield request
+            yield from self._category_requests(url)
+
+    def _start_worker(self):
+        # Регионы и категории задаёт координатор; размер страницы общий для
+        # всех воркеров, иначе номера страниц шардов не совпадут
+        self.shard_queue = ShardQueue.from_settings(self.settings).open()
+        per_page = self.shard_queue.get_meta('per_page')
+        if per_page:
+            self.per_page = int(per_page)
+        self.shards_in_flight = max(1, self.settings.getint('DISTRIBUTED_SHARDS_IN_FLIGHT', 4))
+        self.logger.info(f"Distributed worker {self.shard_queue.worker}, queue {self.shard_queue.path}")
+
+        self._shard_renewal = LoopingCall(self._renew_shards)
+        self._shard_renewal.start(max(1.0, self.shard_queue.lease_timeout / 3), now=False)
+        yield from self._lease_shards()
+
+    def _lease_shards(self):
+        free = self.shards_in_flight - len(self._shards)
+        if free <= 0:
+            return
+        for shard, region, category, page in self.shard_queue.lease(free):
+            self._shards[shard] = None
+            self.crawler.stats.inc_value('distributed/shards_leased')
+            yield self._product_list_request(region, category, page, shard=shard)
+
+    def _renew_shards(self):
+        self.shard_queue.renew(list(self._shards))
+
+    def _complete_shard(self, shard):
+        self.shard_queue.complete(shard)
+        del self._shards[shard]
+        self.crawler.stats.inc_value('distributed/shards_done')
+
+    def _shard_progress(self, meta):
+        # Карточка шарда обработана; последняя завершает шард и освобождает
+        # место для следующего
+        shard = meta.get('shard')
+        if shard is None or not self._shards.get(shard):
+            return
+        self._shards[shard] -= 1
+        if self._shards[shard] == 0:
+            self._complete_shard(shard)
+            for request in self._lease_shards():
+                self.crawler.engine.crawl(request)
+
+    def _add_shard_pages(self, region, category, page, data, results_count):
+        # Первая страница добавляет в очередь остальные страницы категории;
+        # без метаданных страницы добавляются по одной, пока приходят полными
+        last_page = self._last_page(data, results_count)
+        if last_page is None:
+            pages = [page + 1]
+        elif page == 1:
+            pages = range(2, last_page + 1)
+        else:
+            return
+        self.shard_queue.add_pages(region, category, pages)
+
+    def _resume_requests(self):
+        self.crawler.stats.set_value('frontier/resumed', 1)
+        self.logger.info(f"Resuming crawl, {self.frontier.pending_count()} product(s) pending")
+
+        # Категории с сохранённым состоянием продолжаются со страниц списка,
+        # которые были запрошены, но не обработаны
+        known = set()
+        for region, category, next_page, last_page in self.frontier.categories():
+            known.add(category)
+            state = self._list_pages[(region, category)] = {'next_page': next_page, 'last_page': last_page}
+            done = self.frontier.done_pages(region, category)
+            missing = [page for page in range(1, next_page) if page not in done]
+            for page in missing:
+                yield self._product_list_request(region, category, page)
+
+            window = self.list_concurrency - len(missing)
+            while window > 0 and last_page is not None and state['next_page'] <= last_page:
+                yield self._product_list_request(region, category, state['next_page'])
+                state['next_page'] += 1
+                window -= 1
+            self.frontier.save_category(region, category, state['next_page'], last_page)
+
+        for url in self.start_urls:
+            if self._category_slug(url) not in known:
+                yield from self._category_requests(url)
+
+    def _category_slug(self, url):
+        path_parts = urlparse(url).path.split('/')
+        return path_parts[-1] if path_parts[-1] else path_parts[-2]
+
+    def _category_requests(self, url):
+        # HTML категории нужен только ради слага из URL; с CATEGORY_SKIP_HTML
+        # слаг берётся прямо из start_url
+        if self.settings.getbool('CATEGORY_SKIP_HTML'):
+            self.crawler.stats.inc_value('category/html_skipped')
+            yield from self._start_category(self._category_slug(url))
+        else:
+            yield scrapy.Request(url, callback=self.parse_category, meta={'endpoint': 'category'})
 
     def parse_category(self, response):
         try:
-            parsed_url = urlparse(response.url)
-            path_parts = parsed_url.path.split('/')
-            category_slug = path_parts[-1] if path_parts[-1] else path_parts[-2]
-
-            api_url = (
-                f"https://alkoteka.com/web-api/v1/product?"
-                f"city_uuid={self.region_uuid}&"
-                f"page=1&per_page=2000&root_category_slug={category_slug}"
-            )
-
-            request = scrapy.Request(
-                api_url,
-                callback=self.parse_product_list,
-                meta={'category': category_slug}
-            )
-
-            if self.use_proxy and self.proxy_pool:
-                request.meta['proxy'] = choice(self.proxy_pool)
-
-            yield request
-
+            yield from self._start_category(self._category_slug(response.url))
         except Exception as e:
             self.logger.error(f"Error in parse_category: {e}")
 
+    def _start_category(self, category_slug):
+        # Слаг категории общий для всех регионов, дальше обход расходится
+        # по регионам. Сначала запрашиваем только первую страницу: из её
+        # метаданных станет известно общее число страниц
+        for region in self.region_uuids:
+            self._list_pages[(region, category_slug)] = {'next_page': 2, 'last_page': None}
+            if self.frontier is not None:
+                self.frontier.save_category(region, category_slug, 2, None)
+            yield self._product_list_request(region, category_slug, 1)
+
+    def _region_slot(self, region):
+        return f"alkoteka.com:{region}"
+
+    def _product_list_request(self, region, category_slug, page, shard=None):
+        api_url = (
+            f"https://alkoteka.com/web-api/v1/product?"
+            f"city_uuid={region}&"
+            f"page={page}&per_page={self.per_page}&root_category_slug={category_slug}"
+        )
+
+        request = scrapy.Request(
+            api_url,
+            callback=self.parse_product_list,
+            meta={
+                'endpoint': 'list',
+                'region': region,
+                'category': category_slug,
+                'page': page,
+                'shard': shard,
+                'download_slot': self._region_slot(region)
+            },
+            # Шарды уже уникальны, а отброшенный фильтром запрос не дал бы
+            # шарду завершиться
+            dont_filter=shard is not None,
+            errback=self.handle_list_error
+        )
+
+        return request
+
+    def _last_page(self, data, results_count):
+        meta = data.get('meta') or {}
+        last_page = meta.get('last_page')
+        if last_page is not None:
+            return int(last_page)
+
+        total = meta.get('total')
+        per_page = meta.get('per_page') or self.per_page
+        if total is not None and per_page:
+            return max(1, -(-int(total) // int(per_page)))
+
+        # Метаданных нет: идём дальше, пока страницы приходят полными
+        return None if results_count >= self.per_page else 0
+
+    def _next_list_requests(self, region, category_slug, page, data, results_count):
+        state = self._list_pages.setdefault(
+            (region, category_slug), {'next_page': page + 1, 'last_page': None}
+        )
+
+        if state['last_page'] is None:
+            last_page = self._last_page(data, results_count)
+            if last_page is None:
+                # Без метаданных страницы запрашиваются по одной
+                if state['next_page'] == page + 1:
+                    state['next_page'] += 1
+                    yield self._product_list_request(region, category_slug, page + 1)
+                return
+            state['last_page'] = last_page
+
+        # Держим в работе не больше list_concurrency страниц категории:
+        # со страницы 1 открываем окно, каждая следующая сдвигает его на одну
+        window = self.list_concurrency if page == 1 else 1
+        while window > 0 and state['next_page'] <= state['last_page']:
+            yield self._product_list_request(region, category_slug, state['next_page'])
+            state['next_page'] += 1
+            window -= 1
+
     def parse_product_list(self, response):
         try:
-            data = json.loads(response.text)
-            products = data.get('results', [])
-            product_slugs = [p['slug'] for p in products if 'slug' in p]
-
-            self.logger.info(f"Found {len(product_slugs)} products in {response.meta['category']}")
+            region = response.meta['region']
+            category = response.meta['category']
+            page = response.meta.get('page', 1)
+            shard = response.meta.get('shard')
+
+            data = self.codec.decode_product_list(response.body)
+            products = data.get('results') or []
+            self.logger.info(f"Found {len(products)} products in {category} (region {region}, page {page})")
+
+            # В распределённом режиме товар загружает только тот шард, который
+            # первым занял его в общей очереди
+            claimed = None
+            if shard is not None:
+                keys = [product.get('slug') or product.get('uuid') for product in products]
+                claimed = set(self.shard_queue.claim(shard, region, [key for key in keys if key]))
+                self.crawler.stats.inc_value('distributed/duplicates', len(keys) - len(claimed))
+
+            # Детальные запросы по товарам страницы отдаём сразу, не дожидаясь
+            # остальных страниц; приоритет выше, чем у страниц списка. В режиме
+            # продолжения товары вместо этого ставятся в очередь на диске
+            results = []
+            queued = []
+            for product in products:
+                slug = product.get('slug')
+                if claimed is not None and (slug or product.get('uuid')) not in claimed:
+                    continue
+
+                if self.mode == 'fast' and self._has_list_fields(product):
+                    item = self._build_item({'results': product}, region, category, slug)
+                    if item:
+                        self.crawler.stats.inc_value('list_only/items')
+                        queued.append((slug or item['RPC'], item['RPC'], True))
+                        results.append(item)
+                    continue
+
+                if not slug:
+                    continue
+                if self.mode == 'fast':
+                    self.crawler.stats.inc_value('list_only/detail_fallback')
+
+                if self.frontier is not None:
+                    queued.append((slug, product.get('uuid') or '', False))
+                elif self.backpressure is not None:
+                    self._pending_details.append((region, category, slug))
+                else:
+                    results.append(self._product_request(region, category, slug, shard=shard))
+
+            if shard is not None:
+                self._add_shard_pages(region, category, page, data, len(products))
+                self._shards[shard] = sum(1 for result in results if isinstance(result, scrapy.Request))
+                if not self._shards[shard]:
+                    self._complete_shard(shard)
+                    results.extend(self._lease_shards())
+                yield from results
+                return
 
-            for slug in product_slugs:
-                product_url = (
-                    f"https://alkoteka.com/web-api/v1/product/{slug}?"
-                    f"city_uuid={self.region_uuid}"
-                )
+            results.extend(self._list_requests(self._next_list_requests(region, category, page, data, len(products))))
+            if self.frontier is not None:
+                state = self._list_pages[(region, category)]
+                self.frontier.page_done(region, category, page, queued, state['next_page'], state['last_page'])
+                self.crawler.stats.inc_value('frontier/queued', sum(1 for entry in queued if not entry[2]))
+            yield from results
+            yield from self._queued_requests()
 
-                request = scrapy.Request(
-                    product_url,
-                    callback=self.parse_product,
-                    meta={
-                        'slug': slug,
-                        'category': response.meta['category']
-                    },
-                    errback=self.handle_error
-                )
+        except Exception as e:
+            self.logger.error(f"Error parsing product list: {e}")
 
-                if self.use_proxy and self.proxy_pool:
-                    request.meta['proxy'] = choice(self.proxy_pool)
+    def _product_request(self, region, category, slug, rpc=None, shard=None):
+        product_url = (
+            f"https://alkoteka.com/web-api/v1/product/{slug}?"
+            f"city_uuid={region}"
+        )
+
+        return scrapy.Request(
+            product_url,
+            callback=self.parse_product_offloaded if self.transform_pool else self.parse_product,
+            meta={
+                'endpoint': 'detail',
+                'slug': slug,
+                'rpc': rpc,
+                'region': region,
+                'category': category,
+                'shard': shard,
+                'download_slot': self._region_slot(region)
+            },
+            priority=1,
+            dont_filter=shard is not None,
+            errback=self.handle_error
+        )
+
+    def _list_requests(self, requests):
+        # Пока карточек в очереди больше BACKPRESSURE_PENDING_DETAILS,
+        # следующие страницы списка ждут в памяти как запросы
+        if self.backpressure is None or len(self._pending_details) <= self.backpressure.pending_details:
+            yield from requests
+            return
+        for request in requests:
+            self._held_list_requests.append(request)
+            self.crawler.stats.inc_value('backpressure/held_list_pages')
+
+    def _queued_requests(self, finished=0):
+        # Карточки подкладываются, когда запрошенных и ещё не обработанных
+        # остаётся не больше половины BACKPRESSURE_SCHEDULER_DEPTH, и сразу
+        # до полной глубины. Считаем их сами, а не по длине планировщика:
+        # запросы из колбэков попадают в него не сразу. finished - сколько
+        # карточек обработал вызвавший колбэк
+        if self.backpressure is None:
+            return []
+        self._details_in_flight -= finished
+        depth = self.backpressure.scheduler_depth
+        room = depth - self._details_in_flight
+        if room < depth - depth // 2:
+            return []
+
+        if self.frontier is not None:
+            batch = self.frontier.next_batch(min(room, self.resume_batch_size))
+            requests = [self._product_request(region, category, slug, rpc)
+                        for region, category, slug, rpc in batch]
+            if batch:
+                self.crawler.stats.inc_value('frontier/scheduled', len(batch))
+        else:
+            requests = [self._product_request(*self._pending_details.popleft())
+                        for _ in range(min(room, len(self._pending_details)))]
+        self._details_in_flight += len(requests)
+
+        if self._held_list_requests and len(self._pending_details) <= self.backpressure.pending_details // 2:
+            requests.extend(self._held_list_requests)
+            self._held_list_requests.clear()
+        return requests
+
+    def request_dropped(self, request, spider):
+        # Повтор карточки, отброшенный фильтром дублей, до колбэка не дойдёт
+        if self.backpressure is not None and request.meta.get('endpoint') == 'detail':
+            self._details_in_flight -= 1
+
+    def spider_idle(self, spider):
+        if self.shard_queue is not None:
+            # Паук простаивает - запросов взятых шардов не осталось
+            for shard in list(self._shards):
+                self._complete_shard(shard)
+            requests = list(self._lease_shards())
+            for request in requests:
+                self.crawler.engine.crawl(request)
+            # Пока другие воркеры обрабатывают свои шарды, они могут добавить
+            # новые страницы; ждём, пока очередь не опустеет
+            if requests or not self.shard_queue.finished():
+                raise DontCloseSpider
+            return
+
+        if self.backpressure is not None:
+            # Раз паук простаивает, запрошенных карточек не осталось
+            self._details_in_flight = 0
+            requests = self._queued_requests()
+            for request in requests:
+                self.crawler.engine.crawl(request)
+            if requests:
+                raise DontCloseSpider
+            return
+
+        if self.frontier is None:
+            return
+        batch = self.frontier.next_batch(self.resume_batch_size)
+        for region, category, slug, rpc in batch:
+            self.crawler.engine.crawl(self._product_request(region, category, slug, rpc))
+        if batch:
+            self.crawler.stats.inc_value('frontier/scheduled', len(batch))
+            raise DontCloseSpider
+
+    def _has_list_fields(self, product):
+        # Товар можно собрать из списка, только если в нём есть все поля,
+        # перечисленные в LIST_ONLY_REQUIRED_FIELDS
+        return all(product.get(field) is not None for field in self.list_required_fields)
+
+    def handle_list_error(self, failure):
+        # Отложенный запрос (пауза перед повтором, ожидание прокси) ещё вернётся
+        if failure.check(RequestDeferred):
+            return
+        request = failure.request
+        region = request.meta['region']
+        category = request.meta['category']
+        page = request.meta.get('page', 1)
+        self.logger.error(f"Product list page {page} of {category} (region {region}) failed: {failure.value}")
+
+        shard = request.meta.get('shard')
+        if shard is not None:
+            # Шард возвращается в очередь, после DISTRIBUTED_MAX_ATTEMPTS попыток
+            # считается неудачным
+            self.shard_queue.fail(shard)
+            self._shards.pop(shard, None)
+            self.crawler.stats.inc_value('distributed/shards_failed')
+            yield from self._lease_shards()
+            return
+
+        # Пока число страниц неизвестно (страница 1 или обход без метаданных),
+        # без этой страницы категория дальше не пойдёт: запрашиваем её заново,
+        # всего не больше PRODUCT_LIST_PAGE_ATTEMPTS раз
+        state = self._list_pages.get((region, category))
+        if state and state['last_page'] is None:
+            attempt = request.meta.get('list_attempt', 1)
+            if attempt < self.settings.getint('PRODUCT_LIST_PAGE_ATTEMPTS', 3):
+                self.crawler.stats.inc_value('product_list/requeued')
+                meta = {key: value for key, value in request.meta.items() if key != 'retry_times'}
+                meta['list_attempt'] = attempt + 1
+                yield request.replace(meta=meta, dont_filter=True)
+                return
 
-                yield request
+        # Категория в этом обходе собрана не полностью
+        self.list_failures.add((region, category))
+        self.crawler.stats.inc_value('product_list/failed')
+        if page == 1:
+            self.crawler.stats.inc_value('product_list/failed_first_page')
 
-        except Exception as e:
-            self.logger.error(f"Error parsing product list: {e}")
+        # Освобождаем место в окне, чтобы остальные страницы категории
+        # не застряли из-за одной неудачной
+        if state and state['last_page'] is not None:
+            yield from self._list_requests(self._next_list_requests(region, category, page, {}, 0))
+            if self.frontier is not None:
+                self.frontier.save_category(region, category, state['next_page'], state['last_page'])
+        yield from self._queued_requests()
 
     def parse_product(self, response):
         try:
             slug = response.meta['slug']
+            region = response.meta.get('region', self.region_uuid)
             category = response.meta['category']
-            product_data = json.loads(response.text)
+            product_data = self.codec.decode_product(response.body)
 
-            product_data['region_uuid'] = self.region_uuid
+            product_data['region_uuid'] = region
             product_data['category'] = category
 
-            self._save_product_data(product_data, category, slug)
-            self._log_product_info(product_data)
+            if self.product_log_rate and random() < self.product_log_rate:
+                self._log_product_info(product_data)
+            item = self._build_item(product_data, region, category, slug)
+            if item:
+                yield item
 
         except Exception as e:
             self.logger.error(f"Error processing product: {e}")
+        self._shard_progress(response.meta)
+        yield from self._queued_requests(finished=1)
 
-    def transform_product_data(self, input_data: dict, category: str, slug: str) -> dict:
-        # Основные данные из входного JSON
-        results = input_data.get('results', {})
-        if results is None:
-            self.logger.error("Results is None")
-            return {}
-
-        # 1. Формирование названия товара
-        name = results.get('name')
-        if name is None:
-            name = ''
-        subname = results.get('subname')
-        if subname is None:
-            subname = ''
-        base_title = name if name else subname
-
-        # Сбор дополнительных атрибутов для названия
-        color, volume = None, None
-        filter_labels = results.get('filter_labels', [])
-        if filter_labels is None:
-            filter_labels = []
-
-        for label in filter_labels:
-            if label is None:
-                continue
-            filter_type = label.get('filter')
-            if filter_type == 'cvet':
-                color = label.get('title')
-            elif filter_type == 'obem':
-                volume = label.get('title')
-
-        # Добавление цвета и объема к названию при необходимости
-        title_parts = [base_title]
-        if color is not None and color not in base_title:
-            title_parts.append(color)
-        if volume is not None and volume not in base_title:
-            title_parts.append(volume)
-        title = ", ".join(title_parts)
-
-        # 2. Сбор маркетинговых тегов
-        marketing_tags = []
-
-        # Теги из специальных полей
-        is_new = results.get('new')
-        if is_new is not None and is_new:
-            marketing_tags.append('Новинка')
-
-        gift_package = results.get('gift_package')
-        if gift_package is not None and gift_package:
-            marketing_tags.append('Подарок')
-
-        # Теги из price_details
-        price_details = results.get('price_details', [])
-        if price_details is None:
-            price_details = []
-
-        for detail in price_details:
-            if detail is None:
-                continue
-            tag_title = detail.get('title')
-            if tag_title is not None and tag_title not in marketing_tags:
-                marketing_tags.append(tag_title)
-
-        # Теги из filter_labels
-        for label in filter_labels:
-            if label is None:
-                continue
-            if label.get('filter') == 'tovary-so-skidkoi':
-                tag_title = label.get('title')
-                if tag_title is not None and tag_title not in marketing_tags:
-                    marketing_tags.append(tag_title)
-
-        # 3. Извлечение бренда
-        brand = "Неизвестно"
-        description_blocks = results.get('description_blocks', [])
-        if description_blocks is None:
-            description_blocks = []
-
-        for block in description_blocks:
-            if block is None:
-                continue
-            if block.get('code') == 'brend':
-                values = block.get('values', [])
-                if values is not None and len(values) > 0:
-                    brand_name = values[0].get('name')
-                    if brand_name is not None:
-                        brand = brand_name
-                        break
-
-        # 4. Иерархия разделов
-        section = []
-        category_data = results.get('category', {})
-        if category_data is None:
-            category_data = {}
-
-        parent_category = category_data.get('parent', {})
-        if parent_category is None:
-            parent_category = {}
-
-        parent_name = parent_category.get('name')
-        if parent_name is not None:
-            section.append(parent_name)
-
-        category_name = category_data.get('name')
-        if category_name is not None:
-            section.append(category_name)
-
-        # 5. Данные о цене
-        price = results.get('price')
-        if price is None:
-            current_price = 0.0
-        else:
-            try:
-                current_price = float(price)
-            except (TypeError, ValueError):
-                current_price = 0.0
-
-        prev_price = results.get('prev_price')
-        if prev_price is None:
-            original_price = current_price
-        else:
-            try:
-                original_price = float(prev_price)
-            except (TypeError, ValueError):
-                original_price = current_price
-
-        sale_tag = ""
-        if original_price > current_price:
-            discount_percent = round((1 - current_price / original_price) * 100)
-            sale_tag = f"Скидка {discount_percent}%"
-
-        # 6. Наличие товара
-        available = results.get('available')
-        if available is None:
-            in_stock = False
-        else:
-            in_stock = bool(available)
-
-        quantity_total = results.get('quantity_total')
-        if quantity_total is None or not in_stock:
-            stock_count = 0
-        else:
-            try:
-                stock_count = int(quantity_total)
-            except (TypeError, ValueError):
-                stock_count = 0
-
-        # 7. Медиа-контент
-        main_image = results.get('image_url')
-        if main_image is None:
-            main_image = ''
-
-        assets = {
-            'main_image': main_image,
-            'set_images': [main_image] if main_image else [],
-            'view360': [],
-            'video': []
-        }
-
-        # 8. Метаданные и описание
-        metadata = {'__description': ''}
-
-        # Добавление артикула
-        vendor_code = results.get('vendor_code')
-        if vendor_code is not None:
-            metadata['Артикул'] = str(vendor_code)
-
-        # Формирование описания из текстовых блоков
-        description_parts = []
-        text_blocks = results.get('text_blocks', [])
-        if text_blocks is None:
-            text_blocks = []
-
-        for block in text_blocks:
-            if block is None:
-                continue
-            content = block.get('content')
-            if content is not None:
-                description_parts.append(content)
-
-        metadata['__description'] = " ".join(description_parts)
-
-        # Добавление характеристик
-        for block in description_blocks:
-            if block is None:
-                continue
-
-            key = block.get('title')
-            if key is None:
-                continue
-
-            # Обработка разных типов характеристик
-            block_type = block.get('type')
-            if block_type == 'select':
-                values = []
-                block_values = block.get('values', [])
-                if block_values is not None:
-                    for v in block_values:
-                        if v is None:
-                            continue
-                        enabled = v.get('enabled')
-                        if enabled is not None and enabled:
-                            name = v.get('name')
-                            if name is not None:
-                                values.append(name)
-                if values:
-                    metadata[key] = ", ".join(values)
-
-            elif block_type == 'range':
-                unit = block.get('unit')
-                if unit is None:
-                    unit = ''
-
-                min_val = block.get('min')
-                max_val = block.get('max')
-
-                if min_val is not None and max_val is not None:
-                    if min_val == max_val:
-                        metadata[key] = f"{min_val}{unit}"
-                    else:
-                        metadata[key] = f"{min_val}-{max_val}{unit}"
-
-        # 9. Подсчет вариантов
-        color_variants = 1
-        volume_variants = 1
-
-        for block in description_blocks:
-            if block is None:
-                continue
-
-            code = block.get('code')
-            if code == 'cvet' and block.get('type') == 'select':
-                values = block.get('values', [])
-                if values is not None:
-                    color_variants = len([v for v in values if v is not None and v.get('enabled')])
-
-            elif code == 'obem' and block.get('type') == 'select':
-                values = block.get('values', [])
-                if values is not None:
-                    volume_variants = len([v for v in values if v is not None and v.get('enabled')])
-
-        variants = color_variants * volume_variants
-
-        # Формирование итоговых данных
-        uuid = results.get('uuid')
-        if uuid is None:
-            uuid = ''
-
-        return {
-            'timestamp': int(time.time()),
-            'RPC': uuid,
-            'url': '',  # URL отсутствует в исходных данных
-            'title': title,
-            'marketing_tags': marketing_tags,
-            'brand': brand,
-            'section': section,
-            'price_data': {
-                'current': current_price,
-                'original': original_price,
-                'sale_tag': sale_tag
-            },
-            'stock': {
-                'in_stock': in_stock,
-                'count': stock_count
-            },
-            'assets': assets,
-            'metadata': metadata,
-            'variants': variants
-        }
-
-    def _save_product_data(self, product_data, category, slug):
+    async def parse_product_offloaded(self, response):
+        # То же, что parse_product, но разбор и преобразование выполняются
+        # в TransformPool
         try:
-            transformed_data = self.transform_product_data(product_data, category, slug)
-            # Ensure data directory exists
-            os.makedirs(self.data_dir, exist_ok=True)
+            region = response.meta.get('region', self.region_uuid)
+            if self.product_log_rate and random() < self.product_log_rate:
+                # Разбор в реакторе только для попавших в выборку товаров
+                product_data = self.codec.decode_product(response.body)
+                product_data['region_uuid'] = region
+                self._log_product_info(product_data)
+            item = await maybe_deferred_to_future(self.transform_pool.submit(
+                response.body,
+                region,
+                response.meta['category'],
+                response.meta['slug'],
+            ))
+            if item:
+                yield item
 
-            # Define single output file path
-            output_file = os.path.join(self.data_dir, "all_products.jsonl")
+        except Exception as e:
+            self.logger.error(f"Error processing product: {e}")
+        self._shard_progress(response.meta)
+        for request in self._queued_requests(finished=1):
+            yield request
 
-            # Append to JSON Lines file
-            with open(output_file, 'a', encoding='utf-8') as f:
-                json_line = json.dumps(transformed_data, ensure_ascii=False)
-                f.write(json_line + '\n')
+    def closed(self, reason):
+        if self.transform_pool is not None:
+            self.transform_pool.close()
+        if self.shard_queue is not None:
+            if self._shard_renewal is not None and self._shard_renewal.running:
+                self._shard_renewal.stop()
+            # Незавершённые шарды остановленного воркера сразу достаются другим
+            for shard in list(self._shards):
+                self.shard_queue.fail(shard)
+            self.shard_queue.close()
+
+    def _build_item(self, product_data, region, category, slug):
+        item = self.transform_product_data(product_data, category, slug)
+        if item:
+            item['region'] = region
+        return item
 
-            self.logger.info(f"Appended product (category: {category}, slug: {slug}) to {output_file}")
-        except Exception as e:
-            self.logger.error(f"Error saving product data (category: {category}, slug: {slug}): {e}")
+    def transform_product_data(self, input_data: dict, category: str, slug: str) -> dict:
+        return transform_product_data(input_data, category, slug)
 
     def _log_product_info(self, product_data):
         try:
-            info = {
-                'name': product_data.get('results', {}).get('name'),  # Достаем name из вложенного results
-                'price': product_data.get('results', {}).get('price'),
-                'prev_price': product_data.get('results', {}).get('prev_price'),
-                'available': product_data.get('results', {}).get('quantity_total', 0) > 0,  # Проверяем наличие товара
-                'region': self.region_uuid,
-                'url': f"https://example.com/product/{product_data.get('results', {}).get('uuid')}"
-            }
-            self.logger.info(json.dumps(info, indent=2, ensure_ascii=False))
+            results = product_data.get('results') or {}
+            self.logger.info(
+                f"Product {results.get('uuid')} {results.get('name')!r}: "
+                f"price={results.get('price')} prev_price={results.get('prev_price')} "
+                f"available={(results.get('quantity_total') or 0) > 0} "
+                f"region={product_data.get('region_uuid', self.region_uuid)}"
+            )
         except Exception as e:
             self.logger.error(f"Error logging product info: {e}")
 
     def handle_error(self, failure):
         try:
-            self.logger.error(f"Request failed: {failure.value}")
-
-            if not self.use_proxy or not hasattr(self, 'proxy_pool'):
+            if failure.check(RequestDeferred):
+                return
+            if failure.check(NotModified):
+                if self.frontier is not None:
+                    meta = failure.request.meta
+                    self.frontier.complete([(meta.get('region', self.region_uuid), meta.get('rpc'))])
+                self._shard_progress(failure.request.meta)
+                yield from self._queued_requests(finished=1)
                 return
 
-            request = failure.request
-            if 'proxy' in request.meta and self.proxy_pool:
-                bad_proxy = request.meta['proxy']
-                self.logger.warning(f"Removing bad proxy: {bad_proxy}")
-                if bad_proxy in self.proxy_pool:
-                    self.proxy_pool.remove(bad_proxy)
-
-                if self.proxy_pool:
-                    new_proxy = choice(self.proxy_pool)
-                    self.logger.info(f"Retrying with new proxy: {new_proxy}")
-                    request.meta['proxy'] = new_proxy
-                    yield request
-                else:
-                    self.logger.error("No proxies left in the pool")
+            # Повторы с новым прокси уже сделал BackoffRetryMiddleware; сюда
+            # запрос приходит, только когда его бюджет повторов исчерпан
+            if failure.check(HttpError) and failure.value.response.status == 404:
+                self.logger.warning(f"Product not found: {failure.request.url}")
+            else:
+                self.logger.error(f"Request failed: {failure.value}")
+            self._shard_progress(failure.request.meta)
+            yield from self._queued_requests(finished=1)
         except Exception as e:
             self.logger.error(f"Error in handle_error: {e}")
 
-
-class CustomRetryMiddleware(RetryMiddleware):
-    def process_response(self, request, response, spider):
-        if response.status in [403, 429] and getattr(spider, 'use_proxy', False):
-            reason = response_status_message(response.status)
-            if hasattr(spider, 'proxy_pool') and spider.proxy_pool:
-                new_proxy = choice(spider.proxy_pool)
-                spider.logger.warning(f'Switching proxy to {new_proxy} after {response.status} response')
-                request.meta['proxy'] = new_proxy
-                return self._retry(request, reason, spider) or response
-        return response
\ No newline at end of file
@@ -0,0 +1,362 @@
+"""Преобразование ответа API карточки товара в итоговую запись.
+
+Функции модуля не зависят от паука, поэтому их можно вызывать в отдельных
+процессах: TransformPool разбирает и преобразует ответы в пуле процессов,
+не занимая поток реактора.
+"""
+import logging
+import os
+import time
+
+from twisted.internet import defer
+
+from alkoteka_parser.jsoncodec import JsonCodec
+
+logger = logging.getLogger(__name__)
+
+
+# Коды блоков и фильтров API, по которым собирается запись
+COLOR_CODE = 'cvet'
+VOLUME_CODE = 'obem'
+BRAND_CODE = 'brend'
+DISCOUNT_FILTER = 'tovary-so-skidkoi'
+NEW_TAG = 'Новинка'
+GIFT_TAG = 'Подарок'
+UNKNOWN_BRAND = 'Неизвестно'
+
+
+class ProductTransformer:
+    """Преобразует ответ API карточки товара в итоговую запись.
+
+    Каждый список ответа (filter_labels, price_details, description_blocks,
+    text_blocks) проходится один раз. Результат совпадает с прежней
+    реализацией transform_product_data, это проверяет python -m
+    benchmarks.golden (и тесты).
+    """
+
+    def transform(self, input_data: dict, category: str = '', slug: str = '', timestamp=None) -> dict:
+        # Основные данные из входного JSON
+        results = input_data.get('results', {})
+        if results is None:
+            logger.error("Results is None")
+            return {}
+
+        get = results.get
+
+        # Цвет и объём для названия (побеждает последний ярлык), теги скидки
+        color, volume = None, None
+        discount_tags = []
+        for label in get('filter_labels') or ():
+            if label is None:
+                continue
+            filter_type = label.get('filter')
+            if filter_type == COLOR_CODE:
+                color = label.get('title')
+            elif filter_type == VOLUME_CODE:
+                volume = label.get('title')
+            elif filter_type == DISCOUNT_FILTER:
+                discount_tags.append(label.get('title'))
+
+        # 1. Название товара
+        base_title = get('name') or get('subname') or ''
+        title = base_title
+        if color is not None and color not in base_title:
+            title = f"{title}, {color}"
+        if volume is not None and volume not in base_title:
+            title = f"{title}, {volume}"
+
+        # 2. Маркетинговые теги в порядке появления, без повторов. Тегов
+        # единицы, поэтому повторы ищутся по списку: заголовок тега не
+        # обязательно хешируемый
+        marketing_tags = []
+        if get('new'):
+            marketing_tags.append(NEW_TAG)
+        if get('gift_package'):
+            marketing_tags.append(GIFT_TAG)
+        for detail in get('price_details') or ():
+            if detail is not None:
+                tag_title = detail.get('title')
+                if tag_title is not None and tag_title not in marketing_tags:
+                    marketing_tags.append(tag_title)
+        for tag_title in discount_tags:
+            if tag_title is not None and tag_title not in marketing_tags:
+                marketing_tags.append(tag_title)
+
+        # 3. Иерархия разделов
+        section = []
+        category_data = get('category') or {}
+        parent_name = (category_data.get('parent') or {}).get('name')
+        if parent_name is not None:
+            section.append(parent_name)
+        category_name = category_data.get('name')
+        if category_name is not None:
+            section.append(category_name)
+
+        # 4. Цена
+        current_price = 0.0
+        price = get('price')
+        if price is not None:
+            try:
+                current_price = float(price)
+            except (TypeError, ValueError):
+                pass
+        original_price = current_price
+        prev_price = get('prev_price')
+        if prev_price is not None:
+            try:
+                original_price = float(prev_price)
+            except (TypeError, ValueError):
+                pass
+        sale_tag = ""
+        if original_price > current_price:
+            sale_tag = f"Скидка {round((1 - current_price / original_price) * 100)}%"
+
+        # 5. Наличие
+        in_stock = bool(get('available'))
+        quantity_total = get('quantity_total')
+        stock_count = 0
+        if quantity_total is not None and in_stock:
+            try:
+                stock_count = int(quantity_total)
+            except (TypeError, ValueError):
+                stock_count = 0
+
+        # 6. Медиа-контент
+        main_image = get('image_url')
+        if main_image is None:
+            main_image = ''
+
+        # 7. Метаданные: описание, артикул и характеристики
+        metadata = {'__description': ''}
+        vendor_code = get('vendor_code')
+        if vendor_code is not None:
+            metadata['Артикул'] = str(vendor_code)
+        metadata['__description'] = " ".join(
+            block['content'] for block in get('text_blocks') or ()
+            if block is not None and block.get('content') is not None
+        )
+
+        # Один проход по description_blocks: бренд (первый непустой),
+        # характеристики и число вариантов цвета и объёма (последний блок)
+        brand = None
+        color_variants = 1
+        volume_variants = 1
+        for block in get('description_blocks') or ():
+            if block is None:
+                continue
+            code = block.get('code')
+            block_type = block.get('type')
+
+            # Бренд ищется в блоке с кодом brend любого типа
+            if brand is None and code == BRAND_CODE:
+                values = block.get('values', [])
+                if values is not None and len(values) > 0:
+                    brand = values[0].get('name')
+
+            if block_type == 'select':
+                values = block.get('values', [])
+                if values is None:
+                    continue
+                enabled_count = 0
+                names = []
+                for value in values:
+                    if value is not None and value.get('enabled'):
+                        enabled_count += 1
+                        name = value.get('name')
+                        if name is not None:
+                            names.append(name)
+                if code == COLOR_CODE:
+                    color_variants = enabled_count
+                elif code == VOLUME_CODE:
+                    volume_variants = enabled_count
+                if names:
+                    key = block.get('title')
+                    if key is not None:
+                        metadata[key] = ", ".join(names)
+
+            elif block_type == 'range':
+                key = block.get('title')
+                min_val = block.get('min')
+                max_val = block.get('max')
+                if key is not None and min_val is not None and max_val is not None:
+                    unit = block.get('unit')
+                    if unit is None:
+                        unit = ''
+                    if min_val == max_val:
+                        metadata[key] = f"{min_val}{unit}"
+                    else:
+                        metadata[key] = f"{min_val}-{max_val}{unit}"
+
+        uuid = get('uuid')
+        return {
+            'timestamp': int(time.time()) if timestamp is None else timestamp,
+            'RPC': '' if uuid is None else uuid,
+            'url': '',  # URL отсутствует в исходных данных
+            'title': title,
+            'marketing_tags': marketing_tags,
+            'brand': UNKNOWN_BRAND if brand is None else brand,
+            'section': section,
+            'price_data': {
+                'current': current_price,
+                'original': original_price,
+                'sale_tag': sale_tag
+            },
+            'stock': {
+                'in_stock': in_stock,
+                'count': stock_count
+            },
+            'assets': {
+                'main_image': main_image,
+                'set_images': [main_image] if main_image else [],
+                'view360': [],
+                'video': []
+            },
+            'metadata': metadata,
+            'variants': color_variants * volume_variants
+        }
+
+    def transform_many(self, entries):
+        """Преобразует пачку (input_data, category, slug) с общим timestamp."""
+        timestamp = int(time.time())
+        return [self.transform(input_data, category, slug, timestamp) for input_data, category, slug in entries]
+
+
+_transformer = ProductTransformer()
+
+
+def transform_product_data(input_data: dict, category: str, slug: str) -> dict:
+    return _transformer.transform(input_data, category, slug)
+
+
+def decode_and_transform(codec, body, region, category, slug):
+    """Разбор тела ответа карточки и преобразование, как в parse_product."""
+    product_data = codec.decode_product(body)
+    product_data['region_uuid'] = region
+    product_data['category'] = category
+    item = transform_product_data(product_data, category, slug)
+    if item:
+        item['region'] = region
+    return item
+
+
+# Кодек процесса-обработчика пула, создаётся в _init_worker
+_worker_codec = None
+
+
+def _init_worker(decoder, typed):
+    global _worker_codec
+    _worker_codec = JsonCodec(decoder=decoder, typed=typed)
+
+
+def _transform_batch(entries):
+    # Выполняется в процессе пула. Ошибка одного товара не роняет пачку:
+    # вместо записи возвращается текст ошибки
+    results = []
+    for body, region, category, slug in entries:
+        try:
+            results.append((True, decode_and_transform(_worker_codec, body, region, category, slug)))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+
+class TransformError(Exception):
+    pass
+
+
+class TransformPool:
+    """Пул процессов для разбора и преобразования карточек товаров.
+
+    submit() принимает тело ответа и возвращает Deferred с готовой записью.
+    Ответы собираются в пачки по batch_size штук (или за batch_delay секунд),
+    чтобы накладные расходы на передачу между процессами делились на
+    несколько товаров.
+    """
+
+    def __init__(self, workers=0, batch_size=32, batch_delay=0.05, decoder='auto', typed=True,
+                 start_method='spawn', stats=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.batch_size = max(1, batch_size)
+        self.batch_delay = batch_delay
+        self.stats = stats
+        # Пул нужен только с TRANSFORM_POOL_ENABLED, его модули не грузятся
+        # при импорте паука
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Реактор работает в нескольких потоках, поэтому процессы по
+        # умолчанию запускаются через spawn, а не fork
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(decoder, typed),
+        )
+        self._entries = []
+        self._deferreds = []
+        self._delayed_flush = None
+
+    @classmethod
+    def from_settings(cls, settings, stats=None):
+        return cls(
+            workers=settings.getint('TRANSFORM_POOL_WORKERS', 0),
+            batch_size=settings.getint('TRANSFORM_POOL_BATCH_SIZE', 32),
+            batch_delay=settings.getfloat('TRANSFORM_POOL_BATCH_DELAY', 0.05),
+            decoder=settings.get('JSON_DECODER', 'auto'),
+            typed=settings.getbool('JSON_TYPED_DECODE', True),
+            start_method=settings.get('TRANSFORM_POOL_START_METHOD', 'spawn'),
+            stats=stats,
+        )
+
+    def submit(self, body, region, category, slug):
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+        self._entries.append((body, region, category, slug))
+        self._deferreds.append(d)
+        if len(self._entries) >= self.batch_size:
+            self.flush()
+        elif self._delayed_flush is None:
+            self._delayed_flush = reactor.callLater(self.batch_delay, self.flush)
+        return d
+
+    def flush(self):
+        from twisted.internet import reactor
+
+        if self._delayed_flush is not None:
+            if self._delayed_flush.active():
+                self._delayed_flush.cancel()
+            self._delayed_flush = None
+        if not self._entries:
+            return
+
+        entries, deferreds = self._entries, self._deferreds
+        self._entries, self._deferreds = [], []
+        if self.stats is not None:
+            self.stats.inc_value('transform_pool/batches')
+            self.stats.inc_value('transform_pool/items', len(entries))
+
+        future = self._executor.submit(_transform_batch, entries)
+        # Колбэк future вызывается в служебном потоке пула, а Deferred
+        # можно запускать только из потока реактора
+        future.add_done_callback(
+            lambda f: reactor.callFromThread(self._resolve, f, deferreds)
+        )
+
+    @staticmethod
+    def _resolve(future, deferreds):
+        try:
+            results = future.result()
+        except Exception as e:
+            for d in deferreds:
+                d.errback(TransformError(f"Transform batch failed: {e}"))
+            return
+        for d, (ok, value) in zip(deferreds, results):
+            if ok:
+                d.callback(value)
+            else:
+                d.errback(TransformError(value))
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
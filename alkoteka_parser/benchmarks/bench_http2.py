@@ -0,0 +1,219 @@
+"""Бенчмарк загрузки карточек: HTTP11DownloadHandler против HttpxDownloadHandler.
+
+    python -m benchmarks.bench_http2 --requests 2000 --concurrency 32 --latency 20
+
+Поднимает локальный TLS-сервер (hypercorn, HTTP/2 и HTTP/1.1 через ALPN),
+который отвечает на /web-api/v1/product/<slug> карточкой SAMPLE_PRODUCT с
+задержкой --latency мс, и прогоняет через загрузчик Scrapy одинаковый набор
+запросов карточек с каждым обработчиком. Каждый обработчик меряется в
+отдельном процессе. Сервер считает TCP/TLS-соединения, паук - задержку
+ответа (download_latency). Нужны httpx[http2] и hypercorn.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import resource
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.bench_parse import _percentiles, _peak_rss_mb
+from benchmarks.corpus import SAMPLE_PRODUCT
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLERS = {
+    'http11': 'scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler',
+    'httpx': 'alkoteka_parser.http2.HttpxDownloadHandler',
+}
+
+
+def _make_certificate(directory):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    with open(certfile, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(keyfile, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return certfile, keyfile
+
+
+def serve(port, certfile, keyfile, latency):
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    body = json.dumps({'success': True, 'results': SAMPLE_PRODUCT}, ensure_ascii=False).encode('utf-8')
+    connections = set()
+    versions = {}
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        if scope['path'] == '/__stats':
+            payload = json.dumps({'connections': len(connections), 'http_versions': versions}).encode()
+            connections.clear()
+            versions.clear()
+        else:
+            # Новое соединение клиента - новый исходящий порт
+            connections.add(tuple(scope['client'] or ()))
+            versions[scope['http_version']] = versions.get(scope['http_version'], 0) + 1
+            await asyncio.sleep(latency)
+            payload = body
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    config = Config()
+    config.bind = [f'127.0.0.1:{port}']
+    config.certfile = certfile
+    config.keyfile = keyfile
+    config.loglevel = 'ERROR'
+    config.accesslog = None
+    config.h2_max_concurrent_streams = 1000
+    asyncio.run(hypercorn_serve(app, config))
+
+
+def _server_stats(port):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(f'https://127.0.0.1:{port}/__stats', context=context) as response:
+        return json.loads(response.read())
+
+
+def run_handler(handler, port, requests, concurrency, max_connections):
+    import scrapy
+    from scrapy.crawler import CrawlerProcess
+
+    latencies = []
+
+    class BenchSpider(scrapy.Spider):
+        name = 'bench_http2'
+
+        def start_requests(self):
+            for number in range(requests):
+                yield scrapy.Request(
+                    f'https://127.0.0.1:{port}/web-api/v1/product/slug-{number}?city_uuid=bench',
+                    meta={'endpoint': 'detail'}, dont_filter=True,
+                )
+
+        def parse(self, response):
+            latencies.append(response.meta['download_latency'])
+
+    process = CrawlerProcess({
+        'LOG_LEVEL': 'ERROR',
+        'TELNETCONSOLE_ENABLED': False,
+        'DOWNLOAD_HANDLERS': {'https': HANDLERS[handler]},
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'DOWNLOAD_DELAY': 0,
+        'RETRY_ENABLED': False,
+        'HTTP2_MAX_CONNECTIONS': max_connections,
+    }, install_root_handler=False)
+    crawler = process.create_crawler(BenchSpider)
+    process.crawl(crawler)
+    started = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - started
+
+    stats = crawler.stats.get_stats()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'responses': len(latencies),
+        'errors': stats.get('downloader/exception_count', 0),
+        'elapsed_s': elapsed,
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'latency': _percentiles(latencies),
+        # Процессорное время клиента на запрос: сервер на той же машине
+        'cpu_ms_per_request': (usage.ru_utime + usage.ru_stime) * 1000 / max(1, len(latencies)),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=20.0, help='server response delay, ms')
+    parser.add_argument('--max-connections', type=int, default=4, help='HTTP2_MAX_CONNECTIONS')
+    parser.add_argument('--handlers', default='http11,httpx')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--certfile', help=argparse.SUPPRESS)
+    parser.add_argument('--keyfile', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args.port, args.certfile, args.keyfile, args.latency / 1000)
+    if args.worker:
+        result = run_handler(args.worker, args.port, args.requests, args.concurrency, args.max_connections)
+        json.dump(result, sys.stdout)
+        return
+
+    env = dict(os.environ, PYTHONPATH=PROJECT_DIR)
+    env.pop('SCRAPY_SETTINGS_MODULE', None)
+    certfile, keyfile = _make_certificate(tempfile.mkdtemp(prefix='alkoteka-h2-'))
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.bench_http2', '--serve', '--port', str(args.port),
+        '--certfile', certfile, '--keyfile', keyfile, '--latency', str(args.latency),
+    ], cwd=PROJECT_DIR, env=env)
+    try:
+        for _ in range(50):
+            try:
+                _server_stats(args.port)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        results = {}
+        for handler in args.handlers.split(','):
+            command = [sys.executable, '-m', 'benchmarks.bench_http2', '--worker', handler,
+                       '--port', str(args.port), '--requests', str(args.requests),
+                       '--concurrency', str(args.concurrency), '--max-connections', str(args.max_connections)]
+            output = subprocess.run(command, cwd=PROJECT_DIR, env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            results[handler] = json.loads(output)
+            results[handler]['server'] = _server_stats(args.port)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{'handler':>8} {'resp':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'cpu ms':>7} {'conns':>6}  versions")
+    for handler, result in results.items():
+        latency = result['latency'] or {'p50_ms': 0.0, 'p99_ms': 0.0}
+        print(f"{handler:>8} {result['responses']:>6} {result['errors']:>4} {result['requests_per_s']:>8.0f} "
+              f"{latency['p50_ms']:>8.1f} {latency['p99_ms']:>8.1f} {result['cpu_ms_per_request']:>7.2f} "
+              f"{result['server']['connections']:>6}  "
+              f"{result['server']['http_versions']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Бенчмарк разбора и преобразования товаров на офлайн-корпусе.
+
+    python -m benchmarks.bench_parse --sizes 1000,10000,100000
+    python -m benchmarks.bench_parse --mode crawl --sizes 10000
+    python -m benchmarks.bench_parse --mode crawl --offload --sizes 10000
+    python -m benchmarks.bench_parse --json result.json --compare baseline.json
+
+Режим callbacks прогоняет колбэки паука синхронно, без реактора и сети.
+Запросы, которые отдаёт колбэк, сразу разрешаются ответами из корпуса. Режим
+crawl запускает обычный обход через ReplayDownloadHandler. Каждый размер
+корпуса меряется в отдельном процессе, чтобы пиковый RSS не смешивался.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_DIR = os.path.join(PROJECT_DIR, 'benchmarks', '.corpus')
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {'count': len(values), 'p50_ms': pick(0.5), 'p90_ms': pick(0.9), 'p99_ms': pick(0.99)}
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _make_crawler(settings_dict):
+    from scrapy.crawler import Crawler
+    from scrapy.utils.project import get_project_settings
+
+    from alkoteka_parser.spiders.alkoteka import AlkotekaProductSpider
+
+    settings = get_project_settings()
+    settings.setdict(settings_dict, priority='cmdline')
+    crawler = Crawler(AlkotekaProductSpider, settings)
+    crawler._apply_settings()
+    return crawler
+
+
+def run_callbacks(corpus_path, spider_args):
+    from scrapy.http import HtmlResponse, TextResponse
+
+    from alkoteka_parser.replay import Corpus
+
+    crawler = _make_crawler({'LOG_LEVEL': 'ERROR', 'TWISTED_REACTOR': None})
+    spider = crawler.spidercls.from_crawler(crawler, **spider_args)
+    crawler.spider = spider
+    corpus = Corpus(corpus_path)
+
+    timings = {}
+    items = 0
+    misses = 0
+    # Стек, а не очередь: карточки товаров обрабатываются раньше следующих
+    # страниц списка, как и в реальном обходе, и память не копится
+    stack = list(reversed(list(spider.start_requests())))
+    started = time.perf_counter()
+    while stack:
+        request = stack.pop()
+        found = corpus.get(request.url)
+        if found is None:
+            misses += 1
+            continue
+        status, headers, body = found
+        respcls = HtmlResponse if '/catalog/' in request.url else TextResponse
+        response = respcls(request.url, status=status, body=body, request=request, encoding='utf-8')
+
+        callback = request.callback or spider.parse
+        callback_started = time.perf_counter()
+        produced = list(callback(response) or [])
+        timings.setdefault(callback.__name__, []).append(time.perf_counter() - callback_started)
+
+        new_requests = []
+        for result in produced:
+            if hasattr(result, 'url') and hasattr(result, 'callback'):
+                new_requests.append(result)
+            else:
+                items += 1
+        stack.extend(reversed(new_requests))
+    elapsed = time.perf_counter() - started
+    corpus.close()
+
+    return {
+        'items': items,
+        'misses': misses,
+        'elapsed_s': elapsed,
+        'items_per_s': items / elapsed if elapsed else 0.0,
+        'callbacks': {name: _percentiles(values) for name, values in timings.items()},
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_crawl(corpus_path, spider_args, offload=False):
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    output_dir = tempfile.mkdtemp(prefix='alkoteka-bench-')
+    settings = get_project_settings()
+    settings.setdict({
+        'LOG_LEVEL': 'ERROR',
+        'REPLAY_PATH': corpus_path,
+        'DOWNLOAD_HANDLERS': {
+            'http': 'alkoteka_parser.replay.ReplayDownloadHandler',
+            'https': 'alkoteka_parser.replay.ReplayDownloadHandler',
+        },
+        'DOWNLOAD_DELAY': 0,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 64,
+        'ADAPTIVE_THROTTLE_ENABLED': False,
+        'TELNETCONSOLE_ENABLED': False,
+        'PRODUCTS_JSONL_PATH': os.path.join(output_dir, 'all_products.jsonl'),
+        'TRANSFORM_POOL_ENABLED': offload,
+    }, priority='cmdline')
+
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler('alkoteka')
+    process.crawl(crawler, **spider_args)
+    started = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - started
+
+    stats = crawler.stats.get_stats()
+    items = stats.get('item_scraped_count', 0)
+    return {
+        'items': items,
+        'misses': stats.get('replay/miss', 0),
+        'elapsed_s': elapsed,
+        'items_per_s': items / elapsed if elapsed else 0.0,
+        'callbacks': {},
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def ensure_corpus(size, per_page, region, templates_path=None):
+    from benchmarks.corpus import build_corpus, load_templates
+
+    suffix = '-recorded' if templates_path else ''
+    path = os.path.join(CORPUS_DIR, f'products-{size}-{per_page}{suffix}.sqlite3')
+    if not os.path.exists(path):
+        templates = load_templates(templates_path) if templates_path else None
+        build_corpus(path + '.part', size, region, per_page, templates)
+        os.replace(path + '.part', path)
+    return path
+
+
+def _worker(args):
+    spider_args = {'mode': args.mode_arg} if args.mode_arg else {}
+    if args.mode == 'crawl':
+        result = run_crawl(args.corpus, spider_args, offload=args.offload)
+    else:
+        result = run_callbacks(args.corpus, spider_args)
+    json.dump(result, sys.stdout)
+
+
+def _print_table(results):
+    print(f"{'size':>8} {'items':>8} {'items/s':>10} {'rss MB':>8}  callbacks p50/p90/p99 ms")
+    for size, result in results.items():
+        callbacks = '; '.join(
+            f"{name} {c['p50_ms']:.3f}/{c['p90_ms']:.3f}/{c['p99_ms']:.3f}"
+            for name, c in result['callbacks'].items()
+        )
+        print(f"{size:>8} {result['items']:>8} {result['items_per_s']:>10.0f} "
+              f"{result['peak_rss_mb']:>8.1f}  {callbacks}")
+
+
+def _compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    failed = False
+    for size, result in results.items():
+        previous = baseline.get(size)
+        if not previous:
+            continue
+        if result['items_per_s'] < previous['items_per_s'] * (1 - tolerance):
+            print(f"REGRESSION size={size}: {result['items_per_s']:.0f} items/s "
+                  f"vs {previous['items_per_s']:.0f} in baseline")
+            failed = True
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--mode', choices=['callbacks', 'crawl'], default='callbacks')
+    parser.add_argument('--crawl-mode', dest='mode_arg', choices=['full', 'fast'],
+                        help='spider mode argument (full/fast)')
+    parser.add_argument('--offload', action='store_true',
+                        help='crawl mode: transform products in TransformPool (TRANSFORM_POOL_ENABLED)')
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--region', default='4a70f9e0-46ae-11e7-83ff-00155d026416')
+    parser.add_argument('--templates', help='recorded corpus (REPLAY_RECORD_PATH) to clone products from')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline results file; exit 1 on items/s regression')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return _worker(args)
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(',')]:
+        corpus_path = ensure_corpus(size, args.per_page, args.region, args.templates)
+        command = [sys.executable, '-m', 'benchmarks.bench_parse', '--worker',
+                   '--mode', args.mode, '--corpus', corpus_path]
+        if args.mode_arg:
+            command += ['--crawl-mode', args.mode_arg]
+        if args.offload:
+            command.append('--offload')
+        env = dict(os.environ, SCRAPY_SETTINGS_MODULE='alkoteka_parser.settings', PYTHONPATH=PROJECT_DIR)
+        output = subprocess.run(command, cwd=PROJECT_DIR, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        results[str(size)] = json.loads(output)
+
+    _print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare and _compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
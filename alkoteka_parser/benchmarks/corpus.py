@@ -0,0 +1,122 @@
+"""Синтетический корпус ответов web-api заданного размера.
+
+Карточки товаров клонируются из шаблонов: по умолчанию из SAMPLE_PRODUCT,
+либо из карточек, записанных ResponseRecorderMiddleware с реального сайта.
+"""
+import copy
+import json
+from urllib.parse import urlparse
+
+from alkoteka_parser.replay import Corpus
+
+BASE_URL = 'https://alkoteka.com'
+CATEGORIES = ['krepkiy-alkogol', 'slaboalkogolnye-napitki-2', 'vino']
+JSON_HEADERS = {'Content-Type': ['application/json']}
+HTML_HEADERS = {'Content-Type': ['text/html; charset=utf-8']}
+
+# Поля карточки, которых нет в ответе списка
+DETAIL_ONLY_FIELDS = ('description_blocks', 'text_blocks', 'vendor_code')
+
+SAMPLE_PRODUCT = {
+    'uuid': '00000000-0000-0000-0000-000000000000',
+    'slug': 'sample',
+    'name': 'Вино Шато Тамань Каберне',
+    'subname': 'Chateau Tamagne Cabernet',
+    'new': False,
+    'gift_package': False,
+    'price': 899,
+    'prev_price': 1099,
+    'available': True,
+    'quantity_total': 12,
+    'image_url': 'https://web.alkoteka.com/resize/350_500/product/sample.png',
+    'vendor_code': 123456,
+    'category': {'name': 'Вино красное', 'parent': {'name': 'Вино'}},
+    'filter_labels': [
+        {'filter': 'cvet', 'title': 'Красное'},
+        {'filter': 'obem', 'title': '0.75 Л'},
+        {'filter': 'tovary-so-skidkoi', 'title': 'Скидка'},
+    ],
+    'price_details': [{'title': 'Акция'}, {'title': 'Скидка'}],
+    'description_blocks': [
+        {'code': 'brend', 'title': 'Бренд', 'type': 'select',
+         'values': [{'name': 'Шато Тамань', 'enabled': True}]},
+        {'code': 'cvet', 'title': 'Цвет', 'type': 'select',
+         'values': [{'name': 'Красное', 'enabled': True}, {'name': 'Белое', 'enabled': False}]},
+        {'code': 'obem', 'title': 'Объем', 'type': 'select',
+         'values': [{'name': '0.75 Л', 'enabled': True}, {'name': '1.5 Л', 'enabled': True}]},
+        {'code': 'krepost', 'title': 'Крепость', 'type': 'range', 'unit': '%', 'min': 13, 'max': 13},
+        {'code': 'sahar', 'title': 'Сахар', 'type': 'select',
+         'values': [{'name': 'Сухое', 'enabled': True}]},
+    ],
+    'text_blocks': [
+        {'title': 'Описание', 'content': 'Насыщенное красное вино с ароматом спелой вишни.'},
+        {'title': 'Гастрономия', 'content': 'Подходит к мясу и твёрдым сырам.'},
+    ],
+}
+
+
+def load_templates(path):
+    """Карточки товаров из записанного корпуса."""
+    corpus = Corpus(path)
+    templates = []
+    try:
+        for url, status, headers, body in corpus.items():
+            parts = urlparse(url).path.rstrip('/').split('/')
+            if status == 200 and parts[-2:-1] == ['product']:
+                results = json.loads(body).get('results')
+                if results:
+                    templates.append(results)
+    finally:
+        corpus.close()
+    return templates
+
+
+def build_corpus(path, size, region, per_page, templates=None):
+    """Записывает в path корпус из size товаров, разложенных по CATEGORIES."""
+    templates = templates or [SAMPLE_PRODUCT]
+    corpus = Corpus(path)
+
+    for category in CATEGORIES:
+        corpus.add(f'{BASE_URL}/catalog/{category}', 200, HTML_HEADERS, b'<html><body></body></html>')
+
+    per_category = [size // len(CATEGORIES) + (1 if i < size % len(CATEGORIES) else 0)
+                    for i in range(len(CATEGORIES))]
+    number = 0
+    for category, count in zip(CATEGORIES, per_category):
+        last_page = max(1, -(-count // per_page))
+        for page in range(1, last_page + 1):
+            results = []
+            for _ in range(min(per_page, count - (page - 1) * per_page)):
+                product = _clone(templates[number % len(templates)], number)
+                corpus.add(
+                    f'{BASE_URL}/web-api/v1/product/{product["slug"]}?city_uuid={region}',
+                    200, JSON_HEADERS,
+                    json.dumps({'success': True, 'results': product}, ensure_ascii=False).encode('utf-8')
+                )
+                results.append({k: v for k, v in product.items() if k not in DETAIL_ONLY_FIELDS})
+                number += 1
+
+            body = {
+                'success': True,
+                'results': results,
+                'meta': {'current_page': page, 'last_page': last_page, 'per_page': per_page, 'total': count},
+            }
+            corpus.add(
+                f'{BASE_URL}/web-api/v1/product?city_uuid={region}&page={page}'
+                f'&per_page={per_page}&root_category_slug={category}',
+                200, JSON_HEADERS, json.dumps(body, ensure_ascii=False).encode('utf-8')
+            )
+        corpus.commit()
+
+    corpus.close()
+
+
+def _clone(template, number):
+    product = copy.deepcopy(template)
+    product['uuid'] = f'{number:08x}-0000-4000-8000-{number:012x}'
+    product['slug'] = f'{template.get("slug") or "product"}-{number}'
+    product['price'] = 100 + number % 5000
+    product['prev_price'] = product['price'] + number % 300 if number % 3 else None
+    product['available'] = number % 7 != 0
+    product['quantity_total'] = number % 50
+    return product
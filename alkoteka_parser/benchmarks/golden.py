@@ -0,0 +1,191 @@
+"""Проверка преобразования карточек по эталонным результатам.
+
+    python -m benchmarks.golden            # сравнить с benchmarks/golden/transform.jsonl
+    python -m benchmarks.golden --write    # перезаписать эталон текущим кодом
+
+Эталон содержит входные данные и ожидаемые записи (без timestamp): образец
+товара, граничные случаи (None вместо списков и значений, пропуски, повторы
+тегов) и набор случайных карточек с фиксированным seed. Эталон пишется один
+раз и меняется только вместе с намеренным изменением формата записи.
+Случаи, найденные после записи эталона, добавляются в конец, чтобы номера
+прежних не сдвигались. Тот же эталон проверяют тесты (tests/test_golden.py).
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+
+from benchmarks.corpus import SAMPLE_PRODUCT
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', 'transform.jsonl')
+RANDOM_CASES = 300
+
+
+def _edge_cases():
+    cases = [{'results': SAMPLE_PRODUCT}, {'results': None}, {}, {'results': {}}]
+
+    nulls = copy.deepcopy(SAMPLE_PRODUCT)
+    for key in ('filter_labels', 'price_details', 'description_blocks', 'text_blocks', 'category',
+                'name', 'price', 'prev_price', 'available', 'quantity_total', 'image_url', 'vendor_code'):
+        nulls[key] = None
+    cases.append({'results': nulls})
+
+    holes = copy.deepcopy(SAMPLE_PRODUCT)
+    holes['filter_labels'] = [None, {'filter': 'cvet'}, {'filter': 'cvet', 'title': 'Белое'}]
+    holes['price_details'] = [None, {'title': None}, {'title': 'Скидка'}, {'title': 'Скидка'}]
+    holes['text_blocks'] = [None, {'content': None}, {'title': 'x'}, {'content': 'Текст'}]
+    holes['description_blocks'] = [
+        None,
+        {'code': 'brend', 'values': []},
+        {'code': 'brend', 'values': [{'name': None}]},
+        {'code': 'brend', 'title': 'Бренд', 'type': 'select', 'values': [{'name': 'Второй', 'enabled': True}]},
+        {'title': None, 'type': 'select', 'values': [{'name': 'a', 'enabled': True}]},
+        {'code': 'cvet', 'title': 'Цвет', 'type': 'select', 'values': None},
+        {'code': 'cvet', 'title': 'Цвет', 'type': 'select', 'values': [None, {'name': 'a', 'enabled': 0}]},
+        {'code': 'obem', 'title': 'Объем', 'type': 'range', 'min': 1, 'max': 2},
+        {'code': 'krepost', 'title': 'Крепость', 'type': 'range', 'min': 5, 'max': None},
+        {'code': 'krepost', 'title': 'Крепость', 'type': 'range', 'unit': None, 'min': 5, 'max': 7},
+        {'code': 'x', 'title': '__description', 'type': 'select', 'values': [{'name': 'b', 'enabled': True}]},
+        {'code': 'y', 'title': 'Артикул', 'type': 'other'},
+    ]
+    cases.append({'results': holes})
+
+    titled = copy.deepcopy(SAMPLE_PRODUCT)
+    titled['name'] = ''
+    titled['subname'] = 'Красное 0.75 Л'
+    titled['new'] = True
+    titled['gift_package'] = 1
+    titled['price_details'] = [{'title': 'Новинка'}, {'title': 'Подарок'}, {'title': 'Акция'}]
+    titled['price'] = 'не число'
+    titled['prev_price'] = 'тоже'
+    titled['quantity_total'] = '5 шт'
+    cases.append({'results': titled})
+
+    prices = copy.deepcopy(SAMPLE_PRODUCT)
+    prices['price'] = '150.5'
+    prices['prev_price'] = 100
+    prices['available'] = False
+    cases.append({'results': prices})
+    return cases
+
+
+def _random_case(rng):
+    pick = rng.choice
+    titles = ['Акция', 'Скидка', 'Новинка', 'Подарок', 'Хит', None]
+    codes = ['brend', 'cvet', 'obem', 'krepost', 'sahar', 'strana']
+    product = {
+        'uuid': f'{rng.getrandbits(64):016x}',
+        'name': pick(['Вино', 'Виски Красное 0.5 Л', '', None]),
+        'subname': pick(['Sub', None]),
+        'new': pick([True, False, None]),
+        'gift_package': pick([True, False, None]),
+        'price': pick([100, 99.9, '120', None, 'x']),
+        'prev_price': pick([150, 100, None, '200', 50]),
+        'available': pick([True, False, None, 1]),
+        'quantity_total': pick([0, 3, None, '7']),
+        'image_url': pick(['https://img/1.png', '', None]),
+        'vendor_code': pick([1, '0042', None]),
+        'filter_labels': [
+            pick([None, {'filter': pick(['cvet', 'obem', 'tovary-so-skidkoi', 'other']), 'title': pick(titles + ['Красное', '0.5 Л'])}])
+            for _ in range(rng.randrange(5))
+        ],
+        'price_details': pick([None, [pick([None, {'title': pick(titles)}]) for _ in range(rng.randrange(4))]]),
+        'text_blocks': pick([None, [pick([None, {'content': pick(['a', 'b', None])}]) for _ in range(rng.randrange(3))]]),
+        'category': pick([None, {'name': 'Вино'}, {'name': 'Вино', 'parent': pick([None, {'name': 'Алкоголь'}])}]),
+    }
+    blocks = []
+    for _ in range(rng.randrange(6)):
+        code = pick(codes)
+        if rng.random() < 0.3:
+            block = {'code': code, 'title': pick([code.title(), None]), 'type': 'range',
+                     'unit': pick(['%', None]), 'min': pick([1, 2, None]), 'max': pick([1, 2, None])}
+        else:
+            block = {'code': code, 'title': pick([code.title(), None]), 'type': pick(['select', 'select', 'other']),
+                     'values': pick([None, [pick([None, {'name': pick(['a', 'b', None]), 'enabled': pick([True, False, None])}])
+                                            for _ in range(rng.randrange(1, 4))]])}
+        if code == 'brend' and block.get('values'):
+            # Пустой первый элемент значений бренда роняет преобразование и
+            # в старом, и в новом коде; в эталон такие карточки не берём
+            block['values'][0] = block['values'][0] or {'name': None}
+        blocks.append(pick([None, block, block]))
+    product['description_blocks'] = pick([None, blocks, blocks])
+    return {'results': product}
+
+
+def _regression_cases():
+    # Бренд в блоке range: характеристика из min/max остаётся в metadata
+    brand_range = copy.deepcopy(SAMPLE_PRODUCT)
+    brand_range['description_blocks'] = [
+        {'code': 'brend', 'title': 'Бренд', 'type': 'range', 'min': 1, 'max': 2},
+        {'code': 'brend', 'title': 'Производитель', 'type': 'range', 'unit': ' шт', 'min': 3, 'max': 3,
+         'values': [{'name': 'Из диапазона'}]},
+        {'code': 'brend', 'title': 'Марка', 'type': 'select', 'values': [{'name': 'Второй', 'enabled': True}]},
+    ]
+
+    # Нехешируемые заголовки тегов
+    unhashable = copy.deepcopy(SAMPLE_PRODUCT)
+    unhashable['price_details'] = [{'title': {'name': 'Акция'}}, {'title': ['Скидка']}, {'title': ['Скидка']}]
+    unhashable['filter_labels'] = [{'filter': 'tovary-so-skidkoi', 'title': {'name': 'Акция'}},
+                                   {'filter': 'tovary-so-skidkoi', 'title': ['Хит']}]
+    return [{'results': brand_range}, {'results': unhashable}]
+
+
+def build_cases():
+    rng = random.Random(20240501)
+    inputs = _edge_cases() + [_random_case(rng) for _ in range(RANDOM_CASES)] + _regression_cases()
+    return [(data, 'vino', f'slug-{number}') for number, data in enumerate(inputs)]
+
+
+def _strip(item):
+    return {key: value for key, value in (item or {}).items() if key != 'timestamp'}
+
+
+def run_transform(cases):
+    from alkoteka_parser.transform import ProductTransformer
+
+    return [_strip(item) for item in ProductTransformer().transform_many(cases)]
+
+
+def load_golden(path=GOLDEN_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def compare(golden):
+    """Номера случаев эталона, на которых результат отличается, и результаты."""
+    actual = run_transform([(g['input'], g['category'], g['slug']) for g in golden])
+    # Сравниваются сериализованные записи: важен и порядок ключей metadata
+    mismatches = [number for number, (g, item) in enumerate(zip(golden, actual))
+                  if json.dumps(item, ensure_ascii=False) != json.dumps(g['expected'], ensure_ascii=False)]
+    return mismatches, actual
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--write', action='store_true', help='overwrite the golden file')
+    args = parser.parse_args(argv)
+
+    if args.write:
+        cases = build_cases()
+        results = run_transform(cases)
+        os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            for (data, category, slug), expected in zip(cases, results):
+                record = {'input': data, 'category': category, 'slug': slug, 'expected': expected}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        print(f"Wrote {len(cases)} golden cases to {GOLDEN_PATH}")
+        return
+
+    golden = load_golden()
+    mismatches, actual = compare(golden)
+    for number in mismatches[:10]:
+        print(f"MISMATCH case {number}:\n  expected {golden[number]['expected']}\n  actual   {actual[number]}")
+    print(f"{len(golden) - len(mismatches)}/{len(golden)} golden cases match")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from scrapy.http import TextResponse
+from scrapy.utils.reactor import install_reactor
+from scrapy.utils.test import get_crawler
+
+# get_crawler() сверяет настройки с установленным реактором
+install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+
+
+@pytest.fixture
+def make_crawler():
+    """Краулер с настройками и статистикой и движком-заглушкой.
+
+    engine.crawl складывает запросы в engine.crawled, слоты загрузчика -
+    engine.downloader.slots.
+    """
+    def make(**settings):
+        crawler = get_crawler(settings_dict=settings)
+        crawler.engine = SimpleNamespace(crawled=[], downloader=SimpleNamespace(slots={}))
+        crawler.engine.crawl = crawler.engine.crawled.append
+        return crawler
+
+    return make
+
+
+def fake_spider(crawler, **attrs):
+    return SimpleNamespace(crawler=crawler, logger=SimpleNamespace(debug=lambda *a: None), **attrs)
+
+
+@pytest.fixture
+def make_spider(make_crawler):
+    """Паук на краулере make_crawler и его стартовые запросы.
+
+    С CATEGORY_SKIP_HTML стартовые запросы - первые страницы списков.
+    """
+    from alkoteka_parser.spiders.alkoteka import AlkotekaProductSpider
+
+    def make(settings=None, **spider_args):
+        settings = {'CATEGORY_SKIP_HTML': True, **(settings or {})}
+        crawler = make_crawler(**settings)
+        spider = AlkotekaProductSpider.from_crawler(crawler, **spider_args)
+        crawler.spider = spider
+        return spider, list(spider.start_requests())
+
+    return make
+
+
+def list_response(request, products, last_page=None):
+    """Ответ web-api со страницей списка products на запрос request."""
+    data = {'success': True, 'results': products}
+    if last_page is not None:
+        data['meta'] = {'current_page': request.meta['page'], 'last_page': last_page}
+    return TextResponse(request.url, body=json.dumps(data).encode('utf-8'), request=request)
+
+
+def list_products(count, start=0):
+    """Товары страницы списка: без полей, которые есть только в карточке."""
+    from benchmarks.corpus import DETAIL_ONLY_FIELDS, SAMPLE_PRODUCT
+
+    products = []
+    for number in range(start, start + count):
+        product = {k: v for k, v in SAMPLE_PRODUCT.items() if k not in DETAIL_ONLY_FIELDS}
+        product.update(uuid=f'uuid-{number}', slug=f'product-{number}')
+        products.append(product)
+    return products
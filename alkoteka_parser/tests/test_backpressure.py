@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy.exceptions import NotConfigured
+
+from alkoteka_parser import settings as project_settings
+from alkoteka_parser.backpressure import Backpressure, BackpressureExtension, get_backpressure
+from tests.conftest import list_products, list_response
+
+
+def test_backpressure_is_opt_in(make_crawler):
+    assert project_settings.BACKPRESSURE_ENABLED is False
+    with pytest.raises(NotConfigured):
+        BackpressureExtension(make_crawler())
+
+
+def test_limits_shrink_with_memory_budget(make_crawler):
+    state = Backpressure(make_crawler(
+        BACKPRESSURE_SCHEDULER_DEPTH=100, BACKPRESSURE_WRITER_HIGH_WATER=1000, BACKPRESSURE_MEMORY_MB=100,
+    ).settings)
+    mb = 1024 * 1024
+    state.update(50 * mb)
+    assert state.scheduler_depth == 100
+    state.update(85 * mb)
+    assert state.scheduler_depth == 55
+    state.update(120 * mb)
+    assert state.scheduler_depth == 10
+    assert state.writer_high_water == 100
+
+
+@pytest.fixture
+def extension(make_crawler):
+    """Расширение с движком-заглушкой и JSONL-пайплайном с pending_bytes."""
+    crawler = make_crawler(BACKPRESSURE_ENABLED=True, BACKPRESSURE_WRITER_HIGH_WATER=1000)
+    engine = crawler.engine
+    engine.paused = False
+    engine.pause = lambda: setattr(engine, 'paused', True)
+    engine.unpause = lambda: setattr(engine, 'paused', False)
+    writer = SimpleNamespace(pending_bytes=0)
+    engine.scraper = SimpleNamespace(itemproc=SimpleNamespace(middlewares=[object(), writer]))
+    ext = BackpressureExtension.from_crawler(crawler)
+    ext.spider_opened(None)
+    yield ext, writer
+    ext.spider_closed(None)
+
+
+def test_pauses_until_writer_drains(extension):
+    ext, writer = extension
+    engine = ext.crawler.engine
+    assert ext.writer is writer
+
+    writer.pending_bytes = 1500
+    ext._check()
+    assert engine.paused
+    assert ext.stats.get_value('backpressure/pauses') == 1
+
+    writer.pending_bytes = 800
+    ext._check()
+    assert engine.paused
+
+    writer.pending_bytes = 400
+    ext._check()
+    assert not engine.paused
+    assert ext.stats.get_value('backpressure/paused_seconds') is not None
+
+
+def test_close_resumes_paused_engine(extension):
+    ext, writer = extension
+    writer.pending_bytes = 1500
+    ext._check()
+    ext.spider_closed(None)
+    assert not ext.crawler.engine.paused
+    assert not ext._loop.running
+
+
+def test_spider_feeds_details_by_scheduler_depth(make_spider):
+    spider, (first_page,) = make_spider(
+        {'BACKPRESSURE_ENABLED': True, 'BACKPRESSURE_SCHEDULER_DEPTH': 4, 'BACKPRESSURE_PENDING_DETAILS': 5},
+        start_url='https://alkoteka.com/catalog/vino', region_uuid='r1', per_page='10',
+    )
+    assert spider.backpressure is get_backpressure(spider.crawler)
+
+    results = list(spider.parse_product_list(list_response(first_page, list_products(10), last_page=3)))
+    details = [r for r in results if r.meta['endpoint'] == 'detail']
+    # Карточек в работе не больше глубины, остальные ждут; страниц списка
+    # при 6 ждущих карточках больше 5 не запрашиваем
+    assert len(details) == 4
+    assert len(spider._pending_details) == 6
+    assert not [r for r in results if r.meta['endpoint'] == 'list']
+    assert spider.crawler.stats.get_value('backpressure/held_list_pages') == 2
+
+    # Карточки подкладываются, когда в работе остаётся половина глубины;
+    # отложенные страницы списка возвращаются, когда ждущих карточек не
+    # больше половины BACKPRESSURE_PENDING_DETAILS
+    batches = [spider._queued_requests(finished=1) for _ in range(4)]
+    assert [len(batch) for batch in batches] == [0, 2, 0, 4]
+    assert [r.meta['page'] for r in batches[3] if r.meta['endpoint'] == 'list'] == [2, 3]
+    assert len(spider._pending_details) == 2
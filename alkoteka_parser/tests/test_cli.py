@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+from alkoteka_parser.__main__ import build_settings, parse_settings, spider_args
+from benchmarks.corpus import build_corpus
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_settings_overrides_and_disabled_components():
+    settings = build_settings(parse_settings(['LOG_LEVEL=WARNING']))
+    assert settings['LOG_LEVEL'] == 'WARNING'
+    assert not settings.getbool('TELNETCONSOLE_ENABLED')
+    assert settings.getdict('DOWNLOADER_MIDDLEWARES')[
+        'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware'] is None
+
+
+def test_spider_args_from_job():
+    job = {'region': 'r1', 'start_url': ['https://a', 'https://b'], 'mode': 'fast', 'every': 60}
+    assert spider_args(job) == {'region_uuid': 'r1', 'start_url': 'https://a,https://b', 'mode': 'fast'}
+
+
+def test_run_job_against_replay_corpus(tmp_path):
+    corpus = str(tmp_path / 'corpus.sqlite3')
+    build_corpus(corpus, size=6, region='r1', per_page=2)
+    output = tmp_path / 'products.jsonl'
+    handler = json.dumps({'https': 'alkoteka_parser.replay.ReplayDownloadHandler'})
+
+    result = subprocess.run(
+        [sys.executable, '-m', 'alkoteka_parser', 'run', '--region', 'r1', '--mode', 'fast', '--per-page', '2',
+         '-s', f'REPLAY_PATH={corpus}', '-s', f'DOWNLOAD_HANDLERS={handler}',
+         '-s', f'PRODUCTS_JSONL_PATH={output}', '-s', 'LOG_LEVEL=WARNING'],
+        cwd=PROJECT_DIR, capture_output=True, text=True, timeout=120,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert len(output.read_text(encoding='utf-8').splitlines()) == 6
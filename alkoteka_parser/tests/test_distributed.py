@@ -0,0 +1,83 @@
+import json
+
+from alkoteka_parser.distributed import ShardQueue, merge
+
+
+def _queue(tmp_path, worker='w1', **kwargs):
+    return ShardQueue(str(tmp_path / 'queue.sqlite3'), worker=worker, **kwargs).open()
+
+
+def test_lease_gives_first_pages_first_and_only_once(tmp_path):
+    queue = _queue(tmp_path)
+    queue.seed(['r'], ['vino', 'pivo'], per_page=20)
+    queue.add_pages('r', 'vino', [3, 2])
+
+    leased = queue.lease(3)
+    assert [row[3] for row in leased] == [1, 1, 2]
+    assert [row[3] for row in queue.lease(10)] == [3]
+    assert queue.lease(10) == []
+    assert queue.get_meta('per_page') == '20'
+    queue.close()
+
+
+def test_fail_requeues_until_max_attempts(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+    queue.seed(['r'], ['vino'], per_page=20)
+
+    (shard_id, *_), = queue.lease(1)
+    queue.fail(shard_id)
+    assert queue.counts() == {'pending': 1}
+
+    assert queue.lease(1)[0][0] == shard_id
+    queue.fail(shard_id)
+    assert queue.counts() == {'failed': 1}
+    assert queue.finished()
+    queue.close()
+
+
+def test_expired_lease_goes_to_other_worker_with_claims_released(tmp_path):
+    first = _queue(tmp_path, worker='w1', lease_timeout=0.0)
+    first.seed(['r'], ['vino'], per_page=20)
+    (shard_id, *_), = first.lease(1)
+    assert first.claim(shard_id, 'r', ['a', 'b']) == ['a', 'b']
+
+    second = _queue(tmp_path, worker='w2', lease_timeout=0.0)
+    assert second.lease(1)[0][0] == shard_id
+    assert second.claim(shard_id, 'r', ['a']) == ['a']
+    second.complete(shard_id)
+    assert second.finished()
+    first.close()
+    second.close()
+
+
+def test_claim_skips_products_of_other_shards(tmp_path):
+    queue = _queue(tmp_path)
+    queue.seed(['r'], ['vino', 'pivo'], per_page=20)
+    (first, *_), (second, *_) = queue.lease(2)
+
+    assert queue.claim(first, 'r', ['a', 'b']) == ['a', 'b']
+    assert queue.claim(second, 'r', ['b', 'c']) == ['c']
+    assert queue.claim(first, 'r', ['a']) == ['a']
+    queue.close()
+
+
+def test_merge_deduplicates_and_skips_torn_lines(tmp_path):
+    first = tmp_path / 'w1.jsonl'
+    second = tmp_path / 'w2.jsonl'
+    first.write_bytes(
+        b'{"region": "r", "RPC": "1", "worker": 1}\n'
+        b'{"region": "r", "RPC": "2", "worker": 1}\n'
+    )
+    second.write_bytes(
+        b'{"region": "r", "RPC": "1", "worker": 2}\n'
+        b'{"region": "s", "RPC": "1", "worker": 2}\n'
+        b'{"region": "r", "RPC": "3"'
+    )
+    output = tmp_path / 'out' / 'products.jsonl'
+
+    assert merge([str(first), str(second)], str(output)) == 3
+    items = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [(item['region'], item['RPC'], item['worker']) for item in items] == [
+        ('r', '1', 1), ('r', '2', 1), ('s', '1', 2),
+    ]
+    assert not (tmp_path / 'out' / 'products.jsonl.part').exists()
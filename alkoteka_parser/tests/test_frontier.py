@@ -0,0 +1,66 @@
+from alkoteka_parser.frontier import Frontier
+
+
+def _open(tmp_path, scope='scope'):
+    return Frontier(str(tmp_path / 'frontier.sqlite3')).open(scope)
+
+
+def test_unfinished_crawl_with_same_scope_is_resumed(tmp_path):
+    frontier = _open(tmp_path)
+    assert not frontier.resumed
+    run_id = frontier.run_id
+    frontier.page_done('r', 'vino', 1, [('a', '1', False), ('b', '2', True)], next_page=2, last_page=3)
+    frontier.complete([('r', '1')])
+    frontier.close()
+
+    frontier = _open(tmp_path)
+    assert frontier.resumed
+    assert frontier.run_id == run_id
+    assert frontier.categories() == [('r', 'vino', 2, 3)]
+    assert frontier.done_pages('r', 'vino') == {1}
+    assert frontier.is_done('r', '1')
+    # Товар из списка, не дошедший до записи, теперь грузится карточкой
+    assert frontier.next_batch(10) == [('r', 'vino', 'b', '2')]
+    frontier.close()
+
+
+def test_other_scope_or_finished_crawl_starts_over(tmp_path):
+    frontier = _open(tmp_path)
+    frontier.page_done('r', 'vino', 1, [('a', '1', False)], next_page=2, last_page=3)
+    frontier.close()
+
+    frontier = _open(tmp_path, scope='other')
+    assert not frontier.resumed
+    assert frontier.categories() == []
+    assert frontier.pending_count() == 0
+    frontier.page_done('r', 'vino', 1, [('a', '1', False)], next_page=2, last_page=3)
+    frontier.finish()
+    frontier.close()
+
+    frontier = _open(tmp_path, scope='other')
+    assert not frontier.resumed
+    assert frontier.pending_count() == 0
+    frontier.close()
+
+
+def test_next_batch_walks_queue_by_cursor(tmp_path):
+    frontier = _open(tmp_path)
+    products = [(f'slug-{i}', str(i), False) for i in range(5)]
+    frontier.page_done('r', 'vino', 1, products, next_page=2, last_page=None)
+
+    assert [row[3] for row in frontier.next_batch(2)] == ['0', '1']
+    assert [row[3] for row in frontier.next_batch(2)] == ['2', '3']
+    assert [row[3] for row in frontier.next_batch(2)] == ['4']
+    assert frontier.next_batch(2) == []
+    frontier.close()
+
+
+def test_done_products_are_not_queued_again(tmp_path):
+    frontier = _open(tmp_path)
+    frontier.page_done('r', 'vino', 1, [('a', '1', False)], next_page=2, last_page=None)
+    frontier.complete([('r', '1')])
+    assert frontier.pending_count() == 0
+
+    frontier.page_done('r', 'vino', 2, [('a', '1', False)], next_page=3, last_page=None)
+    assert frontier.pending_count() == 0
+    frontier.close()
@@ -0,0 +1,10 @@
+from benchmarks.golden import compare, load_golden
+
+
+def test_transform_matches_golden_records():
+    golden = load_golden()
+    mismatches, actual = compare(golden)
+    assert not mismatches, (
+        f"{len(mismatches)} golden case(s) differ, first {mismatches[0]}: "
+        f"expected {golden[mismatches[0]]['expected']}, got {actual[mismatches[0]]}"
+    )
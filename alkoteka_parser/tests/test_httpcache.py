@@ -0,0 +1,55 @@
+import time
+from email.utils import formatdate
+
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+
+from alkoteka_parser.httpcache import EndpointTTLPolicy
+
+
+def _policy(**ttl):
+    return EndpointTTLPolicy(Settings({'HTTPCACHE_ENDPOINT_TTL': ttl}))
+
+
+def _request(endpoint=None):
+    meta = {'endpoint': endpoint} if endpoint else {}
+    return Request('https://alkoteka.com/web-api/v1/product', meta=meta)
+
+
+def _response(request, age, status=200, headers=None):
+    headers = {'Date': formatdate(time.time() - age, usegmt=True), **(headers or {})}
+    return Response(request.url, status=status, headers=headers, request=request)
+
+
+def test_detail_requests_bypass_cache():
+    policy = _policy()
+    assert not policy.should_cache_request(_request('detail'))
+    assert policy.should_cache_request(_request('list'))
+    assert policy.should_cache_request(_request('category'))
+
+
+def test_list_freshness_follows_endpoint_ttl():
+    policy = _policy()
+    request = _request('list')
+    assert policy.is_cached_response_fresh(_response(request, age=60), request)
+    assert not policy.is_cached_response_fresh(_response(request, age=1000), request)
+
+    request = _request('category')
+    assert policy.is_cached_response_fresh(_response(request, age=1000), request)
+
+
+def test_ttl_setting_overrides_defaults():
+    policy = _policy(list=30, detail=60)
+    request = _request('list')
+    assert not policy.is_cached_response_fresh(_response(request, age=60), request)
+    assert policy.should_cache_request(_request('detail'))
+
+
+def test_only_ok_responses_without_no_store_are_cached():
+    policy = _policy()
+    request = _request('list')
+    assert policy.should_cache_response(_response(request, age=0), request)
+    assert not policy.should_cache_response(_response(request, age=0, status=500), request)
+    assert not policy.should_cache_response(
+        _response(request, age=0, headers={'Cache-Control': 'no-store'}), request
+    )
@@ -0,0 +1,195 @@
+import json
+
+from scrapy.exceptions import DropItem
+from scrapy.utils.test import get_crawler
+
+from alkoteka_parser.incremental import FingerprintStore, item_fingerprint
+from alkoteka_parser.pipelines import IncrementalPipeline, get_outputs
+
+
+def test_fingerprint_ignores_timestamp():
+    item = {'RPC': '1', 'title': 'Вино', 'timestamp': 1}
+    assert item_fingerprint(item) == item_fingerprint({**item, 'timestamp': 2})
+    assert item_fingerprint(item) != item_fingerprint({**item, 'title': 'Пиво'})
+
+
+def test_check_reports_new_unchanged_changed(tmp_path):
+    store = FingerprintStore(str(tmp_path / 'store.sqlite3'))
+    store.open()
+    assert store.check('r', '1', 'a', 'scope') == 'new'
+    assert store.check('r', '1', 'a', 'scope') == 'unchanged'
+    assert store.check('r', '1', 'b', 'scope') == 'changed'
+    store.close()
+
+
+def test_new_fingerprints_wait_for_save(tmp_path):
+    path = str(tmp_path / 'store.sqlite3')
+    store = FingerprintStore(path)
+    store.open()
+    assert store.check('r', '1', 'a', 'scope') == 'new'
+    assert store.check('r', '2', 'a', 'scope') == 'new'
+    store.set_validators('https://alkoteka.com/1', 'r', '1', '"etag"', None)
+    store.close()
+
+    store.open()
+    assert store.check('r', '1', 'a', 'scope') == 'new'
+    assert store.get_validators('https://alkoteka.com/1') is None
+    store.set_validators('https://alkoteka.com/1', 'r', '1', '"etag"', None)
+    assert store.save() == 1
+    store.close()
+
+    store.open()
+    assert store.check('r', '1', 'a', 'scope') == 'unchanged'
+    assert store.check('r', '2', 'a', 'scope') == 'new'
+    assert store.get_validators('https://alkoteka.com/1') == ('r', '1', '"etag"', None)
+    store.close()
+
+
+def test_delisted_only_covers_unseen_products_of_crawled_regions_and_scope(tmp_path):
+    path = str(tmp_path / 'store.sqlite3')
+    store = FingerprintStore(path)
+    store.open()
+    store.check('r1', 'kept', 'a', 'scope')
+    store.check('r1', 'gone', 'a', 'scope')
+    store.check('r2', 'other-region', 'a', 'scope')
+    store.check('r1', 'other-scope', 'a', 'elsewhere')
+    store.save()
+    store.close()
+
+    store = FingerprintStore(path)
+    store.open()
+    store.run_id += 1
+    store.check('r1', 'kept', 'a', 'scope')
+    assert store.delisted(['r1'], 'scope') == [('r1', 'gone')]
+
+    store.forget([('r1', 'gone')])
+    assert store.delisted(['r1'], 'scope') == []
+    store.close()
+
+
+def test_touch_keeps_not_modified_product_listed(tmp_path):
+    path = str(tmp_path / 'store.sqlite3')
+    store = FingerprintStore(path)
+    store.open()
+    store.check('r', '1', 'a', 'scope')
+    store.save()
+    store.close()
+
+    store.open()
+    store.run_id += 1
+    store.touch('r', '1')
+    assert store.delisted(['r'], 'scope') == []
+    store.close()
+
+
+class _Spider:
+    start_urls = ['https://alkoteka.com/catalog/vino']
+    region_uuids = ['r1', 'r2']
+
+    def __init__(self, list_failures=()):
+        self.list_failures = set(list_failures)
+
+
+def _pipeline(tmp_path, writer=None):
+    crawler = get_crawler(settings_dict={
+        'INCREMENTAL_ENABLED': True,
+        'INCREMENTAL_STORE_PATH': str(tmp_path / 'store.sqlite3'),
+        'INCREMENTAL_TOMBSTONES_PATH': str(tmp_path / 'delisted.jsonl'),
+    })
+    if writer is not None:
+        get_outputs(crawler).register(writer)
+    return IncrementalPipeline.from_crawler(crawler)
+
+
+def _crawl(pipeline, spider, rpcs, region='r1'):
+    pipeline.open_spider(spider)
+    statuses = []
+    for rpc in rpcs:
+        try:
+            pipeline.process_item({'RPC': rpc, 'region': region}, spider)
+            statuses.append('emitted')
+        except DropItem:
+            statuses.append('dropped')
+    return statuses
+
+
+def _seed(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    spider = _Spider()
+    pipeline.open_spider(spider)
+    for region in ('r1', 'r2'):
+        pipeline.process_item({'RPC': 'old', 'region': region}, spider)
+    pipeline.spider_closed(spider, 'finished')
+
+
+def test_tombstones_written_after_finished_crawl(tmp_path):
+    _seed(tmp_path)
+    pipeline = _pipeline(tmp_path)
+    spider = _Spider()
+    pipeline.open_spider(spider)
+    pipeline.store.run_id += 1
+    pipeline.spider_closed(spider, 'finished')
+
+    lines = (tmp_path / 'delisted.jsonl').read_text(encoding='utf-8').splitlines()
+    assert sorted((record['region'], record['RPC']) for record in map(json.loads, lines)) == [
+        ('r1', 'old'), ('r2', 'old'),
+    ]
+
+
+def test_tombstones_skip_regions_with_failed_list_pages(tmp_path):
+    _seed(tmp_path)
+    pipeline = _pipeline(tmp_path)
+    spider = _Spider(list_failures=[('r1', 'vino')])
+    pipeline.open_spider(spider)
+    pipeline.store.run_id += 1
+    pipeline.spider_closed(spider, 'finished')
+
+    lines = (tmp_path / 'delisted.jsonl').read_text(encoding='utf-8').splitlines()
+    assert [(record['region'], record['RPC']) for record in map(json.loads, lines)] == [('r2', 'old')]
+    assert pipeline.stats.get_value('incremental/tombstones_skipped_regions') == 1
+
+
+def test_fingerprints_not_saved_when_output_is_not_committed(tmp_path):
+    writer = object()
+    pipeline = _pipeline(tmp_path, writer)
+    spider = _Spider()
+    assert _crawl(pipeline, spider, ['1']) == ['emitted']
+    pipeline.spider_closed(spider, 'finished')
+    pipeline.outputs.done(writer, committed=False)
+    assert pipeline.stats.get_value('incremental/discarded') == 1
+
+    # Товар не попал в вывод, поэтому в следующий раз он снова новый
+    pipeline = _pipeline(tmp_path)
+    assert _crawl(pipeline, spider, ['1']) == ['emitted']
+    pipeline.spider_closed(spider, 'finished')
+
+    pipeline = _pipeline(tmp_path)
+    assert _crawl(pipeline, spider, ['1']) == ['dropped']
+    pipeline.spider_closed(spider, 'finished')
+
+
+def test_fingerprints_not_saved_for_interrupted_crawl(tmp_path):
+    pipeline = _pipeline(tmp_path)
+    spider = _Spider()
+    _crawl(pipeline, spider, ['1'])
+    pipeline.spider_closed(spider, 'shutdown')
+
+    pipeline = _pipeline(tmp_path)
+    assert _crawl(pipeline, spider, ['1']) == ['emitted']
+    pipeline.spider_closed(spider, 'finished')
+
+
+def test_fingerprints_saved_after_writer_commits_later(tmp_path):
+    writer = object()
+    pipeline = _pipeline(tmp_path, writer)
+    spider = _Spider()
+    _crawl(pipeline, spider, ['1'])
+    pipeline.spider_closed(spider, 'finished')
+    assert pipeline.stats.get_value('incremental/saved') is None
+
+    pipeline.outputs.done(writer, committed=True)
+    assert pipeline.stats.get_value('incremental/saved') == 1
+
+    pipeline = _pipeline(tmp_path)
+    assert _crawl(pipeline, spider, ['1']) == ['dropped']
+    pipeline.spider_closed(spider, 'finished')
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from alkoteka_parser.jsoncodec import JsonCodec
+from alkoteka_parser.transform import ProductTransformer
+from benchmarks.corpus import SAMPLE_PRODUCT
+
+PRODUCT = json.dumps({'success': True, 'results': SAMPLE_PRODUCT}, ensure_ascii=False).encode('utf-8')
+
+
+def _codec(decoder, typed=True):
+    if decoder != 'json':
+        pytest.importorskip(decoder)
+    return JsonCodec(decoder=decoder, typed=typed)
+
+
+@pytest.mark.parametrize('decoder', ['json', 'orjson', 'msgspec'])
+def test_decoders_agree_on_product(decoder):
+    # Типизированный разбор пропускает поля, которые преобразование не читает
+    transform = ProductTransformer().transform
+    expected = transform(json.loads(PRODUCT), 'vino', 'sample', timestamp=1)
+    assert transform(_codec(decoder).decode_product(PRODUCT), 'vino', 'sample', timestamp=1) == expected
+
+
+@pytest.mark.parametrize('decoder', ['json', 'orjson', 'msgspec'])
+def test_dumps_keeps_non_ascii(decoder):
+    encoded = _codec(decoder).dumps({'name': 'Вино', 'price': 899})
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == {'name': 'Вино', 'price': 899}
+    assert 'Вино'.encode('utf-8') in encoded
+
+
+@pytest.mark.parametrize('decoder', ['orjson', 'msgspec'])
+def test_dumps_falls_back_for_big_integers(decoder):
+    assert json.loads(_codec(decoder).dumps({'id': 2 ** 70})) == {'id': 2 ** 70}
+
+
+def test_typed_decode_skips_unknown_fields():
+    body = json.dumps({'results': {'name': 'Вино', 'internal': [1, 2]}, 'debug': True}).encode('utf-8')
+    assert _codec('msgspec').decode_product(body) == {'results': {'name': 'Вино'}}
+    assert _codec('msgspec', typed=False).decode_product(body)['debug'] is True
+
+
+def test_typed_decode_falls_back_on_unexpected_shape():
+    # filter_labels по схеме - список; ответ не по схеме разбирается целиком
+    body = json.dumps({'results': {'name': 'Вино', 'filter_labels': {'cvet': 'Красное'}}}).encode('utf-8')
+    data = _codec('msgspec').decode_product(body)
+    assert data['results']['filter_labels'] == {'cvet': 'Красное'}
+
+    body = json.dumps({'results': 'not found', 'meta': {}}).encode('utf-8')
+    assert _codec('msgspec').decode_product_list(body) == {'results': 'not found', 'meta': {}}
+
+
+def test_unknown_decoder_is_rejected():
+    with pytest.raises(ValueError):
+        JsonCodec(decoder='ujson')
@@ -0,0 +1,148 @@
+import json
+
+import pytest
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from alkoteka_parser.pipelines import JsonLinesWriterPipeline, OutputCommits, ParquetExportPipeline
+from alkoteka_parser.transform import transform_product_data
+from benchmarks.corpus import SAMPLE_PRODUCT
+
+
+@pytest.fixture(autouse=True)
+def inline_threads(monkeypatch):
+    # Фоновые записи выполняются сразу, без пула потоков реактора
+    monkeypatch.setattr('alkoteka_parser.pipelines.threads.deferToThread',
+                        lambda f, *args: defer.maybeDeferred(f, *args))
+
+
+def _pipeline(tmp_path, **kwargs):
+    stats = MemoryStatsCollector(get_crawler())
+    return JsonLinesWriterPipeline(str(tmp_path / 'products.jsonl'), flush_interval=0, stats=stats, **kwargs)
+
+
+def _close(pipeline):
+    result = []
+    pipeline.close_spider(None).addBoth(result.append)
+    assert result == [None]
+
+
+def _outputs():
+    outputs = OutputCommits()
+    results = []
+    outputs.when_done(results.append)
+    # Колбэк, добавленный при пустом списке, вызывается сразу
+    assert results == [True]
+    results.clear()
+    return outputs, results
+
+
+def test_products_replace_output_on_close(tmp_path):
+    outputs, committed = _outputs()
+    pipeline = _pipeline(tmp_path, batch_items=2, outputs=outputs)
+    outputs.when_done(committed.append)
+    pipeline.open_spider(None)
+    for rpc in range(3):
+        pipeline.process_item({'RPC': str(rpc)}, None)
+    assert pipeline.stats.get_value('jsonl/lines_written') == 2
+    _close(pipeline)
+
+    lines = (tmp_path / 'products.jsonl').read_text(encoding='utf-8').splitlines()
+    assert [json.loads(line)['RPC'] for line in lines] == ['0', '1', '2']
+    assert not (tmp_path / 'products.jsonl.part').exists()
+    assert pipeline.pending_bytes == 0
+    assert committed == [True]
+
+
+def test_failed_write_keeps_previous_output(tmp_path, monkeypatch):
+    output = tmp_path / 'products.jsonl'
+    output.write_text('{"RPC": "old"}\n', encoding='utf-8')
+    outputs, committed = _outputs()
+    pipeline = _pipeline(tmp_path, batch_items=1, outputs=outputs)
+    outputs.when_done(committed.append)
+    pipeline.open_spider(None)
+
+    write_chunk = pipeline._write_chunk
+    calls = []
+
+    def failing_write(chunk):
+        calls.append(chunk)
+        if len(calls) == 1:
+            raise OSError('No space left on device')
+        return write_chunk(chunk)
+
+    monkeypatch.setattr(pipeline, '_write_chunk', failing_write)
+    pipeline.process_item({'RPC': '1'}, None)
+    pipeline.process_item({'RPC': '2'}, None)
+    _close(pipeline)
+
+    assert output.read_text(encoding='utf-8') == '{"RPC": "old"}\n'
+    assert (tmp_path / 'products.jsonl.part').exists()
+    assert pipeline.stats.get_value('jsonl/write_errors') == 1
+    assert pipeline.stats.get_value('jsonl/lines_written') == 1
+    assert pipeline.pending_bytes == 0
+    assert committed == [False]
+
+
+def _product(region, rpc, timestamp=1_700_000_000):
+    item = transform_product_data({'results': {**SAMPLE_PRODUCT, 'uuid': rpc}}, 'vino', 'sample')
+    item.update(region=region, timestamp=timestamp)
+    return item
+
+
+@pytest.fixture
+def parquet_pipeline(tmp_path):
+    pytest.importorskip('pyarrow')
+
+    def make(**kwargs):
+        stats = MemoryStatsCollector(get_crawler())
+        return ParquetExportPipeline(str(tmp_path / 'parquet'), stats=stats, **kwargs)
+
+    return make
+
+
+def test_parquet_partitions_by_region_and_date(tmp_path, parquet_pipeline):
+    import pyarrow.parquet
+
+    pipeline = parquet_pipeline(row_group_size=2)
+    for number in range(3):
+        pipeline.process_item(_product('r1', f'p{number}'), None)
+    pipeline.process_item(_product('r2', 'p9', timestamp=1_700_100_000), None)
+    _close(pipeline)
+
+    files = sorted(path.relative_to(tmp_path / 'parquet').parent.as_posix()
+                   for path in (tmp_path / 'parquet').rglob('*.parquet'))
+    assert files == ['region_uuid=r1/date=2023-11-14', 'region_uuid=r2/date=2023-11-16']
+
+    table = pyarrow.parquet.read_table(next((tmp_path / 'parquet' / 'region_uuid=r1').rglob('*.parquet')))
+    assert table.column('RPC').to_pylist() == ['p0', 'p1', 'p2']
+    assert table.column('price_current').to_pylist() == [899.0] * 3
+    assert not list((tmp_path / 'parquet').rglob('*.part'))
+    assert pipeline.stats.get_value('parquet/rows_written') == 4
+    assert pipeline.stats.get_value('parquet/files') == 2
+
+
+def test_parquet_failed_row_group_keeps_partition_unpublished(tmp_path, parquet_pipeline, monkeypatch):
+    outputs, committed = _outputs()
+    pipeline = parquet_pipeline(row_group_size=1, outputs=outputs)
+    outputs.when_done(committed.append)
+    write_rows = pipeline._write_rows
+
+    def failing_write(partition, rows):
+        write_rows(partition, rows)
+        if partition[0] == 'r1' and rows[0][1] == 'p1':
+            raise OSError('No space left on device')
+
+    monkeypatch.setattr(pipeline, '_write_rows', failing_write)
+    for rpc in ('p0', 'p1', 'p2'):
+        pipeline.process_item(_product('r1', rpc), None)
+    pipeline.process_item(_product('r2', 'p9'), None)
+    _close(pipeline)
+
+    assert not list((tmp_path / 'parquet' / 'region_uuid=r1').rglob('*.parquet'))
+    assert len(list((tmp_path / 'parquet' / 'region_uuid=r1').rglob('*.parquet.part'))) == 1
+    assert len(list((tmp_path / 'parquet' / 'region_uuid=r2').rglob('*.parquet'))) == 1
+    assert pipeline.stats.get_value('parquet/write_errors') == 1
+    assert pipeline.stats.get_value('parquet/files') == 1
+    assert committed == [False]
@@ -0,0 +1,59 @@
+from alkoteka_parser.priceindex import (
+    BACK_IN_STOCK, IN_STOCK, NEW_PROMO, OUT_OF_STOCK, PRICE_DROP, PRICE_RISE, PriceIndex,
+    price_events, product_key, tag_hash,
+)
+
+
+def test_save_merges_new_products_and_load_reads_them(tmp_path):
+    path = str(tmp_path / 'prices.bin')
+    index = PriceIndex()
+    keys = [product_key('r', str(rpc)) for rpc in range(100)]
+    for price, key in enumerate(keys):
+        index.set(key, float(price), price % 7, IN_STOCK)
+    index.save(path)
+
+    loaded = PriceIndex.load(path)
+    assert len(loaded) == 100
+    assert loaded.get(keys[42]) == (42.0, 0, IN_STOCK)
+
+    # Обновление товара из снимка и новый товар
+    loaded.set(keys[42], 40.0, 1, 0)
+    new_key = product_key('r', 'new')
+    loaded.set(new_key, 5.0, 0, IN_STOCK)
+    assert loaded.get(new_key) == (5.0, 0, IN_STOCK)
+    loaded.save(path)
+
+    reloaded = PriceIndex.load(path)
+    assert len(reloaded) == 101
+    assert reloaded.get(keys[42]) == (40.0, 1, 0)
+    assert reloaded.get(new_key) == (5.0, 0, IN_STOCK)
+    assert reloaded.get(product_key('r', 'missing')) is None
+    assert not (tmp_path / 'prices.bin.part').exists()
+
+
+def test_missing_empty_or_truncated_snapshot_starts_fresh(tmp_path):
+    path = tmp_path / 'prices.bin'
+    assert len(PriceIndex.load(str(path))) == 0
+
+    path.write_bytes(b'')
+    assert len(PriceIndex.load(str(path))) == 0
+
+    index = PriceIndex()
+    index.set(product_key('r', '1'), 1.0, 0, IN_STOCK)
+    index.save(str(path))
+    data = path.read_bytes()
+    for size in (5, len(data) - 1):
+        path.write_bytes(data[:size])
+        assert len(PriceIndex.load(str(path))) == 0
+
+    path.write_bytes(b'junk' + data[4:])
+    assert len(PriceIndex.load(str(path))) == 0
+
+
+def test_price_events():
+    assert price_events((100.0, 0, IN_STOCK), 100.0, '', True) == []
+    assert price_events((100.0, 0, IN_STOCK), 90.0, '', True) == [PRICE_DROP]
+    assert price_events((100.0, 0, IN_STOCK), 110.0, '', False) == [PRICE_RISE, OUT_OF_STOCK]
+    assert price_events((100.0, 0, 0), 100.0, '', True) == [BACK_IN_STOCK]
+    assert price_events((100.0, 0, IN_STOCK), 100.0, '-10%', True) == [NEW_PROMO]
+    assert price_events((100.0, tag_hash('-10%'), IN_STOCK), 100.0, '-10%', True) == []
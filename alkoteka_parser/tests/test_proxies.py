@@ -0,0 +1,102 @@
+import pytest
+from scrapy.http import Request, Response
+
+from alkoteka_parser.middlewares import ProxyPoolMiddleware
+from alkoteka_parser.proxies import ProxyManager
+from tests.conftest import fake_spider
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('alkoteka_parser.proxies.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_acquire_respects_max_per_proxy():
+    manager = ProxyManager(['p1'], max_per_proxy=2)
+    assert manager.acquire() == 'p1'
+    assert manager.acquire() == 'p1'
+    assert manager.acquire() is None
+
+    manager.release('p1', latency=0.1, status=200)
+    assert manager.acquire() == 'p1'
+
+
+@pytest.mark.parametrize('status', [403, 429])
+def test_ban_cools_proxy_down_with_growing_pause(clock, status):
+    manager = ProxyManager(['p1'], cooldown=30.0, max_cooldown=100.0)
+
+    for pause in (30.0, 60.0, 100.0):
+        assert manager.acquire() == 'p1'
+        manager.release('p1', status=status)
+        assert manager.acquire() is None
+        clock[0] += pause - 1
+        assert manager.acquire() is None
+        clock[0] += 1
+
+    snapshot = manager.snapshot()['p1']
+    assert snapshot['cooldowns'] == 3
+    assert snapshot[f'status_{status}'] == 3
+
+
+def test_success_resets_strikes(clock):
+    manager = ProxyManager(['p1'], cooldown=30.0)
+    manager.acquire()
+    manager.release('p1', status=429)
+    clock[0] += 30
+    manager.acquire()
+    manager.release('p1', status=200)
+    manager.acquire()
+    manager.release('p1', status=429)
+    clock[0] += 30
+    assert manager.acquire() == 'p1'
+
+
+def test_errors_cool_down_only_below_min_success_rate(clock):
+    manager = ProxyManager(['p1'], decay=0.5, min_success_rate=0.3)
+    manager.acquire()
+    manager.release('p1', error=True)
+    assert manager.acquire() == 'p1'
+    manager.release('p1', error=True)
+    assert manager.acquire() is None
+
+
+def test_release_wakes_waiters(monkeypatch):
+    manager = ProxyManager(['p1'], max_per_proxy=1)
+    monkeypatch.setattr(manager, '_schedule_wakeup', lambda: None)
+    manager.acquire()
+    woken = []
+    manager.wait().addCallback(woken.append)
+
+    manager.release('p1', status=200)
+    assert woken == [None]
+
+
+def test_cancel_does_not_count_request():
+    manager = ProxyManager(['p1'], max_per_proxy=1)
+    assert manager.acquire() == 'p1'
+    manager.cancel('p1')
+
+    snapshot = manager.snapshot()['p1']
+    assert snapshot['requests'] == 0
+    assert snapshot['in_flight'] == 0
+    assert snapshot['success_rate'] == 1.0
+    assert manager.acquire() == 'p1'
+
+
+def test_cached_response_does_not_count_towards_health(make_crawler):
+    crawler = make_crawler(PROXY_LIST=['http://p1'], PROXY_LIST_ENV=None, PROXY_MAX_CONCURRENCY=1)
+    middleware = ProxyPoolMiddleware(crawler)
+    spider = fake_spider(crawler, use_proxy=True)
+    request = Request('https://alkoteka.com/')
+    middleware.process_request(request, spider)
+    assert request.meta['proxy'] == 'http://p1'
+
+    middleware.process_response(request, Response(request.url, status=429, flags=['cached']), spider)
+    health = middleware.manager.snapshot()['http://p1']
+    assert health['requests'] == 0
+    assert health['in_flight'] == 0
+    assert not health['cooling_down']
+    assert crawler.stats.get_value('proxy/http://p1/requests') == 0
+    assert crawler.stats.get_value('proxy/cached_responses') == 1
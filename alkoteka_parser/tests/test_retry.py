@@ -0,0 +1,125 @@
+import pytest
+from scrapy import Spider
+from scrapy.core.scheduler import Scheduler
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Request, Response
+from twisted.internet import defer
+
+from alkoteka_parser.middlewares import BackoffRetryMiddleware, ProxyPoolMiddleware, RequestDeferred, get_parking
+from tests.conftest import fake_spider
+
+
+@pytest.fixture
+def retry(make_crawler, monkeypatch):
+    """Middleware повторов; паузы не идут по таймеру, их длины - в delays."""
+    def make(**settings):
+        crawler = make_crawler(**settings)
+        middleware = BackoffRetryMiddleware(crawler)
+        delays = []
+
+        def delay(seconds):
+            delays.append(seconds)
+            return defer.Deferred()
+
+        monkeypatch.setattr(middleware.parking, 'delay', delay)
+        return middleware, crawler, delays
+
+    return make
+
+
+def test_retry_is_parked_with_backoff_and_crawled_later(retry, monkeypatch):
+    middleware, crawler, delays = retry(RETRY_BACKOFF_BASE=2.0)
+    monkeypatch.setattr('alkoteka_parser.middlewares.random.uniform', lambda a, b: 0.0)
+    spider = fake_spider(crawler)
+    request = Request('https://alkoteka.com/', meta={'endpoint': 'list'})
+
+    with pytest.raises(RequestDeferred):
+        middleware.process_response(request, Response(request.url, status=503), spider)
+    assert delays == [2.0]
+    parking = get_parking(crawler)
+    assert len(parking) == 1
+    with pytest.raises(DontCloseSpider):
+        parking.spider_idle(spider)
+
+    until, = parking._waiting
+    until.callback(None)
+    retried, = crawler.engine.crawled
+    assert retried.meta['retry_times'] == 1
+    assert len(parking) == 0
+    assert crawler.stats.get_value('parked/retry') == 1
+
+
+def test_retry_after_sets_minimum_pause(retry):
+    middleware, crawler, delays = retry(RETRY_BACKOFF_MAX=60.0)
+    request = Request('https://alkoteka.com/')
+    response = Response(request.url, status=429, headers={'Retry-After': '30'})
+    with pytest.raises(RequestDeferred):
+        middleware.process_response(request, response, fake_spider(crawler))
+    assert delays[0] >= 30.0
+
+
+def test_endpoint_budget_and_permanent_codes(retry):
+    middleware, crawler, delays = retry(RETRY_ENDPOINT_TIMES={'detail': 0})
+    spider = fake_spider(crawler)
+    request = Request('https://alkoteka.com/', meta={'endpoint': 'detail'})
+    response = Response(request.url, status=503)
+    assert middleware.process_response(request, response, spider) is response
+
+    response = Response(request.url, status=404)
+    assert middleware.process_response(Request(request.url), response, spider) is response
+    assert delays == []
+    assert crawler.stats.get_value('retry/permanent/404') == 1
+    assert crawler.stats.get_value('retry/wasted') == 2
+
+
+def test_closing_spider_drops_parked_requests(retry):
+    middleware, crawler, _ = retry()
+    spider = fake_spider(crawler)
+    with pytest.raises(RequestDeferred):
+        middleware.process_response(Request('https://alkoteka.com/'),
+                                    Response('https://alkoteka.com/', status=503), spider)
+    get_parking(crawler).spider_closed(spider)
+    assert crawler.engine.crawled == []
+    assert len(get_parking(crawler)) == 0
+
+
+def test_request_parked_until_proxy_is_free(make_crawler, monkeypatch):
+    crawler = make_crawler(PROXY_LIST=['http://p1'], PROXY_LIST_ENV=None, PROXY_MAX_CONCURRENCY=1)
+    middleware = ProxyPoolMiddleware(crawler)
+    monkeypatch.setattr(middleware.manager, '_schedule_wakeup', lambda: None)
+    spider = fake_spider(crawler, use_proxy=True)
+    first = Request('https://alkoteka.com/1')
+    middleware.process_request(first, spider)
+
+    second = Request('https://alkoteka.com/2')
+    with pytest.raises(RequestDeferred):
+        middleware.process_request(second, spider)
+    assert crawler.engine.crawled == []
+
+    middleware.process_response(first, Response(first.url), spider)
+    assert [request.url for request in crawler.engine.crawled] == [second.url]
+    assert crawler.stats.get_value('parked/proxy') == 1
+
+
+def test_parked_request_passes_dupefilter(make_crawler, monkeypatch):
+    crawler = make_crawler(PROXY_LIST=['http://p1'], PROXY_LIST_ENV=None, PROXY_MAX_CONCURRENCY=1)
+    middleware = ProxyPoolMiddleware(crawler)
+    monkeypatch.setattr(middleware.manager, '_schedule_wakeup', lambda: None)
+    spider = Spider.from_crawler(crawler, 'alkoteka', use_proxy=True)
+    scheduler = Scheduler.from_crawler(crawler)
+    scheduler.open(spider)
+    crawler.engine.crawl = scheduler.enqueue_request
+
+    first = Request('https://alkoteka.com/1')
+    second = Request('https://alkoteka.com/2')
+    assert scheduler.enqueue_request(first)
+    assert scheduler.enqueue_request(second)
+    first, second = scheduler.next_request(), scheduler.next_request()
+
+    middleware.process_request(first, spider)
+    with pytest.raises(RequestDeferred):
+        middleware.process_request(second, spider)
+    middleware.process_response(first, Response(first.url), spider)
+
+    assert scheduler.next_request().url == second.url
+    assert not crawler.stats.get_value('dupefilter/filtered')
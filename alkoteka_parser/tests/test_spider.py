@@ -0,0 +1,126 @@
+from scrapy.http import Request
+from twisted.python.failure import Failure
+
+from tests.conftest import list_products, list_response
+
+VINO = 'https://alkoteka.com/catalog/vino'
+
+
+def _lists(results):
+    return [r.meta['page'] for r in results if isinstance(r, Request) and r.meta['endpoint'] == 'list']
+
+
+def _details(results):
+    return [r for r in results if isinstance(r, Request) and r.meta['endpoint'] == 'detail']
+
+
+def _failure(request):
+    try:
+        raise IOError('connection lost')
+    except IOError:
+        failure = Failure()
+    failure.request = request
+    return failure
+
+
+def test_first_page_opens_window_of_list_pages(make_spider):
+    spider, (first_page,) = make_spider(
+        {'PRODUCT_LIST_CONCURRENT_PAGES': 2}, start_url=VINO, region_uuid='r1', per_page='3',
+    )
+    assert first_page.meta['page'] == 1
+
+    results = list(spider.parse_product_list(list_response(first_page, list_products(3), last_page=5)))
+    assert len(_details(results)) == 3
+    assert _lists(results) == [2, 3]
+
+    # Каждая следующая страница сдвигает окно на одну
+    page_2 = [r for r in results if r.meta.get('page') == 2][0]
+    results = list(spider.parse_product_list(list_response(page_2, list_products(3, start=3), last_page=5)))
+    assert _lists(results) == [4]
+    assert [r.meta['slug'] for r in _details(results)] == ['product-3', 'product-4', 'product-5']
+
+
+def test_pages_without_meta_go_one_by_one(make_spider):
+    spider, (first_page,) = make_spider(start_url=VINO, region_uuid='r1', per_page='3')
+
+    results = list(spider.parse_product_list(list_response(first_page, list_products(3))))
+    assert _lists(results) == [2]
+
+    # Неполная страница - последняя
+    page_2 = [r for r in results if r.meta.get('page') == 2][0]
+    results = list(spider.parse_product_list(list_response(page_2, list_products(1, start=3))))
+    assert _lists(results) == []
+    assert len(_details(results)) == 1
+
+
+def test_failed_first_page_is_requested_again(make_spider):
+    spider, (first_page,) = make_spider(
+        {'PRODUCT_LIST_PAGE_ATTEMPTS': 2}, start_url=VINO, region_uuid='r1', per_page='3',
+    )
+
+    (retry,) = spider.handle_list_error(_failure(first_page))
+    assert retry.meta['page'] == 1
+    assert retry.meta['list_attempt'] == 2
+    assert retry.dont_filter
+
+    assert list(spider.handle_list_error(_failure(retry))) == []
+    assert spider.list_failures == {('r1', 'vino')}
+    assert spider.crawler.stats.get_value('product_list/failed_first_page') == 1
+
+
+def test_failed_page_frees_its_slot_in_window(make_spider):
+    spider, (first_page,) = make_spider(
+        {'PRODUCT_LIST_CONCURRENT_PAGES': 2}, start_url=VINO, region_uuid='r1', per_page='3',
+    )
+    results = list(spider.parse_product_list(list_response(first_page, list_products(3), last_page=5)))
+    page_2 = [r for r in results if r.meta.get('page') == 2][0]
+
+    assert _lists(spider.handle_list_error(_failure(page_2))) == [4]
+    assert spider.list_failures == {('r1', 'vino')}
+
+
+def test_fast_mode_builds_items_from_list(make_spider):
+    spider, (first_page,) = make_spider(start_url=VINO, region_uuid='r1', per_page='3', mode='fast')
+    products = list_products(3)
+    del products[1]['price']
+
+    results = list(spider.parse_product_list(list_response(first_page, products, last_page=1)))
+    items = [r for r in results if not isinstance(r, Request)]
+    assert [item['RPC'] for item in items] == ['uuid-0', 'uuid-2']
+    assert all(item['region'] == 'r1' for item in items)
+    # Без обязательного поля товар запрашивается карточкой
+    assert [r.meta['slug'] for r in _details(results)] == ['product-1']
+    assert spider.crawler.stats.get_value('list_only/items') == 2
+    assert spider.crawler.stats.get_value('list_only/detail_fallback') == 1
+
+
+def test_full_mode_requests_every_detail(make_spider):
+    spider, (first_page,) = make_spider(start_url=VINO, region_uuid='r1', per_page='3')
+    results = list(spider.parse_product_list(list_response(first_page, list_products(3), last_page=1)))
+    assert len(_details(results)) == 3
+    assert all(isinstance(r, Request) for r in results)
+
+
+def test_regions_from_argument_and_file(make_spider, tmp_path):
+    regions_file = tmp_path / 'regions.txt'
+    regions_file.write_text('r2  # Москва\n\n# выключен: r9\nr3\nr1\n', encoding='utf-8')
+
+    spider, requests = make_spider(start_url=VINO, region_uuid='r1, r2', regions_file=str(regions_file))
+    assert spider.region_uuids == ['r1', 'r2', 'r3']
+    assert [r.meta['region'] for r in requests] == ['r1', 'r2', 'r3']
+    assert [r.meta['download_slot'] for r in requests] == [
+        'alkoteka.com:r1', 'alkoteka.com:r2', 'alkoteka.com:r3',
+    ]
+
+
+def test_each_region_is_paginated_separately(make_spider):
+    spider, (page_r1, page_r2) = make_spider(start_url=VINO, region_uuid='r1,r2', per_page='3', mode='fast')
+
+    results = list(spider.parse_product_list(list_response(page_r1, list_products(3), last_page=2)))
+    assert _lists(results) == [2]
+    assert {r.meta['region'] for r in results if isinstance(r, Request)} == {'r1'}
+    assert {r['region'] for r in results if not isinstance(r, Request)} == {'r1'}
+
+    results = list(spider.parse_product_list(list_response(page_r2, list_products(3), last_page=1)))
+    assert _lists(results) == []
+    assert {r['region'] for r in results} == {'r2'}
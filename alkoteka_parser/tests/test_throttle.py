@@ -0,0 +1,96 @@
+import pytest
+from scrapy.core.downloader import Slot
+from scrapy.http import Request, Response
+
+from alkoteka_parser.middlewares import AdaptiveThrottleMiddleware, RequestDeferred
+
+
+@pytest.fixture
+def throttle(make_crawler):
+    """Регулятор и слот 's' с concurrency 8 и delay 1.0."""
+    def make(**settings):
+        crawler = make_crawler(ADAPTIVE_THROTTLE_ENABLED=True, ADAPTIVE_THROTTLE_SPLIT=False, **settings)
+        slot = crawler.engine.downloader.slots['s'] = Slot(8, 1.0, False)
+        return AdaptiveThrottleMiddleware(crawler), slot
+
+    return make
+
+
+def _request(latency=0.1):
+    return Request('https://alkoteka.com/', meta={'download_slot': 's', 'download_latency': latency})
+
+
+def test_success_decreases_delay_and_adds_concurrency(throttle):
+    middleware, slot = throttle(ADAPTIVE_THROTTLE_DELAY_STEP=0.25, ADAPTIVE_THROTTLE_INCREASE_EVERY=3)
+    for _ in range(3):
+        request = _request()
+        middleware.process_response(request, Response(request.url), None)
+    assert slot.delay == pytest.approx(0.25)
+    assert slot.concurrency == 9
+    assert middleware.stats.get_value('throttle/increase') == 1
+    assert middleware.stats.get_value('throttle/s/concurrency') == 9
+
+
+def test_concurrency_is_capped(throttle):
+    middleware, slot = throttle(ADAPTIVE_THROTTLE_MAX_CONCURRENCY=8, ADAPTIVE_THROTTLE_INCREASE_EVERY=1)
+    middleware._success(_request(), 0.1)
+    assert slot.concurrency == 8
+
+
+def test_latency_growth_stops_increase(throttle):
+    middleware, slot = throttle(ADAPTIVE_THROTTLE_INCREASE_EVERY=1)
+    middleware._success(_request(), 0.1)
+    assert slot.concurrency == 9
+    middleware._success(_request(), 1.0)
+    assert slot.concurrency == 9
+    assert slot.delay == pytest.approx(0.9)
+
+
+@pytest.mark.parametrize('status', [429, 403, 503])
+def test_backoff_halves_concurrency_and_doubles_delay(throttle, status):
+    middleware, slot = throttle()
+    request = _request()
+    middleware.process_response(request, Response(request.url, status=status), None)
+    assert slot.concurrency == 4
+    assert slot.delay == pytest.approx(2.0)
+    assert middleware.stats.get_value('throttle/backoff') == 1
+
+
+def test_backoff_respects_retry_after_and_limits(throttle):
+    middleware, slot = throttle(ADAPTIVE_THROTTLE_MAX_DELAY=30.0)
+    request = _request()
+    middleware.process_response(request, Response(request.url, status=429, headers={'Retry-After': '10'}), None)
+    assert slot.delay == pytest.approx(10.0)
+    for _ in range(5):
+        middleware._back_off(request, None)
+    assert slot.concurrency == 1
+    assert slot.delay == pytest.approx(30.0)
+
+
+def test_network_errors_back_off(throttle):
+    middleware, slot = throttle()
+    middleware.process_exception(_request(), TimeoutError(), None)
+    assert slot.concurrency == 4
+
+
+def test_cached_responses_are_ignored(throttle):
+    middleware, slot = throttle()
+    request = _request()
+    middleware.process_response(request, Response(request.url, status=429, flags=['cached']), None)
+    assert (slot.concurrency, slot.delay) == (8, 1.0)
+
+
+def test_parked_requests_are_ignored(throttle):
+    middleware, slot = throttle()
+    middleware.process_exception(_request(), RequestDeferred(), None)
+    assert (slot.concurrency, slot.delay) == (8, 1.0)
+
+
+def test_split_slot_per_endpoint_and_proxy(throttle):
+    middleware, _ = throttle()
+    middleware.split = True
+    request = Request('https://alkoteka.com/', meta={
+        'download_slot': 'alkoteka.com', 'endpoint': 'list', 'proxy': 'http://p1',
+    })
+    middleware.process_request(request, None)
+    assert request.meta['download_slot'] == 'alkoteka.com|list|http://p1'
@@ -0,0 +1,73 @@
+import json
+import queue
+
+import pytest
+from twisted.internet import reactor
+
+from alkoteka_parser import transform
+from alkoteka_parser.jsoncodec import JsonCodec
+from alkoteka_parser.transform import TransformError, TransformPool, decode_and_transform
+from benchmarks.corpus import SAMPLE_PRODUCT
+
+BODY = json.dumps({'success': True, 'results': SAMPLE_PRODUCT}, ensure_ascii=False).encode('utf-8')
+
+
+def _without_timestamp(item):
+    return {key: value for key, value in item.items() if key != 'timestamp'}
+
+
+def test_batch_keeps_going_after_bad_product(monkeypatch):
+    monkeypatch.setattr(transform, '_worker_codec', JsonCodec(decoder='json'))
+    (ok, item), (failed, error), (ok_again, _) = transform._transform_batch([
+        (BODY, 'r1', 'vino', 'sample'),
+        (b'{"results": ', 'r1', 'vino', 'broken'),
+        (BODY, 'r2', 'vino', 'sample'),
+    ])
+    assert ok and ok_again and not failed
+    assert error.startswith('JSONDecodeError')
+    assert item['region'] == 'r1'
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Пул из одного процесса; ответы из пула разбираются в потоке теста.
+
+    Реактор в тестах не запущен, поэтому callFromThread складывает вызовы в
+    очередь, а wait() выполняет их.
+    """
+    calls = queue.Queue()
+    monkeypatch.setattr(reactor, 'callFromThread', lambda f, *args: calls.put((f, args)))
+    pool = TransformPool(workers=1, batch_size=2, batch_delay=60, decoder='json')
+
+    def wait():
+        f, args = calls.get(timeout=60)
+        f(*args)
+
+    yield pool, wait
+    pool.close()
+
+
+def test_pool_transforms_like_parse_product(pool):
+    pool, wait = pool
+    results = []
+    first = pool.submit(BODY, 'r1', 'vino', 'sample')
+    first.addCallback(results.append)
+    # Первая карточка ждёт пачку, вторая её отправляет
+    assert pool._entries
+    failed = pool.submit(b'not json', 'r1', 'vino', 'broken')
+    failed.addErrback(results.append)
+    assert not pool._entries
+    wait()
+
+    expected = decode_and_transform(JsonCodec(decoder='json'), BODY, 'r1', 'vino', 'sample')
+    assert _without_timestamp(results[0]) == _without_timestamp(expected)
+    assert results[1].check(TransformError)
+
+
+def test_close_flushes_partial_batch(pool):
+    pool, wait = pool
+    results = []
+    pool.submit(BODY, 'r1', 'vino', 'sample').addCallback(results.append)
+    pool.close()
+    wait()
+    assert results[0]['region'] == 'r1'